@@ -0,0 +1,100 @@
+"""对比逐行 dict 与列式 BarBatch 的归一化+写库开销。
+
+用法: PYTHONPATH=src python benchmarks/bench_bar_batch.py [bar数量]
+"""
+
+from __future__ import annotations
+
+import sqlite3
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+
+from ib_history.bars import BarBatch
+from ib_history.storage import insert_bars
+
+
+@dataclass
+class FakeBarData:
+    date: datetime
+    open: float
+    high: float
+    low: float
+    close: float
+    volume: float
+    average: float
+    barCount: int
+
+
+def make_bars(count: int):
+    base = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    return [
+        FakeBarData(base + timedelta(minutes=i), 100.0, 101.0, 99.0, 100.5, 10.0, 100.2, 7)
+        for i in range(count)
+    ]
+
+
+def legacy_rows(bars):
+    """基线：重构前 IBAsyncClient 里的逐行循环。"""
+    rows = []
+    for bar_data in bars:
+        ts = bar_data.date
+        if isinstance(ts, datetime):
+            if ts.tzinfo is None:
+                ts = ts.replace(tzinfo=timezone.utc)
+            ts_utc = ts.astimezone(timezone.utc).isoformat()
+        else:
+            ts_utc = datetime.combine(ts, datetime.min.time(), tzinfo=timezone.utc).isoformat()
+        rows.append(
+            {
+                "ts_utc": ts_utc,
+                "open": bar_data.open,
+                "high": bar_data.high,
+                "low": bar_data.low,
+                "close": bar_data.close,
+                "volume": int(bar_data.volume),
+                "vwap": bar_data.average,
+                "trade_count": bar_data.barCount,
+            }
+        )
+    return rows
+
+
+def run_once(bars, normalize):
+    conn = sqlite3.connect(":memory:")
+    started = time.perf_counter()
+    rows = normalize(bars)
+    normalized = time.perf_counter()
+    insert_bars(conn, "BENCH", "1m", rows)
+    finished = time.perf_counter()
+    conn.close()
+    return normalized - started, finished - normalized
+
+
+def measure(label, bars, normalize, repeat=3):
+    best = min((run_once(bars, normalize) for _ in range(repeat)), key=sum)
+    # 内存单独测一轮，避免 tracemalloc 的开销污染计时
+    tracemalloc.start()
+    run_once(bars, normalize)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"{label:<6} normalize={best[0] * 1000:8.1f}ms insert={best[1] * 1000:8.1f}ms "
+        f"total={sum(best) * 1000:8.1f}ms peak_mem={peak / 1024 / 1024:7.1f}MiB"
+    )
+    return sum(best), peak
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    bars = make_bars(count)
+    print(f"bars={count}")
+    legacy_time, legacy_peak = measure("dict", bars, legacy_rows)
+    batch_time, batch_peak = measure("batch", bars, BarBatch.from_bar_data)
+    print(f"speedup={legacy_time / batch_time:.2f}x mem_ratio={legacy_peak / batch_peak:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""基于 FakeIBClient 的 fetch_history 端到端吞吐基准。
+
+用法: PYTHONPATH=src python benchmarks/bench_fetch.py [--latency 0.05] [--json out.json]
+矩阵为 symbols × bars × 区间长度，每格输出 requests/s、rows/s、峰值内存与总耗时。
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from ib_history.fake_client import FakeIBClient
+from ib_history.fetcher import fetch_history
+from ib_history.pacing import PacingLimiter
+
+SYMBOL_SETS = (("MNQ",), ("MNQ", "MGC"))
+BAR_SETS = (("1m",), ("3m", "15m", "1h"))
+RANGE_DAYS = (7, 90)
+END = datetime(2024, 6, 1)
+
+
+def run_case(symbols, bars, days, latency, pacing, violation_every):
+    client = FakeIBClient(latency=latency, pacing_violation_every=violation_every)
+    with tempfile.TemporaryDirectory() as tmp:
+        tracemalloc.start()
+        started = time.perf_counter()
+        report = fetch_history(
+            symbols=list(symbols),
+            bars=list(bars),
+            start=END - timedelta(days=days),
+            end=END,
+            db_path=str(Path(tmp) / "bench.sqlite"),
+            client=client,
+            # 默认不限速，只测本地管线；--pacing 时恢复 IB 的 10 分钟 60 次窗口
+            pacer=PacingLimiter(min_interval=pacing, max_requests=60 if pacing else 10**9),
+        )
+        wall = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return {
+        "symbols": ",".join(symbols),
+        "bars": ",".join(bars),
+        "days": days,
+        "requests": client.requests,
+        "rows": report.success_count,
+        "failures": len(report.failures),
+        "wall_seconds": round(wall, 3),
+        "requests_per_second": round(client.requests / wall, 2),
+        "rows_per_second": round(report.success_count / wall, 1),
+        "peak_mem_mib": round(peak / 1024 / 1024, 2),
+        "phase_seconds": report.metrics["phase_seconds"],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=0.0, help="每个请求的模拟 IB 延迟（秒）")
+    parser.add_argument("--pacing", type=float, default=0.0, help="请求最小间隔（秒）")
+    parser.add_argument("--violation-every", type=int, default=0, help="每 N 次请求注入一次限速错误")
+    parser.add_argument("--json", default=None, help="把结果写入 JSON 文件，便于对比回归")
+    args = parser.parse_args()
+
+    results = []
+    print(
+        f"{'symbols':<9} {'bars':<12} {'days':>4} {'req':>5} {'rows':>8} "
+        f"{'req/s':>8} {'rows/s':>10} {'MiB':>7} {'wall':>7}"
+    )
+    for symbols in SYMBOL_SETS:
+        for bars in BAR_SETS:
+            for days in RANGE_DAYS:
+                r = run_case(symbols, bars, days, args.latency, args.pacing, args.violation_every)
+                results.append(r)
+                print(
+                    f"{r['symbols']:<9} {r['bars']:<12} {r['days']:>4} {r['requests']:>5} "
+                    f"{r['rows']:>8} {r['requests_per_second']:>8} {r['rows_per_second']:>10} "
+                    f"{r['peak_mem_mib']:>7} {r['wall_seconds']:>7}"
+                )
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
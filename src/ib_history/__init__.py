@@ -1,9 +1,18 @@
 """IBKR MNQ/MGC 历史K线获取工具库。"""
 
 from .config import Config, default_config
-from .fetcher import fetch_history
+
 __all__ = [
     "Config",
     "default_config",
     "fetch_history",
 ]
+
+
+def __getattr__(name: str):
+    # fetcher 会带入 numpy 与 IB 客户端，首次访问时才导入，import ib_history.cli 保持轻量
+    if name == "fetch_history":
+        from .fetcher import fetch_history
+
+        return fetch_history
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,437 @@
+from __future__ import annotations
+
+import sqlite3
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from .bars import BAR_DTYPE, BarBatch, bar_seconds, ts_utc_text
+from .config import Config, default_config
+from .reader import read_bar_chunks
+from .sessions import local_to_utc, session_bounds, session_day, session_open_mask
+from .storage import (
+    BAR_COLUMNS,
+    DEFAULT_WHAT_TO_SHOW,
+    bars_table,
+    change_log_seq,
+    enable_change_log,
+    prune_change_log,
+)
+
+# 聚合层只从全时段 1m K线计算，RTH 与全时段视图来自同一次下载
+SOURCE_BAR = "1m"
+SCOPES = ("full", "rth")
+DEFAULT_RTH_CT = ("08:30", "15:00")
+_DAY = 86400
+
+
+@dataclass
+class AggregateResult:
+    """一次聚合更新：重算的交易日数与各 RTH 视图写入的行数。"""
+
+    symbol: str
+    what_to_show: str
+    sessions: int = 0
+    rebuilt: bool = False
+    from_seq: int = 0
+    to_seq: int = 0
+    rth_rows: Dict[str, int] = field(default_factory=dict)
+
+
+def rth_table(symbol: str, bar: str, what_to_show: str = DEFAULT_WHAT_TO_SHOW) -> str:
+    """RTH 视图与原始K线表同构，只把前缀换成 rth_，如 rth_MNQ_5m。"""
+    return "rth_" + bars_table(symbol, bar, what_to_show)[len("bars_") :]
+
+
+def create_aggregate_tables(conn: sqlite3.Connection) -> None:
+    """session_bars 每个交易日、每个口径（full / rth）一行；session_profile 为按价格分桶的成交量分布。
+
+    aggregate_state 记录每个序列已处理到的 bar_changes 序号，之后只重算有变更的交易日。
+    """
+    enable_change_log(conn)
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS session_bars (
+            symbol TEXT NOT NULL,
+            what_to_show TEXT NOT NULL,
+            scope TEXT NOT NULL,
+            session_date TEXT NOT NULL,
+            first_ts_utc TEXT NOT NULL,
+            last_ts_utc TEXT NOT NULL,
+            open REAL,
+            high REAL,
+            low REAL,
+            close REAL,
+            volume INTEGER,
+            vwap REAL,
+            trade_count INTEGER,
+            bars INTEGER NOT NULL,
+            expected_bars INTEGER NOT NULL,
+            or_high REAL,
+            or_low REAL,
+            poc REAL,
+            PRIMARY KEY (symbol, what_to_show, scope, session_date)
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS session_profile (
+            symbol TEXT NOT NULL,
+            what_to_show TEXT NOT NULL,
+            scope TEXT NOT NULL,
+            session_date TEXT NOT NULL,
+            price REAL NOT NULL,
+            volume REAL NOT NULL,
+            PRIMARY KEY (symbol, what_to_show, scope, session_date, price)
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS aggregate_state (
+            symbol TEXT NOT NULL,
+            what_to_show TEXT NOT NULL,
+            last_seq INTEGER NOT NULL,
+            updated_at TEXT NOT NULL,
+            PRIMARY KEY (symbol, what_to_show)
+        )
+        """
+    )
+
+
+def _create_rth_table(conn: sqlite3.Connection, table: str) -> None:
+    # 派生数据不登记到 bar_tables、不挂变更触发器，不参与同步，需要时在目标库重算
+    conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            ts_utc TEXT PRIMARY KEY,
+            open REAL,
+            high REAL,
+            low REAL,
+            close REAL,
+            volume INTEGER,
+            vwap REAL,
+            trade_count INTEGER
+        )
+        """
+    )
+
+
+def _day_text(day: int) -> str:
+    return str(np.datetime64(day, "D"))
+
+
+def _minutes(text: str) -> int:
+    hour, minute = text.split(":")
+    return int(hour) * 60 + int(minute)
+
+
+def rth_bounds(symbol: str, day: int, config: Config) -> Tuple[int, int]:
+    """交易日 day 的常规交易时段 [开盘, 收盘)，UTC epoch 秒。"""
+    start, end = config.rth_hours_ct.get(symbol.upper(), DEFAULT_RTH_CT)
+    local = np.array([day * _DAY + _minutes(start) * 60, day * _DAY + _minutes(end) * 60], dtype=np.int64)
+    bounds = local_to_utc(local)
+    return int(bounds[0]), int(bounds[1])
+
+
+def _concat(first: BarBatch, second: BarBatch) -> BarBatch:
+    return BarBatch(ts=np.concatenate([first.ts, second.ts]), values=np.concatenate([first.values, second.values]))
+
+
+def _take(batch: BarBatch, keep) -> BarBatch:
+    return BarBatch(ts=batch.ts[keep], values=batch.values[keep])
+
+
+def _session_batches(batches: Iterable[BarBatch]) -> Iterator[Tuple[int, BarBatch]]:
+    """把按时间排序的分块切成交易日，跨块的交易日拼接完整后再产出。"""
+    carry = BarBatch.empty()
+    for batch in batches:
+        if len(carry):
+            batch = _concat(carry, batch)
+        if not len(batch):
+            continue
+        days = session_day(batch.ts)
+        cuts = np.flatnonzero(np.diff(days)) + 1
+        starts = np.r_[0, cuts]
+        for begin, end in zip(starts[:-1], cuts):
+            yield int(days[begin]), _take(batch, slice(begin, end))
+        carry = _take(batch, slice(int(starts[-1]), None))
+    if len(carry):
+        yield int(session_day(carry.ts[:1])[0]), carry
+
+
+def _volume_profile(part: BarBatch, bucket: float) -> Tuple[np.ndarray, np.ndarray]:
+    """每根K线的成交量平均摊到 [low, high] 覆盖的价格桶上。"""
+    values = part.values
+    valid = np.isfinite(values["low"]) & np.isfinite(values["high"]) & (values["volume"] > 0)
+    if not valid.any():
+        return np.empty(0), np.empty(0)
+    low = np.floor(values["low"][valid] / bucket).astype(np.int64)
+    high = np.floor(values["high"][valid] / bucket).astype(np.int64)
+    span = np.maximum(high - low, 0) + 1
+    base = low.min()
+    offsets = np.arange(int(span.sum())) - np.repeat(np.cumsum(span) - span, span)
+    buckets = np.repeat(low - base, span) + offsets
+    weights = np.repeat(values["volume"][valid] / span, span)
+    totals = np.bincount(buckets, weights=weights)
+    keep = totals > 0
+    return ((np.arange(len(totals)) + base) * bucket)[keep], totals[keep]
+
+
+def _summarize(part: BarBatch, scope_open: int, scope_close: int, config: Config, bucket: float):
+    values = part.values
+    volume = values["volume"]
+    weighted = np.isfinite(values["vwap"]) & (volume > 0)
+    total = int(volume.sum())
+    vwap = (
+        float((values["vwap"][weighted] * volume[weighted]).sum() / volume[weighted].sum())
+        if weighted.any()
+        else None
+    )
+    opening = part.ts < scope_open + config.opening_range_minutes * 60
+    prices, profile = _volume_profile(part, bucket)
+    expected = int(session_open_mask(np.arange(scope_open, scope_close, 60, dtype=np.int64), 60).sum())
+    row = (
+        ts_utc_text(part.ts[:1])[0],
+        ts_utc_text(part.ts[-1:])[0],
+        float(values["open"][0]),
+        float(np.nanmax(values["high"])),
+        float(np.nanmin(values["low"])),
+        float(values["close"][-1]),
+        total,
+        vwap,
+        int(values["trade_count"].sum()),
+        len(part),
+        expected,
+        float(np.nanmax(values["high"][opening])) if opening.any() else None,
+        float(np.nanmin(values["low"][opening])) if opening.any() else None,
+        float(prices[np.argmax(profile)]) if len(profile) else None,
+    )
+    return row, list(zip(prices.tolist(), profile.tolist()))
+
+
+def _resample(part: BarBatch, origin: int, step: int) -> BarBatch:
+    """以 origin（RTH 开盘）为起点按 step 秒分组，周期起点对齐开盘时间，与 IB 的 RTH K线一致。"""
+    if step == bar_seconds(SOURCE_BAR):
+        return part
+    group = (part.ts - origin) // step
+    starts = np.r_[0, np.flatnonzero(np.diff(group)) + 1]
+    ends = np.r_[starts[1:], len(part)] - 1
+    src = part.values
+    values = np.empty(len(starts), dtype=src.dtype)
+    values["open"] = src["open"][starts]
+    values["close"] = src["close"][ends]
+    values["high"] = np.fmax.reduceat(src["high"], starts)
+    values["low"] = np.fmin.reduceat(src["low"], starts)
+    values["volume"] = np.add.reduceat(src["volume"], starts)
+    values["trade_count"] = np.add.reduceat(src["trade_count"], starts)
+    notional = np.add.reduceat(np.nan_to_num(src["vwap"]) * src["volume"], starts)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        values["vwap"] = np.where(values["volume"] > 0, notional / values["volume"], values["close"])
+    return BarBatch(ts=origin + group[starts] * step, values=values)
+
+
+def _write_session(
+    conn: sqlite3.Connection,
+    symbol: str,
+    what: str,
+    day: int,
+    batch: BarBatch,
+    config: Config,
+    result: AggregateResult,
+) -> None:
+    date_text = _day_text(day)
+    bucket = config.profile_bucket_size.get(symbol, 1.0)
+    conn.execute(
+        "DELETE FROM session_bars WHERE symbol = ? AND what_to_show = ? AND session_date = ?",
+        (symbol, what, date_text),
+    )
+    conn.execute(
+        "DELETE FROM session_profile WHERE symbol = ? AND what_to_show = ? AND session_date = ?",
+        (symbol, what, date_text),
+    )
+    full_open, full_close = (int(bound[0]) for bound in session_bounds(np.array([day])))
+    rth_open, rth_close = rth_bounds(symbol, day, config)
+    rth = _take(batch, (batch.ts >= rth_open) & (batch.ts < rth_close))
+    for scope, part, scope_open, scope_close in (
+        ("full", batch, full_open, full_close),
+        ("rth", rth, rth_open, rth_close),
+    ):
+        if not len(part):
+            continue
+        row, profile = _summarize(part, scope_open, scope_close, config, bucket)
+        conn.execute(
+            f"INSERT INTO session_bars VALUES ({', '.join('?' * (4 + len(row)))})",
+            (symbol, what, scope, date_text, *row),
+        )
+        conn.executemany(
+            "INSERT INTO session_profile VALUES (?, ?, ?, ?, ?, ?)",
+            [(symbol, what, scope, date_text, price, volume) for price, volume in profile],
+        )
+    window = ts_utc_text(np.array([rth_open, rth_close], dtype=np.int64)).tolist()
+    for bar in config.aggregate_rth_bars:
+        table = rth_table(symbol, bar, what)
+        conn.execute(f"DELETE FROM {table} WHERE ts_utc >= ? AND ts_utc < ?", window)
+        if not len(rth):
+            continue
+        view = _resample(rth, rth_open, bar_seconds(bar))
+        conn.executemany(f"INSERT INTO {table} VALUES (?, ?, ?, ?, ?, ?, ?, ?)", view.to_records())
+        result.rth_rows[bar] = result.rth_rows.get(bar, 0) + len(view)
+    result.sessions += 1
+
+
+def _changed_days(conn: sqlite3.Connection, source: str, since: int, until: int) -> List[int]:
+    rows = conn.execute(
+        "SELECT DISTINCT CAST(strftime('%s', ts_utc) AS INTEGER) FROM bar_changes "
+        "WHERE table_name = ? AND seq > ? AND seq <= ?",
+        (source, since, until),
+    ).fetchall()
+    if not rows:
+        return []
+    return sorted(set(session_day(np.array([row[0] for row in rows], dtype=np.int64)).tolist()))
+
+
+def _day_runs(days: List[int], max_gap: int = 3) -> Iterator[List[int]]:
+    """相近的交易日合并成一次区间读取（跨周末也算相近）。"""
+    run: List[int] = []
+    for day in days:
+        if run and day - run[-1] > max_gap:
+            yield run
+            run = []
+        run.append(day)
+    if run:
+        yield run
+
+
+def update_aggregates(
+    conn: sqlite3.Connection,
+    symbol: str,
+    what_to_show: str = DEFAULT_WHAT_TO_SHOW,
+    config: Optional[Config] = None,
+    rebuild: bool = False,
+) -> AggregateResult:
+    """按变更记录增量刷新某品种的交易日统计、成交量分布和 RTH 视图。
+
+    第一次运行、rebuild，或变更记录已被清理到上次水位之后时整表重建；
+    否则只重算上次之后有新增或改写K线的交易日。
+    """
+    cfg = config or default_config()
+    symbol, what = symbol.upper(), what_to_show.upper()
+    create_aggregate_tables(conn)
+    source = bars_table(symbol, SOURCE_BAR, what)
+    row = conn.execute(
+        "SELECT last_seq FROM aggregate_state WHERE symbol = ? AND what_to_show = ?", (symbol, what)
+    ).fetchone()
+    last_seq = row[0] if row else 0
+    until = change_log_seq(conn)
+    first = conn.execute("SELECT MIN(seq) FROM bar_changes").fetchone()[0]
+    pruned = until > last_seq and (first is None or first > last_seq + 1)
+    result = AggregateResult(
+        symbol=symbol, what_to_show=what, rebuilt=row is None or rebuild or pruned, from_seq=last_seq, to_seq=until
+    )
+
+    if result.rebuilt:
+        conn.execute("DELETE FROM session_bars WHERE symbol = ? AND what_to_show = ?", (symbol, what))
+        conn.execute("DELETE FROM session_profile WHERE symbol = ? AND what_to_show = ?", (symbol, what))
+        for bar in cfg.aggregate_rth_bars:
+            conn.execute(f"DROP TABLE IF EXISTS {rth_table(symbol, bar, what)}")
+    for bar in cfg.aggregate_rth_bars:
+        _create_rth_table(conn, rth_table(symbol, bar, what))
+
+    if result.rebuilt:
+        sessions = _session_batches(read_bar_chunks(conn, symbol, SOURCE_BAR, what))
+        for day, batch in sessions:
+            _write_session(conn, symbol, what, day, batch, cfg, result)
+    else:
+        days = _changed_days(conn, source, last_seq, until)
+        for run in _day_runs(days):
+            start = session_bounds(np.array([run[0]]))[0]
+            end = session_bounds(np.array([run[-1]]))[1]
+            window = ts_utc_text(np.concatenate([start, end])).tolist()
+            chunks = read_bar_chunks(conn, symbol, SOURCE_BAR, what, start_utc=window[0], end_utc=window[1])
+            wanted = set(run)
+            for day, batch in _session_batches(chunks):
+                if day in wanted:
+                    _write_session(conn, symbol, what, day, batch, cfg, result)
+
+    conn.execute(
+        "INSERT OR REPLACE INTO aggregate_state (symbol, what_to_show, last_seq, updated_at) VALUES (?, ?, ?, ?)",
+        (symbol, what, until, datetime.utcnow().isoformat()),
+    )
+    # 只做聚合、不同步的库没有人跑 sync prune：处理过的变更记录顺手清掉（不越过各 sync 对端的进度）
+    prune_change_log(conn)
+    conn.commit()
+    return result
+
+
+def read_session_bars(
+    conn: sqlite3.Connection,
+    symbol: str,
+    scope: str = "full",
+    what_to_show: str = DEFAULT_WHAT_TO_SHOW,
+) -> BarBatch:
+    """按交易日聚合的日K线，ts 为交易日当天 0 点 UTC（与 IB 日线的日期含义一致）。"""
+    if scope not in SCOPES:
+        raise ValueError(f"不支持的口径: {scope}")
+    rows = conn.execute(
+        f"SELECT CAST(strftime('%s', session_date) AS INTEGER), {', '.join(BAR_COLUMNS)} FROM session_bars "
+        "WHERE symbol = ? AND what_to_show = ? AND scope = ? ORDER BY session_date",
+        (symbol.upper(), what_to_show.upper(), scope),
+    ).fetchall()
+    return _rows_batch(rows)
+
+
+def read_session_stats(
+    conn: sqlite3.Connection,
+    symbol: str,
+    scope: str = "full",
+    what_to_show: str = DEFAULT_WHAT_TO_SHOW,
+) -> List[Dict]:
+    """交易日统计：开盘区间、VWAP、成交量最大的价格（poc）、实际与日历应有的K线数。"""
+    cursor = conn.execute(
+        "SELECT * FROM session_bars WHERE symbol = ? AND what_to_show = ? AND scope = ? ORDER BY session_date",
+        (symbol.upper(), what_to_show.upper(), scope),
+    )
+    names = [column[0] for column in cursor.description]
+    return [dict(zip(names, row)) for row in cursor]
+
+
+def read_volume_profile(
+    conn: sqlite3.Connection,
+    symbol: str,
+    session_date: str,
+    scope: str = "full",
+    what_to_show: str = DEFAULT_WHAT_TO_SHOW,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """某交易日的成交量分布，返回 (价格桶下沿, 成交量)，按价格升序。"""
+    rows = conn.execute(
+        "SELECT price, volume FROM session_profile "
+        "WHERE symbol = ? AND what_to_show = ? AND scope = ? AND session_date = ? ORDER BY price",
+        (symbol.upper(), what_to_show.upper(), scope, session_date),
+    ).fetchall()
+    matrix = np.array(rows, dtype=np.float64).reshape(len(rows), 2)
+    return matrix[:, 0], matrix[:, 1]
+
+
+def read_rth_bars(
+    conn: sqlite3.Connection, symbol: str, bar: str, what_to_show: str = DEFAULT_WHAT_TO_SHOW
+) -> BarBatch:
+    rows = conn.execute(
+        f"SELECT CAST(strftime('%s', ts_utc) AS INTEGER), {', '.join(BAR_COLUMNS)} "
+        f"FROM {rth_table(symbol, bar, what_to_show)} ORDER BY ts_utc"
+    ).fetchall()
+    return _rows_batch(rows)
+
+
+def _rows_batch(rows) -> BarBatch:
+    if not rows:
+        return BarBatch.empty()
+    matrix = np.array(rows, dtype=np.float64)
+    values = np.empty(len(rows), dtype=BAR_DTYPE)
+    for offset, name in enumerate(BAR_COLUMNS):
+        column = matrix[:, offset + 1]
+        values[name] = np.nan_to_num(column) if values.dtype[name].kind == "i" else column
+    return BarBatch(ts=matrix[:, 0].astype(np.int64), values=values)
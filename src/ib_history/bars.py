@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Iterator, Sequence, Tuple
+
+import numpy as np
+
+BAR_DTYPE = np.dtype(
+    [
+        ("open", np.float64),
+        ("high", np.float64),
+        ("low", np.float64),
+        ("close", np.float64),
+        ("volume", np.int64),
+        ("vwap", np.float64),
+        ("trade_count", np.int64),
+    ]
+)
+
+
+_UNIT_SECONDS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def bar_seconds(bar: str) -> int:
+    """把 1m/3m/1h/1d 这类周期写法转换为秒数。"""
+    unit = bar[-1].lower()
+    if unit not in _UNIT_SECONDS or not bar[:-1].isdigit():
+        raise ValueError(f"不支持的bar周期: {bar}")
+    return int(bar[:-1]) * _UNIT_SECONDS[unit]
+
+
+def epoch_seconds(values: Sequence) -> np.ndarray:
+    """把 BarData.date（datetime 或 date）批量转换为 UTC 秒级时间戳。"""
+    if len(values) == 0:
+        return np.empty(0, dtype=np.int64)
+    first = values[0]
+    if isinstance(first, datetime):
+        if first.tzinfo is None:
+            # 无时区的时间按 UTC 处理，numpy 可直接整体解析
+            return np.array(values, dtype="datetime64[s]").astype(np.int64)
+        seconds = np.fromiter((v.timestamp() for v in values), dtype=np.float64, count=len(values))
+        return np.floor(seconds).astype(np.int64)
+    # 日线返回 date，按 UTC 零点对齐
+    return np.array(values, dtype="datetime64[D]").astype("datetime64[s]").astype(np.int64)
+
+
+def ts_utc_text(ts: np.ndarray) -> np.ndarray:
+    """秒级时间戳转为库内使用的 ISO 文本（与 datetime.isoformat 的 UTC 输出一致）。"""
+    text = np.datetime_as_string(ts.astype("datetime64[s]"), unit="s")
+    return np.char.add(text, "+00:00")
+
+
+@dataclass
+class BarBatch:
+    """按列存放的一批K线，替代逐行构造的 dict 列表。"""
+
+    ts: np.ndarray
+    values: np.ndarray
+
+    def __len__(self) -> int:
+        return int(self.ts.shape[0])
+
+    @classmethod
+    def empty(cls) -> "BarBatch":
+        return cls(ts=np.empty(0, dtype=np.int64), values=np.empty(0, dtype=BAR_DTYPE))
+
+    @classmethod
+    def from_bar_data(cls, bars: Sequence) -> "BarBatch":
+        """直接由 ib_async 的 BarData 列表填充。"""
+        count = len(bars)
+        if count == 0:
+            return cls.empty()
+        ts = epoch_seconds([b.date for b in bars])
+        values = np.fromiter(
+            (
+                (b.open, b.high, b.low, b.close, b.volume, b.average, b.barCount)
+                for b in bars
+            ),
+            dtype=BAR_DTYPE,
+            count=count,
+        )
+        return cls(ts=ts, values=values)
+
+    def column(self, name: str) -> np.ndarray:
+        return self.values[name]
+
+    def ts_utc(self) -> np.ndarray:
+        return ts_utc_text(self.ts)
+
+    def to_records(self, chunk_size: int = 8192) -> Iterator[Tuple]:
+        """按 storage 的列顺序分块产出元组，tolist() 保证写入 SQLite 的是原生类型。"""
+        for offset in range(0, len(self), chunk_size):
+            part = slice(offset, offset + chunk_size)
+            columns = [ts_utc_text(self.ts[part]).tolist()]
+            columns.extend(self.values[name][part].tolist() for name in BAR_DTYPE.names)
+            yield from zip(*columns)
@@ -6,12 +6,19 @@ from datetime import datetime, timedelta
 from typing import List
 from zoneinfo import ZoneInfo
 
-try:
-    import pandas as pd
-except ImportError:  # pragma: no cover
-    pd = None
+import numpy as np
 
-from .storage import bars_table
+from .profiling import span
+from .reader import read_column_chunks
+
+
+def _pandas():
+    """首次用到时才导入 pandas（之后由 sys.modules 缓存）；未安装时返回 None。"""
+    try:
+        import pandas as pd
+    except ImportError:  # pragma: no cover
+        return None
+    return pd
 
 
 @dataclass
@@ -21,36 +28,38 @@ class ChartContext:
     bar: str
 
 
+CHART_COLUMNS = ("open", "high", "low", "close", "volume")
+
+
 def _load_bars(db_path: str, symbol: str, bar: str, display_tz: str):
-    table = bars_table(symbol, bar)
     conn = sqlite3.connect(db_path)
     try:
-        cursor = conn.execute(
-            f"SELECT ts_utc, open, high, low, close, volume FROM {table} ORDER BY ts_utc"
-        )
-        rows = cursor.fetchall()
+        with span("sqlite_read"):
+            # 经 reader 读取：已归档到冷存储的月份也能显示
+            parts = list(read_column_chunks(conn, symbol, bar, columns=CHART_COLUMNS))
     finally:
         conn.close()
-    if not rows:
+    if not parts:
         return None
+    with span("dataframe"):
+        ts = np.concatenate([part_ts for part_ts, _ in parts])
+        matrix = np.concatenate([part for _, part in parts])
+        return _to_frame(ts, matrix, display_tz)
+
+
+def _to_frame(ts, matrix, display_tz: str):
+    """ts 为 UTC epoch 秒，matrix 的列依次为 CHART_COLUMNS。"""
+    pd = _pandas()
     if pd is None:
         return [
-            {
-                "time": datetime.fromisoformat(row[0]).timestamp(),
-                "open": row[1],
-                "high": row[2],
-                "low": row[3],
-                "close": row[4],
-                "volume": row[5],
-            }
-            for row in rows
+            {"time": float(epoch), **dict(zip(CHART_COLUMNS, row))}
+            for epoch, row in zip(ts.tolist(), matrix.tolist())
         ]
-    df = pd.DataFrame(
-        rows, columns=["time", "open", "high", "low", "close", "volume"]
-    )
+    df = pd.DataFrame(matrix, columns=list(CHART_COLUMNS))
+    df.insert(0, "time", ts)
     # pandas 3.x 可能产生 datetime64[us, UTC]，lightweight-charts 内部按 ns 计算时间戳。
     # 这里统一转换为 datetime64[ns]（无时区）以确保K线正常显示。
-    df["time"] = pd.to_datetime(df["time"], utc=True)
+    df["time"] = pd.to_datetime(df["time"], unit="s", utc=True)
     if display_tz:
         df["time"] = df["time"].dt.tz_convert(ZoneInfo(display_tz))
     df["time"] = df["time"].dt.tz_convert(None).astype("datetime64[ns]")
@@ -63,12 +72,7 @@ def show_chart(
     bar: str = "3m",
     display_tz: str = "America/New_York",
 ) -> None:
-    import sys
-
-    print(f"[chart_app] loaded from: {__file__}")
-    print(f"[chart_app] sys.path[0:5]: {sys.path[:5]}")
-    print("hello tiger")
-    if pd is None:
+    if _pandas() is None:
         raise RuntimeError("请先安装 pandas 以使用图表功能。")
     from lightweight_charts import Chart
 
@@ -82,7 +86,8 @@ def show_chart(
         data = _load_bars(context.db_path, context.symbol, context.bar, display_tz)
         if data is None:
             return
-        chart.set(data, True)
+        with span("chart_push"):
+            chart.set(data, True)
 
     def on_symbol_search(chart_obj, searched):
         context.symbol = searched.upper()
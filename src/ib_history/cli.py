@@ -2,10 +2,15 @@ from __future__ import annotations
 
 import argparse
 from datetime import datetime
+from typing import TYPE_CHECKING, Optional
 
 from .config import default_config, merge_config
-from .fetcher import fetch_history
-from .report import FetchReport
+
+if TYPE_CHECKING:
+    from .report import FetchReport
+
+# 子命令用到的模块（numpy、IB 客户端、存储等）都在各自分支里导入，
+# 启动时只加载 argparse 与配置，cron 触发的小任务和 roll-table 不为用不到的依赖付导入开销
 
 
 def parse_datetime(value: str) -> datetime:
@@ -22,12 +27,143 @@ def build_parser() -> argparse.ArgumentParser:
     fetch.add_argument("--start", help="ISO 格式，例如 2024-01-01T00:00:00")
     fetch.add_argument("--end", help="ISO 格式，例如 2024-06-01T00:00:00")
     fetch.add_argument("--lookback", help="如 6m, 2y")
+    fetch.add_argument("--what", default=None, help="如 TRADES,BID_ASK,MIDPOINT，默认 TRADES")
     fetch.add_argument("--db", default="data/ib_history.sqlite")
     fetch.add_argument("--report", default="reports/fetch_latest.json")
+    fetch.add_argument("--metrics-out", default=None, help="运行中写出的指标文件")
+    fetch.add_argument("--metrics-format", choices=["jsonl", "prom"], default="jsonl")
+    fetch.add_argument(
+        "--events-out", default=None, help="逐片段追加 JSON-lines 事件，报告只保留聚合统计"
+    )
+    fetch.add_argument("--queue", action="store_true", help="写入持久化任务队列后执行，可中断后 resume")
+    fetch.add_argument("--workers", type=int, default=1, help="--queue 模式下的并发 worker 数")
+    fetch.add_argument("--skip-stored", action="store_true", help="跳过库内已有数据的首尾区间")
+    fetch.add_argument("--dry-run", action="store_true", help="只输出请求计划与耗时估算，不拉取")
+    fetch.add_argument("--plan-out", default="reports/fetch_plan.json")
+    fetch.add_argument(
+        "--fill-gaps", action="store_true", help="只按交易时段网格重拉缺失区间；不给时间范围时只补库内缺口"
+    )
+    fetch.add_argument(
+        "--session", action="store_true", help="复用 ib-history session 守护进程的连接，未运行时直连"
+    )
+    fetch.add_argument(
+        "--cache-mode",
+        choices=("off", "readwrite", "replay"),
+        default=None,
+        help="IB 原始响应缓存：readwrite 先查缓存再请求；replay 只读缓存、不连接 IB",
+    )
+    fetch.add_argument("--cache-dir", default=None, help="响应缓存目录，默认 data/response_cache")
     fetch.add_argument("--host", default=None)
     fetch.add_argument("--port", type=int, default=None)
     fetch.add_argument("--client-id", type=int, default=None)
 
+    resume = sub.add_parser("resume", help="继续执行任务队列中未完成的任务")
+    resume.add_argument("--db", default="data/ib_history.sqlite")
+    resume.add_argument("--workers", type=int, default=1)
+    resume.add_argument("--report", default="reports/fetch_latest.json")
+    resume.add_argument("--host", default=None)
+    resume.add_argument("--port", type=int, default=None)
+    resume.add_argument("--client-id", type=int, default=None)
+
+    plan = sub.add_parser("plan", help="输出拉取请求计划与耗时估算（JSON）")
+    plan.add_argument("--symbols", required=True, help="如 MNQ,MGC")
+    plan.add_argument("--bars", required=True, help="如 1m,5m,1h")
+    plan.add_argument("--start", help="ISO 格式，例如 2024-01-01T00:00:00")
+    plan.add_argument("--end", help="ISO 格式，例如 2024-06-01T00:00:00")
+    plan.add_argument("--lookback", help="如 6m, 2y")
+    plan.add_argument("--what", default=None, help="如 TRADES,BID_ASK,MIDPOINT，默认 TRADES")
+    plan.add_argument("--db", default="data/ib_history.sqlite")
+    plan.add_argument("--workers", type=int, default=1, help="并发连接数")
+    plan.add_argument("--include-stored", action="store_true", help="不扣除库内已有数据")
+    plan.add_argument("--out", default="reports/fetch_plan.json")
+    plan.add_argument("--host", default=None)
+    plan.add_argument("--port", type=int, default=None)
+    plan.add_argument("--client-id", type=int, default=None)
+
+    retry = sub.add_parser("retry-failures", help="按失败记录重拉缺失区间")
+    retry.add_argument("--symbols", default=None, help="只处理指定品种，如 MNQ,MGC")
+    retry.add_argument("--db", default="data/ib_history.sqlite")
+    retry.add_argument("--report", default="reports/retry_latest.json")
+    retry.add_argument("--no-compact", action="store_true", help="不压缩 fetch_failures 表")
+    retry.add_argument("--host", default=None)
+    retry.add_argument("--port", type=int, default=None)
+    retry.add_argument("--client-id", type=int, default=None)
+
+    gaps = sub.add_parser("gaps", help="对照交易时段网格列出缺失区间与补齐所需请求数")
+    gaps.add_argument("--symbols", required=True, help="如 MNQ,MGC")
+    gaps.add_argument("--bars", required=True, help="如 1m,5m,1h")
+    gaps.add_argument("--start", help="ISO 格式；不给时只检查库内数据之间的缺口")
+    gaps.add_argument("--end", help="ISO 格式")
+    gaps.add_argument("--lookback", help="如 6m, 2y")
+    gaps.add_argument("--what", default=None, help="如 TRADES,BID_ASK，默认 TRADES")
+    gaps.add_argument("--db", default="data/ib_history.sqlite")
+    gaps.add_argument("--out", default="reports/gaps_latest.json")
+
+    validate = sub.add_parser("validate", help="检查库内K线质量，结果写入 bar_findings")
+    validate.add_argument("--symbols", required=True, help="如 MNQ,MGC")
+    validate.add_argument("--bars", required=True, help="如 1m,5m,1h")
+    validate.add_argument("--what", default=None, help="如 TRADES,BID_ASK，默认 TRADES")
+    validate.add_argument("--db", default="data/ib_history.sqlite")
+    validate.add_argument("--chunk-rows", type=int, default=None, help="每块读取行数，控制内存")
+    validate.add_argument("--refetch", action="store_true", help="检查后按可疑区间重新拉取")
+    validate.add_argument("--report", default="reports/validate_refetch.json")
+    validate.add_argument("--host", default=None)
+    validate.add_argument("--port", type=int, default=None)
+    validate.add_argument("--client-id", type=int, default=None)
+
+    archive = sub.add_parser("archive", help="把早于截止月份的整月K线移入压缩冷存储")
+    archive.add_argument("--symbols", required=True, help="如 MNQ,MGC")
+    archive.add_argument("--bars", required=True, help="如 1m,5m,1h")
+    archive.add_argument("--what", default=None, help="如 TRADES,BID_ASK，默认 TRADES")
+    archive.add_argument("--db", default="data/ib_history.sqlite")
+    archive.add_argument("--before", help="ISO 格式；该日期所在月份之前的整月归档，默认 cold_after_days 天前")
+    archive.add_argument("--vacuum", action="store_true", help="归档后 VACUUM，真正缩小数据库文件")
+
+    aggregate = sub.add_parser("aggregate", help="由全时段 1m K线增量刷新交易日统计与 RTH 视图")
+    aggregate.add_argument("--symbols", required=True, help="如 MNQ,MGC")
+    aggregate.add_argument("--what", default=None, help="如 TRADES,BID_ASK，默认 TRADES")
+    aggregate.add_argument("--db", default="data/ib_history.sqlite")
+    aggregate.add_argument("--rebuild", action="store_true", help="忽略变更记录，整表重建")
+
+    sync = sub.add_parser("sync", help="按变更序号在两个历史库之间增量同步K线")
+    sync.add_argument(
+        "action",
+        choices=("export", "apply", "init", "prune"),
+        help="export 导出批次；apply 应用批次；init 把整库复制的文件初始化为副本；prune 清理各对端都已导出的变更记录",
+    )
+    sync.add_argument("--db", default="data/ib_history.sqlite")
+    sync.add_argument("--batch", default="data/sync/changes.npz", help="批次文件路径")
+    sync.add_argument("--peer", help="对端名称；export 时从上次发给它的序号继续")
+    sync.add_argument("--since", type=int, default=None, help="export 起始序号（不含），优先于 --peer 的记录")
+    sync.add_argument("--force", action="store_true", help="apply 时忽略批次序号不连续")
+
+    session = sub.add_parser("session", help="启动常驻 IB 会话守护进程（Unix socket）")
+    session.add_argument("--socket", default=None, help="默认 data/ib_session.sock")
+    session.add_argument("--status", action="store_true", help="查看守护进程状态")
+    session.add_argument("--stop", action="store_true", help="停止守护进程")
+    session.add_argument("--host", default=None)
+    session.add_argument("--port", type=int, default=None)
+    session.add_argument("--client-id", type=int, default=None)
+
+    ticks = sub.add_parser("ticks", help="拉取历史 tick")
+    ticks.add_argument("--symbols", required=True, help="如 MNQ,MGC")
+    ticks.add_argument("--start", required=True, help="ISO 格式（UTC）")
+    ticks.add_argument("--end", required=True, help="ISO 格式（UTC）")
+    ticks.add_argument("--what", default="TRADES", help="TRADES,BID_ASK")
+    ticks.add_argument("--root", default=None, help="tick 分区目录，默认 data/ticks")
+    ticks.add_argument("--report", default="reports/ticks_latest.json")
+    ticks.add_argument("--host", default=None)
+    ticks.add_argument("--port", type=int, default=None)
+    ticks.add_argument("--client-id", type=int, default=None)
+
+    stream = sub.add_parser("stream", help="订阅实时K线并持续写库")
+    stream.add_argument("--symbols", required=True, help="如 MNQ,MGC")
+    stream.add_argument("--bars", required=True, help="如 1m,3m（仅日内周期）")
+    stream.add_argument("--db", default="data/ib_history.sqlite")
+    stream.add_argument("--host", default=None)
+    stream.add_argument("--port", type=int, default=None)
+    stream.add_argument("--client-id", type=int, default=None)
+
     chart = sub.add_parser("chart", help="启动图表展示（待实现）")
     chart.add_argument("--db", default="data/ib_history.sqlite")
     chart.add_argument("--symbol", default="MNQ")
@@ -37,34 +173,394 @@ def build_parser() -> argparse.ArgumentParser:
     roll = sub.add_parser("roll-table", help="生成主力切换表")
     roll.add_argument("--path", default="data/roll_schedule.csv")
 
+    for command in sub.choices.values():
+        command.add_argument(
+            "--profile",
+            nargs="?",
+            const="sample",
+            choices=("sample", "cprofile"),
+            default=None,
+            help="记录调用栈采样（cprofile 时另存 cProfile 统计）与各阶段耗时",
+        )
+        command.add_argument(
+            "--profile-out", default=None, help="profile 文件前缀，默认 reports/profile/{子命令}-{时间}"
+        )
+
     return parser
 
 
+def _print_plan(plan, path: str) -> None:
+    print(f"请求数: {len(plan.requests)} | 已入库跳过: {plan.skipped_requests} | 连接数: {plan.connections}")
+    print(f"预计耗时: {plan.estimated_seconds / 60:.1f} 分钟 | 计划已写入: {path}")
+
+
+def _run_fetch(args, cfg, symbols, bars, start, end, what_to_show, client) -> Optional[FetchReport]:
+    from .metrics import build_metrics
+
+    if args.dry_run:
+        from .planner import plan_fetch
+
+        plan = plan_fetch(
+            symbols=symbols,
+            bars=bars,
+            start=start,
+            end=end,
+            lookback=args.lookback,
+            config=cfg,
+            db_path=args.db,
+            client=client,
+            what_to_show=what_to_show,
+            connections=args.workers,
+            skip_stored=args.skip_stored,
+        )
+        plan.write_json(args.plan_out)
+        _print_plan(plan, args.plan_out)
+        return None
+    if args.fill_gaps:
+        from .gaps import fill_gaps
+
+        return fill_gaps(
+            symbols=symbols,
+            bars=bars,
+            start=start,
+            end=end,
+            lookback=args.lookback,
+            config=cfg,
+            db_path=args.db,
+            client=client,
+            what_to_show=what_to_show,
+            metrics=build_metrics(args.metrics_out, args.metrics_format),
+            events_out=args.events_out,
+        )
+    if args.queue:
+        from .jobs import queue_fetch
+        from .pacing import PacingLimiter
+
+        return queue_fetch(
+            symbols=symbols,
+            bars=bars,
+            start=start,
+            end=end,
+            lookback=args.lookback,
+            config=cfg,
+            db_path=args.db,
+            what_to_show=what_to_show,
+            workers=args.workers,
+            skip_stored=args.skip_stored,
+            events_out=args.events_out,
+            # 会话守护进程统一限速，每个 worker 各开一条 socket 连接
+            client_factory=_session_factory(client.socket_path) if client is not None else None,
+            pacer=PacingLimiter.unlimited() if client is not None else None,
+        )
+    from .fetcher import fetch_history
+
+    return fetch_history(
+        symbols=symbols,
+        bars=bars,
+        metrics=build_metrics(args.metrics_out, args.metrics_format),
+        start=start,
+        end=end,
+        lookback=args.lookback,
+        db_path=args.db,
+        config=cfg,
+        client=client,
+        what_to_show=what_to_show,
+        skip_stored=args.skip_stored,
+        events_out=args.events_out,
+    )
+
+
+def _session_factory(socket_path: str):
+    from .session import SessionClient
+
+    return lambda index: SessionClient(socket_path)
+
+
 def main() -> None:
     parser = build_parser()
     args = parser.parse_args()
+    from .profiling import profile_run
+
+    with profile_run(args.profile, args.profile_out, args.command):
+        _run_command(args)
+
 
+def _run_command(args) -> None:
     if args.command == "fetch":
         start = parse_datetime(args.start) if args.start else None
         end = parse_datetime(args.end) if args.end else None
+        cfg = merge_config(
+            default_config(),
+            ib_host=args.host,
+            ib_port=args.port,
+            ib_client_id=args.client_id,
+            response_cache_mode=args.cache_mode,
+            response_cache_dir=args.cache_dir,
+        )
+        symbols = [s.strip() for s in args.symbols.split(",")]
+        bars = [b.strip() for b in args.bars.split(",")]
+        what_to_show = [w.strip().upper() for w in args.what.split(",")] if args.what else None
+        client = None
+        if args.session:
+            from .session import connect_session
+
+            client = connect_session(cfg)
+            if client is None:
+                print(f"[session] 未找到守护进程 {cfg.session_socket}，改为直连 IB")
+        try:
+            report = _run_fetch(args, cfg, symbols, bars, start, end, what_to_show, client)
+        finally:
+            if client is not None:
+                client.close()
+        if report is None:
+            return
+        report.write_json(args.report)
+        print(f"成功写入K线数量: {report.success_count}")
+        print(f"失败片段数: {report.failure_count} | 无数据片段数: {report.no_data_count}")
+        for entry in report.skipped:
+            print(
+                f"[跳过] {entry['symbol']} {entry['bar']} {entry['what_to_show']} "
+                f"正由 {entry['owner']} 拉取"
+            )
+        summary = report.metrics
+        if summary:
+            print(
+                f"请求数: {summary['requests']} | 耗时: {summary['elapsed_seconds']}s | "
+                f"写入速率: {summary['rows_per_second']} 行/秒 | 阶段耗时: {summary['phase_seconds']}"
+            )
+    elif args.command == "session":
+        from .session import SessionClient, SessionError, run_session
+
         cfg = merge_config(
             default_config(),
             ib_host=args.host,
             ib_port=args.port,
             ib_client_id=args.client_id,
         )
-        report = fetch_history(
+        path = args.socket or cfg.session_socket
+        if args.status or args.stop:
+            try:
+                client = SessionClient(path, timeout=10.0)
+            except OSError:
+                print(f"守护进程未运行: {path}")
+                return
+            try:
+                if args.stop:
+                    client.shutdown()
+                    print(f"已停止守护进程: {path}")
+                else:
+                    print(f"守护进程状态: {client.ping()}")
+            except SessionError as exc:
+                print(f"守护进程无响应: {exc}")
+            finally:
+                client.close()
+            return
+        print(f"[session] 监听 {path}，Ctrl+C 退出")
+        run_session(cfg, path)
+    elif args.command == "resume":
+        from .jobs import job_counts, run_jobs
+        from .storage import ensure_db
+
+        cfg = merge_config(
+            default_config(),
+            ib_host=args.host,
+            ib_port=args.port,
+            ib_client_id=args.client_id,
+        )
+        report = run_jobs(args.db, cfg, workers=args.workers)
+        report.write_json(args.report)
+        conn = ensure_db(args.db)
+        try:
+            counts = job_counts(conn)
+        finally:
+            conn.close()
+        print(f"成功写入K线数量: {report.success_count}")
+        print(f"任务状态: {counts}")
+    elif args.command == "plan":
+        from .planner import plan_fetch
+
+        cfg = merge_config(
+            default_config(),
+            ib_host=args.host,
+            ib_port=args.port,
+            ib_client_id=args.client_id,
+        )
+        plan = plan_fetch(
             symbols=[s.strip() for s in args.symbols.split(",")],
             bars=[b.strip() for b in args.bars.split(",")],
-            start=start,
-            end=end,
+            start=parse_datetime(args.start) if args.start else None,
+            end=parse_datetime(args.end) if args.end else None,
             lookback=args.lookback,
+            config=cfg,
             db_path=args.db,
+            what_to_show=[w.strip().upper() for w in args.what.split(",")] if args.what else None,
+            connections=args.workers,
+            skip_stored=not args.include_stored,
+        )
+        plan.write_json(args.out)
+        _print_plan(plan, args.out)
+    elif args.command == "retry-failures":
+        from .recovery import retry_failures
+
+        cfg = merge_config(
+            default_config(),
+            ib_host=args.host,
+            ib_port=args.port,
+            ib_client_id=args.client_id,
+        )
+        report = retry_failures(
             config=cfg,
+            db_path=args.db,
+            symbols=[s.strip() for s in args.symbols.split(",")] if args.symbols else None,
+            compact=not args.no_compact,
         )
         report.write_json(args.report)
-        print(f"成功写入K线数量: {report.success_count}")
-        print(f"失败片段数: {len(report.failures)} | 无数据片段数: {len(report.no_data)}")
+        print(f"重拉区间数: {len(report.ranges)} | 成功写入K线数量: {report.success_count}")
+        print(f"失败片段数: {report.failure_count} | 无数据片段数: {report.no_data_count}")
+    elif args.command == "gaps":
+        from .gaps import analyze_gaps, plan_gap_windows, write_gap_report
+
+        cfg = default_config()
+        found = analyze_gaps(
+            symbols=[s.strip() for s in args.symbols.split(",")],
+            bars=[b.strip() for b in args.bars.split(",")],
+            start=parse_datetime(args.start) if args.start else None,
+            end=parse_datetime(args.end) if args.end else None,
+            lookback=args.lookback,
+            config=cfg,
+            db_path=args.db,
+            what_to_show=[w.strip().upper() for w in args.what.split(",")] if args.what else None,
+        )
+        windows = plan_gap_windows(found, cfg.max_days_per_bar)
+        write_gap_report(found, windows, args.out)
+        print(
+            f"缺口数: {len(found)} | 缺失K线: {sum(g.missing for g in found)} | "
+            f"补齐请求数: {len(windows)} | 明细: {args.out}"
+        )
+    elif args.command == "validate":
+        from .validate import refetch_findings, validate_bars
+
+        symbols = [s.strip() for s in args.symbols.split(",")]
+        cfg = merge_config(
+            default_config(),
+            ib_host=args.host,
+            ib_port=args.port,
+            ib_client_id=args.client_id,
+        )
+        results = validate_bars(
+            symbols=symbols,
+            bars=[b.strip() for b in args.bars.split(",")],
+            what_to_show=[w.strip().upper() for w in args.what.split(",")] if args.what else None,
+            config=cfg,
+            db_path=args.db,
+            chunk_rows=args.chunk_rows,
+        )
+        for result in results:
+            counts = ", ".join(f"{k}={v}" for k, v in sorted(result.counts.items())) or "无问题"
+            print(
+                f"{result.symbol} {result.bar} {result.what_to_show}: {result.rows} 行, "
+                f"{result.elapsed_seconds:.2f}s | {counts}"
+            )
+        if args.refetch:
+            report = refetch_findings(config=cfg, db_path=args.db, symbols=symbols)
+            report.write_json(args.report)
+            print(f"重拉区间数: {len(report.ranges)} | 成功写入K线数量: {report.success_count}")
+            print(f"失败片段数: {report.failure_count} | 无数据片段数: {report.no_data_count}")
+    elif args.command == "archive":
+        import os
+
+        from .cold import archive_history
+
+        results = archive_history(
+            symbols=[s.strip() for s in args.symbols.split(",")],
+            bars=[b.strip() for b in args.bars.split(",")],
+            what_to_show=[w.strip().upper() for w in args.what.split(",")] if args.what else None,
+            before=parse_datetime(args.before) if args.before else None,
+            db_path=args.db,
+            vacuum=args.vacuum,
+        )
+        for result in results:
+            months = ",".join(result.months) or "无"
+            print(f"{result.table}: 归档月份 {months} | {result.rows} 行 | 冷存储 {result.bytes} 字节")
+        print(f"数据库文件: {os.path.getsize(args.db)} 字节")
+    elif args.command == "aggregate":
+        from .aggregates import update_aggregates
+        from .storage import ensure_db
+
+        cfg = default_config()
+        conn = ensure_db(args.db)
+        try:
+            for symbol in [s.strip() for s in args.symbols.split(",")]:
+                for what in [w.strip() for w in args.what.split(",")] if args.what else [cfg.what_to_show]:
+                    result = update_aggregates(conn, symbol, what, config=cfg, rebuild=args.rebuild)
+                    mode = "整表重建" if result.rebuilt else f"增量 ({result.from_seq}, {result.to_seq}]"
+                    views = ", ".join(f"{bar} {rows}" for bar, rows in result.rth_rows.items()) or "无"
+                    print(
+                        f"{result.symbol} {result.what_to_show}: {mode} | 重算交易日 {result.sessions} | "
+                        f"RTH 视图行数: {views}"
+                    )
+        finally:
+            conn.close()
+    elif args.command == "sync":
+        from .storage import ensure_db
+        from .sync import apply_changes, export_changes, init_replica, prune_changes
+
+        conn = ensure_db(args.db)
+        try:
+            if args.action == "export":
+                batch = export_changes(conn, args.batch, since=args.since, peer=args.peer)
+                print(
+                    f"导出序号 ({batch.from_seq}, {batch.to_seq}] | {len(batch.tables)} 张表 "
+                    f"{batch.rows} 行 | {batch.bytes} 字节 -> {args.batch}"
+                )
+            elif args.action == "apply":
+                batch = apply_changes(conn, args.batch, force=args.force)
+                print(
+                    f"应用序号 ({batch.from_seq}, {batch.to_seq}] | {batch.rows} 行 | "
+                    f"新增 {batch.inserted} 更新 {batch.updated}"
+                )
+            elif args.action == "init":
+                batch = init_replica(conn)
+                print(f"已初始化为副本，源库下次导出请用 --since {batch.to_seq}")
+            else:
+                print(f"清理变更记录: {prune_changes(conn)} 条")
+        finally:
+            conn.close()
+    elif args.command == "ticks":
+        from .fetcher import fetch_ticks_history
+
+        cfg = merge_config(
+            default_config(),
+            ib_host=args.host,
+            ib_port=args.port,
+            ib_client_id=args.client_id,
+        )
+        report = fetch_ticks_history(
+            symbols=[s.strip() for s in args.symbols.split(",")],
+            start=parse_datetime(args.start),
+            end=parse_datetime(args.end),
+            what_to_show=[w.strip().upper() for w in args.what.split(",")],
+            config=cfg,
+            root=args.root,
+        )
+        report.write_json(args.report)
+        print(f"成功写入 tick 数量: {report.success_count}")
+        print(f"失败片段数: {report.failure_count} | 无数据片段数: {report.no_data_count}")
+    elif args.command == "stream":
+        from .streamer import run_stream
+
+        cfg = merge_config(
+            default_config(),
+            ib_host=args.host,
+            ib_port=args.port,
+            ib_client_id=args.client_id,
+        )
+        run_stream(
+            symbols=[s.strip() for s in args.symbols.split(",")],
+            bars=[b.strip() for b in args.bars.split(",")],
+            config=cfg,
+            db_path=args.db,
+        )
     elif args.command == "chart":
         from .chart_app import show_chart
 
@@ -0,0 +1,204 @@
+from __future__ import annotations
+
+import os
+import sqlite3
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Mapping, Optional, Sequence
+
+import numpy as np
+
+from .bars import BAR_DTYPE, BarBatch, ts_utc_text
+from .config import Config, default_config, merge_config
+from .storage import (
+    DEFAULT_WHAT_TO_SHOW,
+    bars_table,
+    cold_blocks,
+    create_bars_table,
+    create_cold_manifest_table,
+    ensure_db,
+)
+
+
+def _shuffle(column: np.ndarray) -> np.ndarray:
+    # 按字节位重排（同一字节位放在一起），价格/时间戳的高位字节高度重复，deflate 压缩率高得多
+    return np.ascontiguousarray(column).view(np.uint8).reshape(len(column), column.itemsize).T.copy()
+
+
+def _unshuffle(data: np.ndarray, dtype: np.dtype) -> np.ndarray:
+    return np.ascontiguousarray(data.T).view(dtype).reshape(-1)
+
+
+def encode_batch(batch: BarBatch, prefix: str = "") -> Dict[str, np.ndarray]:
+    """按列字节重排后的数组，时间戳按差分存放，交给 np.savez_compressed 压缩。"""
+    ts = batch.ts.astype(np.int64)
+    arrays = {prefix + "ts": _shuffle(np.diff(ts, prepend=np.int64(0)))}
+    for name in BAR_DTYPE.names:
+        arrays[prefix + name] = _shuffle(batch.values[name])
+    return arrays
+
+
+def decode_batch(archive: Mapping[str, np.ndarray], prefix: str = "") -> BarBatch:
+    ts = np.cumsum(_unshuffle(archive[prefix + "ts"], np.dtype(np.int64)))
+    values = np.empty(len(ts), dtype=BAR_DTYPE)
+    for name in BAR_DTYPE.names:
+        values[name] = _unshuffle(archive[prefix + name], BAR_DTYPE[name])
+    return BarBatch(ts=ts, values=values)
+
+
+def write_block(path: Path, batch: BarBatch) -> int:
+    """把一批K线写成不可变的压缩列块；返回文件字节数。"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.stem + ".tmp.npz")
+    np.savez_compressed(tmp, **encode_batch(batch))
+    os.replace(tmp, path)
+    return path.stat().st_size
+
+
+def read_block(path: str) -> BarBatch:
+    with np.load(path) as archive:
+        return decode_batch(archive)
+
+
+@dataclass
+class ArchiveResult:
+    table: str
+    months: List[str] = field(default_factory=list)
+    rows: int = 0
+    bytes: int = 0
+
+
+def _month_start(epoch: int) -> datetime:
+    day = datetime(1970, 1, 1) + timedelta(seconds=int(epoch))
+    return datetime(day.year, day.month, 1)
+
+
+def _next_month(value: datetime) -> datetime:
+    return datetime(value.year + value.month // 12, value.month % 12 + 1, 1)
+
+
+def _text(value: datetime) -> str:
+    return value.isoformat() + "+00:00"
+
+
+def _hot_batch(conn: sqlite3.Connection, table: str, start: datetime, end: datetime) -> BarBatch:
+    rows = conn.execute(
+        f"SELECT CAST(strftime('%s', ts_utc) AS INTEGER), open, high, low, close, volume, vwap, trade_count "
+        f"FROM {table} WHERE ts_utc >= ? AND ts_utc < ? ORDER BY ts_utc",
+        (_text(start), _text(end)),
+    ).fetchall()
+    if not rows:
+        return BarBatch.empty()
+    matrix = np.array(rows, dtype=np.float64)
+    values = np.empty(len(rows), dtype=BAR_DTYPE)
+    for offset, name in enumerate(BAR_DTYPE.names):
+        column = matrix[:, offset + 1]
+        values[name] = np.nan_to_num(column) if values.dtype[name].kind == "i" else column
+    return BarBatch(ts=matrix[:, 0].astype(np.int64), values=values)
+
+
+def merge_batches(older: BarBatch, newer: BarBatch) -> BarBatch:
+    """按时间合并两批K线，同一时间戳以 newer 为准。"""
+    if not len(older):
+        return newer
+    if not len(newer):
+        return older
+    ts = np.concatenate([older.ts, newer.ts])
+    values = np.concatenate([older.values, newer.values])
+    order = np.argsort(ts, kind="stable")
+    ts, values = ts[order], values[order]
+    last = np.r_[ts[1:] != ts[:-1], True]
+    return BarBatch(ts=ts[last], values=values[last])
+
+
+def archive_series(
+    conn: sqlite3.Connection,
+    symbol: str,
+    bar: str,
+    what_to_show: str = DEFAULT_WHAT_TO_SHOW,
+    before: Optional[datetime] = None,
+    root: str = "data/cold",
+) -> ArchiveResult:
+    """把早于 before 所在月份的整月K线移入冷存储块并从热表删除。
+
+    已归档月份之后又写入热表的K线（例如补缺口）会与原块合并成新块。
+    """
+    create_bars_table(conn, symbol, bar, what_to_show)
+    create_cold_manifest_table(conn)
+    table = bars_table(symbol, bar, what_to_show)
+    result = ArchiveResult(table=table)
+    limit = before or datetime.utcnow()
+    cutoff = datetime(limit.year, limit.month, 1)
+    first = conn.execute(
+        f"SELECT CAST(strftime('%s', MIN(ts_utc)) AS INTEGER) FROM {table} WHERE ts_utc < ?",
+        (_text(cutoff),),
+    ).fetchone()[0]
+    if first is None:
+        return result
+    existing = {month: path for month, _, _, _, path in cold_blocks(conn, table)}
+    month = _month_start(first)
+    while month < cutoff:
+        following = _next_month(month)
+        hot = _hot_batch(conn, table, month, following)
+        if len(hot):
+            key = month.strftime("%Y-%m")
+            batch = merge_batches(read_block(existing[key]), hot) if key in existing else hot
+            path = Path(root) / table / f"{key}.npz"
+            size = write_block(path, batch)
+            first_utc, last_utc = ts_utc_text(batch.ts[[0, -1]]).tolist()
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO cold_blocks
+                (table_name, month, first_utc, last_utc, rows, path, bytes, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (table, key, first_utc, last_utc, len(batch), str(path), size, datetime.utcnow().isoformat()),
+            )
+            conn.execute(
+                f"DELETE FROM {table} WHERE ts_utc >= ? AND ts_utc < ?", (_text(month), _text(following))
+            )
+            # 每个月单独提交：块文件先落盘，清单与删除在同一事务里
+            conn.commit()
+            result.months.append(key)
+            result.rows += len(hot)
+            result.bytes += size
+        month = following
+    return result
+
+
+def archive_history(
+    symbols: Sequence[str],
+    bars: Sequence[str],
+    what_to_show: Optional[Sequence[str]] = None,
+    before: Optional[datetime] = None,
+    config: Optional[Config] = None,
+    db_path: str = "data/ib_history.sqlite",
+    vacuum: bool = False,
+) -> List[ArchiveResult]:
+    """before 缺省为 cold_after_days 天前；vacuum 时整理数据库文件以真正缩小体积。"""
+    cfg = merge_config(config or default_config())
+    before = before or datetime.utcnow() - timedelta(days=cfg.cold_after_days)
+    conn = ensure_db(db_path)
+    try:
+        results = [
+            archive_series(conn, symbol, bar, what, before, cfg.cold_root)
+            for symbol in symbols
+            for bar in bars
+            for what in (what_to_show or [cfg.what_to_show])
+        ]
+        if vacuum:
+            conn.execute("VACUUM")
+        return results
+    finally:
+        conn.close()
+
+
+def cold_summary(conn: sqlite3.Connection) -> Dict[str, Dict[str, int]]:
+    create_cold_manifest_table(conn)
+    return {
+        table: {"blocks": blocks, "rows": rows, "bytes": size}
+        for table, blocks, rows, size in conn.execute(
+            "SELECT table_name, COUNT(*), SUM(rows), SUM(bytes) FROM cold_blocks GROUP BY table_name"
+        )
+    }
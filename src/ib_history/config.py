@@ -2,7 +2,7 @@ from __future__ import annotations
 
 from dataclasses import dataclass, field
 from datetime import date, timedelta
-from typing import Dict, List
+from typing import Dict, List, Tuple
 
 
 @dataclass(frozen=True)
@@ -32,10 +32,28 @@ class Config:
     timezone_data: str = "UTC"
     timezone_display: str = "America/New_York"
     pacing_sleep_seconds: float = 1.5
+    pacing_max_requests: int = 60
+    pacing_window_seconds: float = 600.0
+    # 多个进程连同一个 Gateway 时共享的限速账本（如 data/pacing_ledger.sqlite），默认只在进程内限速
+    pacing_ledger_path: str = ""
+    # 多个拉取进程写同一个库：WAL 模式 + 遇锁等待
+    sqlite_wal: bool = True
+    sqlite_busy_timeout: float = 30.0
     retry_rounds: int = 3
+    job_lease_seconds: float = 300.0
+    plan_request_seconds: float = 2.0
+    session_socket: str = "data/ib_session.sock"
+    session_contract_ttl_seconds: float = 3600.0
+    session_client_timeout: float = 900.0
+    validate_chunk_rows: int = 500_000
+    validate_return_sigma: float = 12.0
+    validate_min_return: float = 0.005
+    validate_stale_bars: int = 30
     what_to_show: str = "TRADES"
     use_rth: bool = False
     use_continuous_futures: bool = False
+    stream_reconnect_seconds: float = 10.0
+    stream_max_backfill: str = "5d"
     max_days_per_bar: Dict[str, int] = field(
         default_factory=lambda: {
             "1m": 1,
@@ -59,6 +77,33 @@ class Config:
         }
     )
     roll_table_path: str = "data/roll_schedule.csv"
+    tick_root: str = "data/ticks"
+    timeframe_cache_dir: str = "data/timeframe_index"
+    cold_root: str = "data/cold"
+    cold_after_days: int = 90
+    # IB 原始响应缓存：off / readwrite / replay（只读缓存，离线重建和基准测试用）
+    response_cache_mode: str = "off"
+    response_cache_dir: str = "data/response_cache"
+    response_cache_max_mb: int = 2048
+    # 结束时间距今不足该小时数的窗口不缓存，IB 可能还会修订最近的K线
+    response_cache_settle_hours: float = 24.0
+    # 预计算聚合层：由全时段 1m K线生成的 RTH 日内周期与交易日统计
+    aggregate_rth_bars: List[str] = field(default_factory=lambda: ["1m", "5m", "15m", "30m", "1h"])
+    opening_range_minutes: int = 30
+    # 常规交易时段（芝加哥时间），未列出的品种按股指 08:30-15:00
+    rth_hours_ct: Dict[str, Tuple[str, str]] = field(
+        default_factory=lambda: {
+            "MNQ": ("08:30", "15:00"),
+            "MGC": ("07:20", "12:30"),
+        }
+    )
+    # 成交量分布的价格分桶宽度，未列出的品种按 1.0
+    profile_bucket_size: Dict[str, float] = field(
+        default_factory=lambda: {
+            "MNQ": 5.0,
+            "MGC": 1.0,
+        }
+    )
     contract_months: Dict[str, List[int]] = field(
         default_factory=lambda: {
             "MNQ": [3, 6, 9, 12],
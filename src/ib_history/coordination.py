@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import os
+import socket
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Iterable, List, Optional, Tuple
+
+from .storage import commit_with_retry
+
+SeriesKey = Tuple[str, str, str]
+
+
+def create_lease_table(conn: sqlite3.Connection) -> None:
+    """每个 (symbol, bar, whatToShow) 同一时刻只属于一个拉取进程，过期的租约可被接管。"""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS series_leases (
+            symbol TEXT NOT NULL,
+            bar TEXT NOT NULL,
+            what_to_show TEXT NOT NULL,
+            owner TEXT NOT NULL,
+            lease_until REAL NOT NULL,
+            acquired_at TEXT NOT NULL,
+            PRIMARY KEY (symbol, bar, what_to_show)
+        )
+        """
+    )
+
+
+def default_owner() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}-{threading.get_ident()}"
+
+
+def series_lease_seconds(config) -> float:
+    """租约时长：续约检查最长相隔一次完整的限速等待加一次 IB 请求，过半才续约，所以至少取其两倍。"""
+    return max(config.job_lease_seconds, 2 * (config.pacing_window_seconds + config.ib_timeout))
+
+
+class SeriesLeases:
+    """一个拉取进程持有的序列租约：开始前批量领取，运行中按需续约，结束时释放。"""
+
+    def __init__(
+        self,
+        conn: sqlite3.Connection,
+        lease_seconds: float,
+        owner: Optional[str] = None,
+        clock=time.time,
+    ) -> None:
+        self.conn = conn
+        self.lease_seconds = lease_seconds
+        self.owner = owner or default_owner()
+        self.clock = clock
+        self.held: List[SeriesKey] = []
+        # 本进程停顿太久、租约过期后被其他进程接管的序列
+        self.lost: List[SeriesKey] = []
+        self._renew_at = 0.0
+        create_lease_table(conn)
+        conn.commit()
+
+    def acquire(self, keys: Iterable[SeriesKey]) -> List[SeriesKey]:
+        """领取空闲或已过期的租约，返回本进程拿到的序列；被其他进程持有的不在其中。"""
+
+        def _claim() -> List[SeriesKey]:
+            now = self.clock()
+            got = []
+            for symbol, bar, what in keys:
+                row = self.conn.execute(
+                    """
+                    INSERT INTO series_leases (symbol, bar, what_to_show, owner, lease_until, acquired_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (symbol, bar, what_to_show) DO UPDATE SET
+                        owner = excluded.owner,
+                        lease_until = excluded.lease_until,
+                        acquired_at = excluded.acquired_at
+                    WHERE series_leases.lease_until < ? OR series_leases.owner = excluded.owner
+                    RETURNING symbol
+                    """,
+                    (
+                        symbol,
+                        bar,
+                        what,
+                        self.owner,
+                        now + self.lease_seconds,
+                        datetime.utcnow().isoformat(),
+                        now,
+                    ),
+                ).fetchone()
+                if row is not None:
+                    got.append((symbol, bar, what))
+            return got
+
+        keys = list(keys)
+        got = commit_with_retry(self.conn, _claim)
+        self.held.extend(key for key in got if key not in self.held)
+        self._renew_at = self.clock() + self.lease_seconds / 2
+        return got
+
+    def holder(self, key: SeriesKey) -> Optional[str]:
+        row = self.conn.execute(
+            "SELECT owner FROM series_leases WHERE symbol = ? AND bar = ? AND what_to_show = ?", key
+        ).fetchone()
+        return row[0] if row else None
+
+    def renew_if_due(self) -> List[SeriesKey]:
+        """过了半个租期就续约，长时间回补不会被其他进程当作崩溃接管。
+
+        返回续约时发现已被其他进程接管的序列，它们移到 lost，调用方应停止拉取。
+        """
+        if not self.held or self.clock() < self._renew_at:
+            return []
+
+        def _renew() -> List[SeriesKey]:
+            until = self.clock() + self.lease_seconds
+            lost = []
+            for symbol, bar, what in self.held:
+                cursor = self.conn.execute(
+                    """
+                    UPDATE series_leases SET lease_until = ?
+                    WHERE symbol = ? AND bar = ? AND what_to_show = ? AND owner = ?
+                    """,
+                    (until, symbol, bar, what, self.owner),
+                )
+                if cursor.rowcount == 0:
+                    lost.append((symbol, bar, what))
+            return lost
+
+        lost = commit_with_retry(self.conn, _renew)
+        self.held = [key for key in self.held if key not in lost]
+        self.lost.extend(lost)
+        self._renew_at = self.clock() + self.lease_seconds / 2
+        return lost
+
+    def release(self) -> None:
+        if not self.held:
+            return
+
+        def _release() -> None:
+            for symbol, bar, what in self.held:
+                self.conn.execute(
+                    "DELETE FROM series_leases WHERE symbol = ? AND bar = ? AND what_to_show = ? AND owner = ?",
+                    (symbol, bar, what, self.owner),
+                )
+
+        commit_with_retry(self.conn, _release)
+        self.held = []
@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+import random
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .bars import BAR_DTYPE, BarBatch, bar_seconds
+from .config import third_friday
+from .sessions import session_open_mask
+
+
+class PacingViolation(RuntimeError):
+    pass
+
+
+@dataclass(frozen=True)
+class FakeContract:
+    conId: int
+    symbol: str
+    lastTradeDateOrContractMonth: str
+    localSymbol: str
+    secType: str = "FUT"
+
+
+@dataclass
+class FakeIBClient:
+    """本地替身，实现 DataClient 协议，用于测试和吞吐基准，不需要 IB Gateway。
+
+    生成的K线只依赖 (conId, 时间戳)，重复请求得到相同数据；可注入延迟、
+    限速错误（每 N 次请求一次）和无数据区间。
+    """
+
+    latency: float = 0.0
+    latency_jitter: float = 0.0
+    pacing_violation_every: int = 0
+    empty_windows: Sequence[Tuple[datetime, datetime]] = ()
+    first_year: int = 2018
+    last_year: int = 2030
+    seed: int = 7
+    sleep: Callable[[float], None] = time.sleep
+    requests: int = 0
+    rows_served: int = 0
+    _rng: random.Random = field(default=None, repr=False)
+
+    def __post_init__(self) -> None:
+        if self._rng is None:
+            self._rng = random.Random(self.seed)
+
+    def list_fut_contracts(self, symbol: str, config=None) -> List[FakeContract]:
+        months = config.contract_months.get(symbol.upper(), [3, 6, 9, 12]) if config else [3, 6, 9, 12]
+        contracts = []
+        for year in range(self.first_year, self.last_year + 1):
+            for month in months:
+                expiry = third_friday(year, month)
+                contracts.append(
+                    FakeContract(
+                        conId=_con_id(symbol, year, month),
+                        symbol=symbol.upper(),
+                        lastTradeDateOrContractMonth=expiry.strftime("%Y%m%d"),
+                        localSymbol=f"{symbol.upper()}{year % 100:02d}{month:02d}",
+                    )
+                )
+        return contracts
+
+    def head_timestamp(self, contract, what_to_show: Optional[str] = None) -> Optional[datetime]:
+        expiry = datetime.strptime(contract.lastTradeDateOrContractMonth, "%Y%m%d")
+        return expiry - timedelta(days=365)
+
+    def fetch_bars(self, symbol: str, bar: str, start: datetime, end: datetime, config=None):
+        contracts = self.list_fut_contracts(symbol, config)
+        target = next(
+            (c for c in contracts if c.lastTradeDateOrContractMonth >= start.strftime("%Y%m%d")),
+            contracts[-1],
+        )
+        return self.fetch_bars_for_contract(target, bar, start, end, config)
+
+    def fetch_bars_for_contract(self, contract, bar: str, start: datetime, end: datetime, config=None):
+        self.requests += 1
+        delay = self.latency + (self._rng.uniform(0, self.latency_jitter) if self.latency_jitter else 0.0)
+        if delay > 0:
+            self.sleep(delay)
+        if self.pacing_violation_every and self.requests % self.pacing_violation_every == 0:
+            raise PacingViolation(
+                "Error 162: Historical Market Data Service error message:"
+                "API historical data query cancelled: pacing violation"
+            )
+        batch = synthetic_bars(getattr(contract, "conId", 0), bar, start, end, self.empty_windows)
+        self.rows_served += len(batch)
+        return batch
+
+    def close(self) -> None:
+        return None
+
+
+def _con_id(symbol: str, year: int, month: int) -> int:
+    return sum(ord(ch) for ch in symbol.upper()) * 1_000_000 + year * 100 + month
+
+
+def _utc_epoch(value: datetime) -> int:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp())
+
+
+def synthetic_bars(
+    con_id: int,
+    bar: str,
+    start: datetime,
+    end: datetime,
+    empty_windows: Sequence[Tuple[datetime, datetime]] = (),
+) -> BarBatch:
+    """按 CME Globex 交易时段（芝加哥时间周日 17:00 至周五 16:00，每日 16:00-17:00 休市）生成K线。"""
+    step = bar_seconds(bar)
+    first = -(-_utc_epoch(start) // step) * step
+    ts = np.arange(first, _utc_epoch(end), step, dtype=np.int64)
+    open_mask = session_open_mask(ts, step)
+    for lo, hi in empty_windows:
+        open_mask &= (ts < _utc_epoch(lo)) | (ts >= _utc_epoch(hi))
+    ts = ts[open_mask]
+    # 只依赖时间戳与合约的确定性价格，跨分片重复请求结果一致
+    phase = ts.astype(np.float64) / 86400.0
+    noise = np.modf(np.sin(ts * 12.9898 + con_id % 997) * 43758.5453)[0]
+    mid = 15000.0 + 800.0 * np.sin(phase / 30.0) + 40.0 * np.sin(phase * 3.0) + 5.0 * noise
+    mid = np.round(mid * 4) / 4
+    values = np.empty(len(ts), dtype=BAR_DTYPE)
+    values["open"] = mid - 0.25
+    values["high"] = mid + 1.5
+    values["low"] = mid - 1.5
+    values["close"] = mid + 0.25
+    values["volume"] = (np.abs(noise) * 500).astype(np.int64) + 1
+    values["vwap"] = mid
+    values["trade_count"] = values["volume"] // 3 + 1
+    return BarBatch(ts=ts, values=values)
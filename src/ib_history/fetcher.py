@@ -1,17 +1,32 @@
 from __future__ import annotations
 
-from dataclasses import asdict
-from datetime import datetime, timedelta
-from typing import Iterable, List, Optional, Sequence
-
-from .config import Config, default_config, merge_config
 import time
+from collections import deque
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Sequence, Tuple
 
+from .bars import BarBatch, bar_seconds
+from .config import Config, default_config, merge_config
 from .contract_resolver import resolve_contract
+from .coordination import SeriesLeases, series_lease_seconds
 from .ib_client import DataClient, IBAsyncClient
-from .report import FailureRecord, FetchReport
-from .slicer import slice_by_bar
-from .storage import ensure_db, insert_bars, log_failure
+from .metrics import FetchMetrics, attach_metrics, retry_reason
+from .pacing import PacingLimiter
+from .profiling import phase_label
+from .report import FailureRecord, FetchReport, JsonLinesReportSink, contract_label
+from .response_cache import served_from_cache
+from .slicer import TimeSlice, slice_by_bar, slice_range
+from .storage import (
+    commit_with_retry,
+    ensure_db,
+    load_head_timestamp,
+    log_failure,
+    save_head_timestamp,
+    stored_span,
+    upsert_bars,
+)
+from .ticks import write_ticks
 
 
 def parse_lookback(lookback: str) -> timedelta:
@@ -28,6 +43,18 @@ def parse_lookback(lookback: str) -> timedelta:
     raise ValueError(f"不支持的 lookback 格式: {lookback}")
 
 
+def resolve_time_range(
+    start: Optional[datetime], end: Optional[datetime], lookback: Optional[str]
+) -> Tuple[datetime, datetime]:
+    if end is None:
+        end = datetime.utcnow()
+    if start is None:
+        if lookback is None:
+            raise ValueError("start 或 lookback 至少提供一个")
+        start = end - parse_lookback(lookback)
+    return start, end
+
+
 def fetch_history(
     symbols: Sequence[str],
     bars: Sequence[str],
@@ -37,111 +64,481 @@ def fetch_history(
     config: Optional[Config] = None,
     db_path: str = "data/ib_history.sqlite",
     client: Optional[DataClient] = None,
+    what_to_show: Optional[Sequence[str]] = None,
+    pacer: Optional[PacingLimiter] = None,
+    metrics: Optional[FetchMetrics] = None,
+    skip_stored: bool = False,
+    events_out: Optional[str] = None,
 ) -> FetchReport:
+    """按合约区间 × 分片拉取并写库。
+
+    events_out 给出时逐片段写 JSON-lines 事件，报告只保留聚合统计。
+    多个进程可以同时对同一个库运行：每个序列先领租约，被其他进程持有的序列跳过并记入报告。
+    """
     cfg = merge_config(config or default_config())
-    if end is None:
-        end = datetime.utcnow()
-    if start is None:
-        if lookback is None:
-            raise ValueError("start 或 lookback 至少提供一个")
-        start = end - parse_lookback(lookback)
+    start, end = resolve_time_range(start, end, lookback)
+    series = list(what_to_show or [cfg.what_to_show])
+    # 每种 whatToShow 使用各自的配置副本，client 按 config.what_to_show 发请求
+    series_cfg = {what: merge_config(cfg, what_to_show=what) for what in series}
+    owns_pacer = pacer is None
+    if pacer is None:
+        pacer = (
+            PacingLimiter.unlimited()
+            if getattr(client, "shared_pacing", False)
+            else PacingLimiter.from_config(cfg)
+        )
+    metrics = metrics or FetchMetrics()
 
     report = FetchReport(
         symbols=list(symbols),
         bars=list(bars),
         ranges=[{"start": start.isoformat(), "end": end.isoformat()}],
+        keep_records=events_out is None,
+        sink=JsonLinesReportSink(events_out) if events_out else None,
     )
 
     owns_client = client is None
     client = client or IBAsyncClient.from_config(cfg, resolve_contract)
-    conn = ensure_db(db_path)
+    conn = ensure_db(db_path, busy_timeout=cfg.sqlite_busy_timeout, wal=cfg.sqlite_wal)
+    leases = SeriesLeases(conn, series_lease_seconds(cfg))
+    previous_metrics = attach_metrics(client, metrics)
+
+    try:
+        requests: List[SliceRequest] = []
+        with metrics.phase("contract_resolution"):
+            for symbol in symbols:
+                requests.extend(
+                    build_slice_requests(
+                        client, conn, symbol, bars, start, end, cfg, series, skip_stored=skip_stored
+                    )
+                )
+        requests = _claim_series(leases, report, requests)
+        for request in interleave_requests(requests):
+            leases.renew_if_due()
+            if (request.symbol, request.bar, request.what_to_show) in leases.lost:
+                continue
+            _fetch_slice(
+                client,
+                conn,
+                report,
+                pacer,
+                metrics,
+                request.symbol,
+                request.bar,
+                request.contract,
+                request.time_slice,
+                series_cfg[request.what_to_show],
+                before_attempt=leases.renew_if_due,
+            )
+        # 租约过期后被其他进程接管的序列交给对方，剩余分片不再拉取
+        for key in leases.lost:
+            report.record_skipped(*key, owner=leases.holder(key) or "")
+        conn.commit()
+        report.metrics = metrics.summary()
+        return report
+    finally:
+        attach_metrics(client, previous_metrics)
+        leases.release()
+        metrics.close()
+        report.close()
+        conn.close()
+        if owns_pacer and hasattr(pacer, "close"):
+            pacer.close()
+        if owns_client:
+            client.close()
+
+
+def _claim_series(leases: SeriesLeases, report, requests: List["SliceRequest"]) -> List["SliceRequest"]:
+    """领取请求涉及的全部序列，只保留本进程拿到租约的请求。"""
+    keys = list(dict.fromkeys((r.symbol, r.bar, r.what_to_show) for r in requests))
+    claimed = set(leases.acquire(keys))
+    for key in keys:
+        if key not in claimed:
+            report.record_skipped(*key, owner=leases.holder(key) or "")
+    return [r for r in requests if (r.symbol, r.bar, r.what_to_show) in claimed]
+
+
+@dataclass(frozen=True)
+class SliceRequest:
+    """一次历史K线请求：某合约、某周期、某 whatToShow 的一个时间片。"""
+
+    symbol: str
+    bar: str
+    what_to_show: str
+    contract: object
+    time_slice: TimeSlice
+
+
+def build_slice_requests(
+    client,
+    conn,
+    symbol: str,
+    bars: Sequence[str],
+    start: datetime,
+    end: datetime,
+    config: Config,
+    what_to_show: Sequence[str],
+    skip_stored: bool = False,
+) -> List[SliceRequest]:
+    """把合约区间 × 分片展开为请求列表，区间先裁剪到各序列的最早数据时间。
+
+    skip_stored 时再扣除库内已有数据的首尾区间（内部缺口不在此处理）。
+    """
+    requests, _ = expand_slice_requests(
+        client, conn, symbol, bars, start, end, config, what_to_show, skip_stored=skip_stored
+    )
+    return requests
+
+
+def expand_slice_requests(
+    client,
+    conn,
+    symbol: str,
+    bars: Sequence[str],
+    start: datetime,
+    end: datetime,
+    config: Config,
+    what_to_show: Sequence[str],
+    skip_stored: bool = False,
+) -> Tuple[List[SliceRequest], int]:
+    """同 build_slice_requests，另外返回扣除库内数据之前的请求数。"""
+    contract_ranges = _build_contract_ranges(client, symbol, start, end, config)
+    requests: List[SliceRequest] = []
+    total = 0
+    for bar in bars:
+        keyed = []
+        for order, what in enumerate(what_to_show):
+            series_cfg = merge_config(config, what_to_show=what)
+            ranges = _clip_to_head_timestamps(client, conn, contract_ranges, series_cfg)
+            total += sum(
+                len(slice_by_bar(range_start, range_end, bar, config.max_days_per_bar))
+                for _, range_start, range_end in ranges
+            )
+            if skip_stored:
+                ranges = _subtract_stored(conn, symbol, bar, what, ranges)
+            for contract, range_start, range_end in ranges:
+                for time_slice in slice_by_bar(range_start, range_end, bar, config.max_days_per_bar):
+                    keyed.append(
+                        ((time_slice.start, order), SliceRequest(symbol, bar, what, contract, time_slice))
+                    )
+        # 同一时间片的多个序列相邻发出，共享同一个限速预算
+        keyed.sort(key=lambda item: item[0])
+        requests.extend(request for _, request in keyed)
+    return requests, total
+
+
+def interleave_requests(requests: Sequence[SliceRequest]) -> List[SliceRequest]:
+    """按合约轮转请求顺序，避免连续打同一合约触发 IB 的同合约限速。
+
+    每个合约内部保持原有（时间、序列）顺序。
+    """
+    queues: Dict[Tuple[str, object], Deque[SliceRequest]] = {}
+    for request in requests:
+        key = (request.symbol, getattr(request.contract, "conId", None))
+        queues.setdefault(key, deque()).append(request)
+    ordered: List[SliceRequest] = []
+    while queues:
+        for key in list(queues):
+            queue = queues[key]
+            ordered.append(queue.popleft())
+            if not queue:
+                del queues[key]
+    return ordered
+
+
+def _subtract_stored(conn, symbol, bar, what, ranges):
+    span = stored_span(conn, symbol, bar, what)
+    if span is None:
+        return ranges
+    # 库内时间为带 +00:00 的 UTC 文本，这里统一成 naive UTC 比较
+    first = datetime.fromisoformat(span[0]).replace(tzinfo=None)
+    after_last = datetime.fromisoformat(span[1]).replace(tzinfo=None) + timedelta(
+        seconds=bar_seconds(bar)
+    )
+    remaining = []
+    for contract, range_start, range_end in ranges:
+        if range_start < first:
+            remaining.append((contract, range_start, min(range_end, first)))
+        if range_end > after_last:
+            remaining.append((contract, max(range_start, after_last), range_end))
+    return remaining
+
+
+def _fetch_slice(
+    client,
+    conn,
+    report,
+    pacer,
+    metrics,
+    symbol,
+    bar,
+    contract,
+    time_slice,
+    config,
+    before_attempt: Optional[Callable[[], object]] = None,
+) -> bool:
+    """拉取单个时间片并写库，按 retry_rounds 重试；成功或确认无数据返回 True。
+
+    before_attempt 在每次尝试的限速等待之前调用（如续约序列租约）。
+    """
+    what = config.what_to_show
+    labels = {"symbol": symbol, "bar": bar, "what_to_show": what}
+    for attempt in range(1, config.retry_rounds + 1):
+        if before_attempt is not None:
+            before_attempt()
+        if not served_from_cache(client, contract, bar, time_slice.start, time_slice.end, config):
+            with phase_label("pacing_sleep"):
+                metrics.add_phase("pacing_sleep", pacer.wait(bar))
+        started = time.perf_counter()
+        try:
+            rows = _fetch_with_contract(
+                client, symbol, bar, time_slice.start, time_slice.end, config, contract
+            )
+        except Exception as exc:  # noqa: BLE001
+            reason = retry_reason(exc)
+            metrics.observe_request(time.perf_counter() - started, 0, reason, **labels)
+            metrics.record_retry(reason)
+            _record_failure(
+                conn,
+                report,
+                symbol,
+                bar,
+                what,
+                time_slice,
+                attempt,
+                str(exc),
+                False,
+                contract=contract,
+                retrying=attempt < config.retry_rounds,
+            )
+            continue
+        latency = time.perf_counter() - started
+        rows, overlap = _trim_to_window(rows, time_slice)
+        if overlap:
+            metrics.add_overlap(overlap)
+        if not rows:
+            metrics.observe_request(latency, 0, "no_data", **labels)
+            _record_failure(
+                conn, report, symbol, bar, what, time_slice, attempt, "no_data", True, contract=contract
+            )
+        else:
+            metrics.observe_request(latency, len(rows), "ok", **labels)
+            with metrics.phase("sqlite_write"):
+                # 每个分片单独提交，写锁只持有一个分片的时间，其他拉取进程可以穿插写入
+                stats = commit_with_retry(
+                    conn, lambda: upsert_bars(conn, symbol, bar, rows, what_to_show=what)
+                )
+            metrics.add_write(stats)
+            written = stats.received
+            report.record_slice(
+                symbol,
+                bar,
+                what,
+                contract_label(contract),
+                time_slice.start.isoformat(),
+                time_slice.end.isoformat(),
+                written,
+            )
+        return True
+    return False
+
+
+def _record_failure(
+    conn,
+    report,
+    symbol,
+    bar,
+    what,
+    time_slice,
+    attempt,
+    reason,
+    is_no_data,
+    contract=None,
+    retrying=False,
+) -> None:
+    record = FailureRecord(
+        symbol=symbol,
+        bar=bar,
+        start_utc=time_slice.start.isoformat(),
+        end_utc=time_slice.end.isoformat(),
+        attempt=attempt,
+        reason=reason,
+        is_no_data=is_no_data,
+        what_to_show=what,
+        contract=contract_label(contract),
+    )
+    if is_no_data:
+        report.record_no_data(record)
+    else:
+        report.record_failure(record, retrying=retrying)
+    created_at = datetime.utcnow().isoformat()
+    # 立即提交：不能带着写事务进入下一次限速等待和 IB 请求
+    commit_with_retry(
+        conn,
+        lambda: log_failure(
+            conn,
+            symbol,
+            bar,
+            record.start_utc,
+            record.end_utc,
+            attempt,
+            record.reason,
+            is_no_data,
+            created_at,
+            what_to_show=what,
+        ),
+    )
+
+
+def fetch_ticks_history(
+    symbols: Sequence[str],
+    start: datetime,
+    end: datetime,
+    what_to_show: Sequence[str] = ("TRADES",),
+    config: Optional[Config] = None,
+    root: Optional[str] = None,
+    client: Optional[DataClient] = None,
+) -> FetchReport:
+    """按合约区间、UTC 自然日拉取历史 tick，写入压缩分区文件。"""
+    cfg = merge_config(config or default_config())
+    root = root or cfg.tick_root
+    report = FetchReport(
+        symbols=list(symbols),
+        bars=[f"tick_{kind}" for kind in what_to_show],
+        ranges=[{"start": start.isoformat(), "end": end.isoformat()}],
+    )
+    owns_client = client is None
+    client = client or IBAsyncClient.from_config(cfg, resolve_contract)
+    if not hasattr(client, "fetch_ticks"):
+        raise ValueError("当前 client 不支持 tick 拉取")
+    pacer = PacingLimiter.from_config(cfg)
 
     try:
         for symbol in symbols:
             contract_ranges = _build_contract_ranges(client, symbol, start, end, cfg)
-            for bar in bars:
+            for kind in what_to_show:
                 for contract, range_start, range_end in contract_ranges:
-                    slices = slice_by_bar(range_start, range_end, bar, cfg.max_days_per_bar)
-                    for time_slice in slices:
-                        success = False
+                    for day_slice in slice_range(range_start, range_end, max_days=1):
                         for attempt in range(1, cfg.retry_rounds + 1):
                             try:
-                                rows = _fetch_with_contract(
-                                    client,
-                                    symbol,
-                                    bar,
-                                    time_slice.start,
-                                    time_slice.end,
-                                    cfg,
-                                    contract,
+                                batch = client.fetch_ticks(
+                                    contract, day_slice.start, day_slice.end, kind, pacer=pacer
                                 )
-                                if not rows:
-                                    record = FailureRecord(
-                                        symbol=symbol,
-                                        bar=bar,
-                                        start_utc=time_slice.start.isoformat(),
-                                        end_utc=time_slice.end.isoformat(),
-                                        attempt=attempt,
-                                        reason="no_data",
-                                        is_no_data=True,
+                                if not len(batch):
+                                    report.record_no_data(
+                                        FailureRecord(
+                                            symbol=symbol,
+                                            bar=f"tick_{kind}",
+                                            start_utc=day_slice.start.isoformat(),
+                                            end_utc=day_slice.end.isoformat(),
+                                            attempt=attempt,
+                                            reason="no_data",
+                                            is_no_data=True,
+                                            what_to_show=kind,
+                                            contract=contract_label(contract),
+                                        )
                                     )
-                                    report.no_data.append(record)
-                                    log_failure(
-                                        conn,
+                                else:
+                                    report.record_slice(
                                         symbol,
-                                        bar,
-                                        record.start_utc,
-                                        record.end_utc,
-                                        attempt,
-                                        record.reason,
-                                        True,
-                                        datetime.utcnow().isoformat(),
+                                        f"tick_{kind}",
+                                        kind,
+                                        contract_label(contract),
+                                        day_slice.start.isoformat(),
+                                        day_slice.end.isoformat(),
+                                        write_ticks(root, symbol, batch, day_slice.start, day_slice.end),
                                     )
-                                    success = True
-                                else:
-                                    report.success_count += insert_bars(conn, symbol, bar, rows)
-                                    success = True
                                 break
                             except Exception as exc:  # noqa: BLE001
-                                record = FailureRecord(
-                                    symbol=symbol,
-                                    bar=bar,
-                                    start_utc=time_slice.start.isoformat(),
-                                    end_utc=time_slice.end.isoformat(),
-                                    attempt=attempt,
-                                    reason=str(exc),
-                                    is_no_data=False,
-                                )
-                                report.failures.append(record)
-                                log_failure(
-                                    conn,
-                                    symbol,
-                                    bar,
-                                    record.start_utc,
-                                    record.end_utc,
-                                    attempt,
-                                    record.reason,
-                                    False,
-                                    datetime.utcnow().isoformat(),
+                                report.record_failure(
+                                    FailureRecord(
+                                        symbol=symbol,
+                                        bar=f"tick_{kind}",
+                                        start_utc=day_slice.start.isoformat(),
+                                        end_utc=day_slice.end.isoformat(),
+                                        attempt=attempt,
+                                        reason=str(exc),
+                                        is_no_data=False,
+                                        what_to_show=kind,
+                                        contract=contract_label(contract),
+                                    ),
+                                    retrying=attempt < cfg.retry_rounds,
                                 )
-                                time.sleep(cfg.pacing_sleep_seconds)
-                        if not success:
-                            continue
-                        time.sleep(cfg.pacing_sleep_seconds)
-        conn.commit()
         return report
     finally:
-        conn.close()
         if owns_client:
             client.close()
 
 
+def _trim_to_window(rows, time_slice: TimeSlice):
+    """丢掉落在 [start, end) 之外的K线，返回 (剩余K线, 丢弃行数)。
+
+    IB 的 durationStr 以天为单位向上取整，响应可能带出相邻分片的K线，写库前裁掉以免重复写入。
+    """
+    if isinstance(rows, BarBatch):
+        lo = int(time_slice.start.replace(tzinfo=timezone.utc).timestamp())
+        hi = int(time_slice.end.replace(tzinfo=timezone.utc).timestamp())
+        keep = (rows.ts >= lo) & (rows.ts < hi)
+        if keep.all():
+            return rows, 0
+        return BarBatch(ts=rows.ts[keep], values=rows.values[keep]), int((~keep).sum())
+    kept = [row for row in rows if time_slice.start <= _naive_utc(row["ts_utc"]) < time_slice.end]
+    return kept, len(rows) - len(kept)
+
+
+def _naive_utc(text: str) -> datetime:
+    value = datetime.fromisoformat(text)
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
 def _fetch_with_contract(client, symbol, bar, start, end, config, contract):
     if hasattr(client, "fetch_bars_for_contract"):
         return client.fetch_bars_for_contract(contract, bar, start, end, config)
     return client.fetch_bars(symbol, bar, start, end, config=config)
 
 
+def _head_timestamp(client, conn, contract, config) -> Optional[datetime]:
+    con_id = getattr(contract, "conId", 0)
+    if not con_id:
+        return None
+    cached = load_head_timestamp(conn, con_id, config.what_to_show, config.use_rth)
+    if cached is not None:
+        return datetime.fromisoformat(cached)
+    try:
+        head = client.head_timestamp(contract, config.what_to_show)
+    except Exception:  # noqa: BLE001
+        # 查询失败不影响拉取，只是不做裁剪
+        return None
+    if head is None:
+        return None
+    save_head_timestamp(
+        conn,
+        con_id,
+        config.what_to_show,
+        config.use_rth,
+        head.isoformat(),
+        datetime.utcnow().isoformat(),
+    )
+    conn.commit()
+    return head
+
+
+def _clip_to_head_timestamps(client, conn, contract_ranges, config):
+    """把每个合约区间的起点裁剪到 IB 的最早数据时间，跳过注定为空的请求。"""
+    if not hasattr(client, "head_timestamp"):
+        return contract_ranges
+    clipped = []
+    for contract, range_start, range_end in contract_ranges:
+        head = _head_timestamp(client, conn, contract, config) if contract is not None else None
+        if head is not None and head > range_start:
+            range_start = head
+        if range_start < range_end:
+            clipped.append((contract, range_start, range_end))
+    return clipped
+
+
 def _build_contract_ranges(client, symbol: str, start: datetime, end: datetime, config):
     if not hasattr(client, "list_fut_contracts"):
         return [(None, start, end)]
@@ -160,9 +557,10 @@ def _build_contract_ranges(client, symbol: str, start: datetime, end: datetime,
         if last_dt < start:
             prev_end = last_dt
             continue
-        range_start = max(start, prev_end + timedelta(days=1))
+        # 相邻合约区间首尾相接、互不重叠：上一合约覆盖到其到期日 0 点
+        range_start = max(start, prev_end)
         range_end = min(end, last_dt)
-        if range_start <= range_end:
+        if range_start < range_end:
             ranges.append((contract, range_start, range_end))
         prev_end = last_dt
         if prev_end >= end:
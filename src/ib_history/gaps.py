@@ -0,0 +1,350 @@
+from __future__ import annotations
+
+import json
+import sqlite3
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .bars import bar_seconds
+from .config import Config, default_config, merge_config
+from .contract_resolver import resolve_contract
+from .fetcher import resolve_time_range
+from .ib_client import DataClient, IBAsyncClient
+from .metrics import FetchMetrics, attach_metrics
+from .pacing import PacingLimiter
+from .reader import read_column_chunks
+from .recovery import FailureWindow, refetch_window
+from .report import FetchReport, JsonLinesReportSink
+from .sessions import session_open_mask
+from .storage import DEFAULT_WHAT_TO_SHOW, create_failure_table, ensure_db
+
+
+@dataclass
+class Gap:
+    """一段缺失的K线：start 为第一根缺失K线，end 为最后一根缺失K线的结束时间（naive UTC）。"""
+
+    symbol: str
+    bar: str
+    what_to_show: str
+    start: datetime
+    end: datetime
+    missing: int
+
+
+def create_known_gaps_table(conn: sqlite3.Connection) -> None:
+    """IB 重拉后仍无数据的区间（多为交易所节假日）。
+
+    confirmed = 1 的区间之后的缺口分析跳过：该段请求 IB 明确返回无数据，或连续两次重拉后仍缺同一段；
+    只重拉过一次、当时有其他K线返回的区间先记为 0，可能只是那次响应不完整。
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS known_gaps (
+            symbol TEXT NOT NULL,
+            bar TEXT NOT NULL,
+            what_to_show TEXT NOT NULL,
+            start_utc TEXT NOT NULL,
+            end_utc TEXT NOT NULL,
+            checked_at TEXT NOT NULL,
+            confirmed INTEGER NOT NULL DEFAULT 1,
+            PRIMARY KEY (symbol, bar, what_to_show, start_utc)
+        )
+        """
+    )
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(known_gaps)")}
+    if "confirmed" not in columns:
+        conn.execute("ALTER TABLE known_gaps ADD COLUMN confirmed INTEGER NOT NULL DEFAULT 1")
+
+
+def _epoch(value: datetime) -> int:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp())
+
+
+def _naive(epoch: int) -> datetime:
+    return datetime(1970, 1, 1) + timedelta(seconds=int(epoch))
+
+
+def _stored_text(epoch: int) -> str:
+    return _naive(epoch).replace(tzinfo=timezone.utc).isoformat()
+
+
+def find_gaps(
+    conn: sqlite3.Connection,
+    symbol: str,
+    bar: str,
+    what_to_show: str = DEFAULT_WHAT_TO_SHOW,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    chunk_rows: int = 500_000,
+    include_known: bool = False,
+) -> List[Gap]:
+    """对照交易时段的K线网格找出缺失区间。
+
+    只读时间戳列，分块扫描；给出 start/end 时也检查首尾，否则只看库内数据之间的缺口。
+    休市、周末不算缺口；已登记在 known_gaps 中的区间默认跳过。
+    """
+    step = bar_seconds(bar)
+    lo = -(-_epoch(start) // step) * step if start is not None else None
+    hi = _epoch(end) if end is not None else None
+    gaps: List[Gap] = []
+
+    def add(after: int, before: int) -> None:
+        grid = np.arange(after + step, before, step, dtype=np.int64)
+        missing = grid[session_open_mask(grid, step)]
+        if len(missing):
+            gaps.append(
+                Gap(
+                    symbol,
+                    bar,
+                    what_to_show,
+                    _naive(missing[0]),
+                    _naive(missing[-1] + step),
+                    len(missing),
+                )
+            )
+
+    prev: Optional[int] = None
+    for ts, _ in read_column_chunks(
+        conn,
+        symbol,
+        bar,
+        what_to_show,
+        (),
+        chunk_rows,
+        _stored_text(lo) if lo is not None else None,
+        _stored_text(hi) if hi is not None else None,
+    ):
+        # 非 +00:00 写法会打乱文本排序，重复或倒序的时间戳不影响缺口判断
+        ts = np.unique(ts)
+        if prev is None:
+            if lo is not None:
+                add(lo - step, int(ts[0]))
+        else:
+            ts = ts[ts > prev]
+            if not len(ts):
+                continue
+        prevs = np.concatenate(([prev if prev is not None else ts[0]], ts[:-1]))
+        for idx in np.flatnonzero(ts - prevs > step):
+            add(int(prevs[idx]), int(ts[idx]))
+        prev = int(ts[-1])
+    if hi is not None and (prev is not None or lo is not None):
+        add(prev if prev is not None else lo - step, hi)
+
+    if include_known or not gaps:
+        return gaps
+    spans = known_spans(conn, symbol, bar, what_to_show)
+    return [g for g in gaps if not within_known(_epoch(g.start), _epoch(g.end), step, spans)]
+
+
+def known_spans(
+    conn: sqlite3.Connection, symbol: str, bar: str, what_to_show: str = DEFAULT_WHAT_TO_SHOW
+) -> List[Tuple[int, int]]:
+    """IB 确认没有数据的区间 [(start, end)]（epoch 秒）：已确认的 known_gaps 与无数据的拉取记录。
+
+    交易日历里没有交易所节假日，缺口分析、数据校验和失败重拉都靠这些区间跳过节假日。
+    """
+    create_known_gaps_table(conn)
+    create_failure_table(conn)
+    rows = conn.execute(
+        "SELECT start_utc, end_utc FROM known_gaps "
+        "WHERE symbol = ? AND bar = ? AND what_to_show = ? AND confirmed = 1 "
+        "UNION SELECT start_utc, end_utc FROM fetch_failures "
+        "WHERE symbol = ? AND bar = ? AND what_to_show = ? AND is_no_data = 1",
+        (symbol, bar, what_to_show) * 2,
+    ).fetchall()
+    return [(_epoch(datetime.fromisoformat(a)), _epoch(datetime.fromisoformat(b))) for a, b in rows]
+
+
+def within_known(start: int, end: int, step: int, spans: Sequence[Tuple[int, int]]) -> bool:
+    """[start, end) 内交易时段应有的每根K线都落在某个已知无数据区间里。"""
+    if not spans:
+        return False
+    grid = np.arange(start, end, step, dtype=np.int64)
+    grid = grid[session_open_mask(grid, step)]
+    covered = np.zeros(len(grid), dtype=bool)
+    for lo, hi in spans:
+        covered |= (grid >= lo) & (grid + step <= hi)
+    return bool(covered.all())
+
+
+def plan_gap_windows(gaps: Sequence[Gap], max_days_per_bar: Dict[str, int]) -> List[FailureWindow]:
+    """把缺口贪心合并成最少的请求窗口。
+
+    同一序列上相邻缺口只要合并后仍在单次请求的最大跨度内就放进同一窗口，
+    中间已有的K线会被重复下载并覆盖写入，换来更少的请求次数。
+    """
+    windows: List[FailureWindow] = []
+    for gap in sorted(gaps, key=lambda g: (g.symbol, g.bar, g.what_to_show, g.start)):
+        span = timedelta(days=max_days_per_bar.get(gap.bar, 1))
+        last = windows[-1] if windows else None
+        if (
+            last is not None
+            and (last.symbol, last.bar, last.what_to_show) == (gap.symbol, gap.bar, gap.what_to_show)
+            and gap.end - last.start <= span
+        ):
+            last.end = max(last.end, gap.end)
+        else:
+            windows.append(FailureWindow(gap.symbol, gap.bar, gap.what_to_show, gap.start, gap.end))
+    return windows
+
+
+def analyze_gaps(
+    symbols: Sequence[str],
+    bars: Sequence[str],
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    lookback: Optional[str] = None,
+    config: Optional[Config] = None,
+    db_path: str = "data/ib_history.sqlite",
+    what_to_show: Optional[Sequence[str]] = None,
+) -> List[Gap]:
+    """不给 start/lookback 时只检查库内已有数据之间的缺口。"""
+    cfg = merge_config(config or default_config())
+    if start is not None or lookback is not None:
+        start, end = resolve_time_range(start, end, lookback)
+    conn = ensure_db(db_path)
+    try:
+        return [
+            gap
+            for symbol in symbols
+            for bar in bars
+            for what in (what_to_show or [cfg.what_to_show])
+            for gap in find_gaps(conn, symbol, bar, what, start, end)
+        ]
+    finally:
+        conn.close()
+
+
+def write_gap_report(gaps: Sequence[Gap], windows: Sequence[FailureWindow], path: str) -> None:
+    target = Path(path)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    payload = {
+        "gaps": len(gaps),
+        "missing_bars": sum(g.missing for g in gaps),
+        "requests": len(windows),
+        "windows": [
+            {
+                "symbol": w.symbol,
+                "bar": w.bar,
+                "what_to_show": w.what_to_show,
+                "start": w.start.isoformat(),
+                "end": w.end.isoformat(),
+            }
+            for w in windows
+        ],
+        "detail": [
+            {
+                "symbol": g.symbol,
+                "bar": g.bar,
+                "what_to_show": g.what_to_show,
+                "start": g.start.isoformat(),
+                "end": g.end.isoformat(),
+                "missing": g.missing,
+            }
+            for g in gaps
+        ],
+    }
+    target.write_text(json.dumps(payload, indent=2, ensure_ascii=False))
+
+
+def fill_gaps(
+    symbols: Sequence[str],
+    bars: Sequence[str],
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    lookback: Optional[str] = None,
+    config: Optional[Config] = None,
+    db_path: str = "data/ib_history.sqlite",
+    client: Optional[DataClient] = None,
+    what_to_show: Optional[Sequence[str]] = None,
+    pacer: Optional[PacingLimiter] = None,
+    metrics: Optional[FetchMetrics] = None,
+    events_out: Optional[str] = None,
+) -> FetchReport:
+    """只重拉缺口：分析缺失区间，合并成最少的请求窗口后逐个拉取。
+
+    窗口拉取成功后仍缺的K线登记到 known_gaps：落在 IB 返回无数据的分片内、或上次重拉后就缺同一段的
+    确认为 IB 确实没有数据，下次不再请求；其余的先记为待确认，下次还会再拉一次。
+    """
+    cfg = merge_config(config or default_config())
+    gaps = analyze_gaps(symbols, bars, start, end, lookback, cfg, db_path, what_to_show)
+    windows = plan_gap_windows(gaps, cfg.max_days_per_bar)
+    if pacer is None:
+        pacer = (
+            PacingLimiter.unlimited()
+            if getattr(client, "shared_pacing", False)
+            else PacingLimiter.from_config(cfg)
+        )
+    metrics = metrics or FetchMetrics()
+    report = FetchReport(
+        symbols=list(symbols),
+        bars=list(bars),
+        ranges=[
+            {"symbol": w.symbol, "bar": w.bar, "start": w.start.isoformat(), "end": w.end.isoformat()}
+            for w in windows
+        ],
+        keep_records=events_out is None,
+        sink=JsonLinesReportSink(events_out) if events_out else None,
+    )
+    if not windows:
+        report.close()
+        return report
+
+    owns_client = client is None
+    client = client or IBAsyncClient.from_config(cfg, resolve_contract)
+    conn = ensure_db(db_path)
+    create_known_gaps_table(conn)
+    previous_metrics = attach_metrics(client, metrics)
+    try:
+        for window in windows:
+            if not refetch_window(client, conn, report, pacer, metrics, cfg, window):
+                conn.commit()
+                continue
+            now = datetime.utcnow().isoformat()
+            # 重拉时 IB 对某个分片返回无数据的，known_spans 里已有对应记录
+            empty = known_spans(conn, window.symbol, window.bar, window.what_to_show)
+            step = bar_seconds(window.bar)
+            remaining = find_gaps(
+                conn,
+                window.symbol,
+                window.bar,
+                window.what_to_show,
+                window.start,
+                window.end,
+                include_known=True,
+            )
+            rows = []
+            for g in remaining:
+                start_utc = g.start.replace(tzinfo=timezone.utc).isoformat()
+                end_utc = g.end.replace(tzinfo=timezone.utc).isoformat()
+                seen = conn.execute(
+                    "SELECT 1 FROM known_gaps WHERE symbol = ? AND bar = ? AND what_to_show = ? "
+                    "AND start_utc = ? AND end_utc = ?",
+                    (g.symbol, g.bar, g.what_to_show, start_utc, end_utc),
+                ).fetchone()
+                confirmed = seen is not None or within_known(_epoch(g.start), _epoch(g.end), step, empty)
+                rows.append((g.symbol, g.bar, g.what_to_show, start_utc, end_utc, now, int(confirmed)))
+            conn.executemany(
+                """
+                INSERT OR REPLACE INTO known_gaps
+                (symbol, bar, what_to_show, start_utc, end_utc, checked_at, confirmed)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                rows,
+            )
+            conn.commit()
+        report.metrics = metrics.summary()
+        return report
+    finally:
+        attach_metrics(client, previous_metrics)
+        metrics.close()
+        report.close()
+        conn.close()
+        if owns_client:
+            client.close()
@@ -1,14 +1,21 @@
 from __future__ import annotations
 
+import math
+import time
 from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
-from typing import Iterable, List, Mapping, Optional, Protocol
+from typing import Callable, Iterable, List, Mapping, Optional, Protocol, Sequence, Union
+
+from .bars import BarBatch
+from .profiling import phase_label
+from .response_cache import MODES, CachedContract, ResponseCache, ResponseCacheMiss, contract_fields
+from .ticks import TickBatch
 
 
 class DataClient(Protocol):
     def fetch_bars(
         self, symbol: str, bar: str, start: datetime, end: datetime, config=None
-    ) -> List[Mapping]:
+    ) -> Union[Sequence[Mapping], BarBatch]:
         ...
 
     def close(self) -> None:
@@ -28,6 +35,10 @@ class IBAsyncClient:
     timeout: float = 60.0
     what_to_show: str = "TRADES"
     use_rth: bool = False
+    metrics: Optional[object] = None
+    response_cache: Optional[ResponseCache] = None
+    cache_mode: str = "off"
+    cache_settle_hours: float = 24.0
     _ib: Optional[object] = None
     _contract_resolver: Optional[object] = None
     _contfut_cache: dict = None
@@ -38,9 +49,16 @@ class IBAsyncClient:
 
         return IB, Future, Contract, util
 
+    @property
+    def offline(self) -> bool:
+        """replay 模式只读响应缓存，不连接 IB，也不占限速预算。"""
+        return self.cache_mode == "replay"
+
     def _ensure_connected(self) -> None:
         if self._ib is not None:
             return
+        if self.offline:
+            raise ResponseCacheMiss("replay 模式不连接 IB")
         IB, _, _, _ = self._load_ib()
         ib = IB()
         ib.connect(self.host, self.port, clientId=self.client_id, timeout=self.timeout)
@@ -52,7 +70,7 @@ class IBAsyncClient:
 
     def fetch_bars(
         self, symbol: str, bar: str, start: datetime, end: datetime, config=None
-    ) -> List[Mapping]:
+    ) -> BarBatch:
         if config is None:
             raise ValueError("IBAsyncClient.fetch_bars 需要传入 config")
         return self.fetch_bars_with_config(symbol, bar, start, end, config)
@@ -68,100 +86,110 @@ class IBAsyncClient:
             use_rth=config.use_rth,
         )
         client._contract_resolver = contract_resolver
+        if config.response_cache_mode not in MODES:
+            raise ValueError(f"未知响应缓存模式: {config.response_cache_mode}")
+        if config.response_cache_mode != "off":
+            client.response_cache = ResponseCache(
+                config.response_cache_dir, config.response_cache_max_mb * 1024 * 1024
+            )
+            client.cache_mode = config.response_cache_mode
+            client.cache_settle_hours = config.response_cache_settle_hours
         return client
 
     def _duration_str(self, start: datetime, end: datetime) -> str:
-        delta = end - start
-        if delta < timedelta(days=1):
-            seconds = max(30, int(delta.total_seconds()))
-            return f"{seconds} S"
-        days = max(1, int(delta.total_seconds() // 86400))
-        return f"{days} D"
+        """覆盖 [start, end) 的最短时长：一天以内精确到秒，更长向上取整到天。
+
+        向下取整会漏掉窗口开头；多取的部分由 fetcher 按窗口裁掉，不会重复写库。
+        """
+        seconds = math.ceil((end - start).total_seconds())
+        if seconds <= 86400:
+            return f"{max(30, seconds)} S"
+        return f"{-(-seconds // 86400)} D"
+
+    @staticmethod
+    def _end_datetime(end: datetime) -> datetime:
+        # naive 时间会被 TWS 按登录时区解释，这里统一显式标成 UTC
+        return end if end.tzinfo is not None else end.replace(tzinfo=timezone.utc)
 
     def _bar_size(self, bar: str, config) -> str:
         return config.bar_size_map.get(bar, bar)
 
     def fetch_bars_with_config(
         self, symbol: str, bar: str, start: datetime, end: datetime, config
-    ) -> List[Mapping]:
+    ) -> BarBatch:
         self._ensure_connected()
         IB, Future, Contract, util = self._load_ib()
         if config.use_continuous_futures:
             contract = self._get_contfut_contract(symbol, config, Contract)
         else:
             contract = self._get_fut_contract_by_date(symbol, start, config, Contract)
-        duration = self._duration_str(start, end)
-        bars = self._ib.reqHistoricalData(  # type: ignore[attr-defined]
-            contract,
-            endDateTime=end,
-            durationStr=duration,
-            barSizeSetting=self._bar_size(bar, config),
-            whatToShow=self.what_to_show,
-            useRTH=self.use_rth,
-            formatDate=1,
-            timeout=self.timeout,
-        )
-        rows = []
-        for bar_data in bars:
-            ts = bar_data.date
-            if isinstance(ts, datetime):
-                if ts.tzinfo is None:
-                    ts = ts.replace(tzinfo=timezone.utc)
-                ts_utc = ts.astimezone(timezone.utc).isoformat()
-            else:
-                ts_utc = datetime.combine(ts, datetime.min.time(), tzinfo=timezone.utc).isoformat()
-            rows.append(
-                {
-                    "ts_utc": ts_utc,
-                    "open": bar_data.open,
-                    "high": bar_data.high,
-                    "low": bar_data.low,
-                    "close": bar_data.close,
-                    "volume": int(bar_data.volume),
-                    "vwap": bar_data.average,
-                    "trade_count": bar_data.barCount,
-                }
-            )
-        return rows
+        return self._request_bars(contract, bar, start, end, config)
 
     def fetch_bars_for_contract(
         self, contract, bar: str, start: datetime, end: datetime, config
-    ) -> List[Mapping]:
+    ) -> BarBatch:
+        return self._request_bars(contract, bar, start, end, config)
+
+    def _bars_signature(self, contract, bar: str, start: datetime, end: datetime, config) -> Optional[tuple]:
+        """(conId, endDateTime, durationStr, barSizeSetting, whatToShow, useRTH)，未解析的合约不缓存。"""
+        con_id = getattr(contract, "conId", 0)
+        if not con_id:
+            return None
+        return (
+            "bars",
+            con_id,
+            self._end_datetime(end).isoformat(),
+            self._duration_str(start, end),
+            self._bar_size(bar, config),
+            config.what_to_show,
+            self.use_rth,
+        )
+
+    def has_cached_bars(self, contract, bar: str, start: datetime, end: datetime, config) -> bool:
+        if self.response_cache is None:
+            return False
+        signature = self._bars_signature(contract, bar, start, end, config)
+        return signature is not None and self.response_cache.contains(signature)
+
+    def _settled(self, end: datetime) -> bool:
+        age = datetime.now(timezone.utc) - self._end_datetime(end)
+        return age >= timedelta(hours=self.cache_settle_hours)
+
+    def _request_bars(self, contract, bar: str, start: datetime, end: datetime, config) -> BarBatch:
+        signature = None
+        if self.response_cache is not None:
+            signature = self._bars_signature(contract, bar, start, end, config)
+        if signature is not None:
+            cached = self.response_cache.get_bars(signature)
+            if self.metrics is not None:
+                self.metrics.record_cache(cached is not None)
+            if cached is not None:
+                return cached
+        if self.offline:
+            raise ResponseCacheMiss(f"响应缓存中没有该请求: {signature}")
         self._ensure_connected()
-        IB, Future, Contract, util = self._load_ib()
         duration = self._duration_str(start, end)
-        bars = self._ib.reqHistoricalData(  # type: ignore[attr-defined]
-            contract,
-            endDateTime=end,
-            durationStr=duration,
-            barSizeSetting=self._bar_size(bar, config),
-            whatToShow=self.what_to_show,
-            useRTH=self.use_rth,
-            formatDate=1,
-            timeout=self.timeout,
-        )
-        rows = []
-        for bar_data in bars:
-            ts = bar_data.date
-            if isinstance(ts, datetime):
-                if ts.tzinfo is None:
-                    ts = ts.replace(tzinfo=timezone.utc)
-                ts_utc = ts.astimezone(timezone.utc).isoformat()
-            else:
-                ts_utc = datetime.combine(ts, datetime.min.time(), tzinfo=timezone.utc).isoformat()
-            rows.append(
-                {
-                    "ts_utc": ts_utc,
-                    "open": bar_data.open,
-                    "high": bar_data.high,
-                    "low": bar_data.low,
-                    "close": bar_data.close,
-                    "volume": int(bar_data.volume),
-                    "vwap": bar_data.average,
-                    "trade_count": bar_data.barCount,
-                }
+        started = time.perf_counter()
+        with phase_label("ib_wait"):
+            bars = self._ib.reqHistoricalData(  # type: ignore[attr-defined]
+                contract,
+                endDateTime=self._end_datetime(end),
+                durationStr=duration,
+                barSizeSetting=self._bar_size(bar, config),
+                whatToShow=config.what_to_show,
+                useRTH=self.use_rth,
+                formatDate=1,
+                timeout=self.timeout,
             )
-        return rows
+        received = time.perf_counter()
+        with phase_label("normalize"):
+            batch = BarBatch.from_bar_data(bars)
+        if self.metrics is not None:
+            self.metrics.add_phase("ib_wait", received - started)
+            self.metrics.add_phase("normalize", time.perf_counter() - received)
+        if signature is not None and self._settled(end):
+            self.response_cache.put_bars(signature, batch)
+        return batch
 
     def _get_contfut_contract(self, symbol: str, config, Contract):
         symbol = symbol.upper()
@@ -216,20 +244,117 @@ class IBAsyncClient:
             raise ValueError(f"未找到合约: {symbol} {as_of.date().isoformat()}")
         return target
 
-    def list_fut_contracts(self, symbol: str, config=None) -> List[object]:
+    def head_timestamp(self, contract, what_to_show: Optional[str] = None) -> Optional[datetime]:
+        """返回合约最早有数据的时间（UTC，无时区），IB 无记录时返回 None。"""
+        what = what_to_show or self.what_to_show
+        signature = ("head", getattr(contract, "conId", 0), what, self.use_rth)
+        if self.offline:
+            cached = self.response_cache.get_json(signature) if self.response_cache is not None else None
+            if cached is None:
+                raise ResponseCacheMiss(f"响应缓存中没有该请求: {signature}")
+            return datetime.fromisoformat(cached["head"]) if cached["head"] else None
+        self._ensure_connected()
+        head = self._ib.reqHeadTimeStamp(  # type: ignore[attr-defined]
+            contract,
+            whatToShow=what,
+            useRTH=self.use_rth,
+            formatDate=2,
+        )
+        if not isinstance(head, datetime):
+            head = None
+        elif head.tzinfo is not None:
+            head = head.astimezone(timezone.utc).replace(tzinfo=None)
+        if self.response_cache is not None and signature[1]:
+            self.response_cache.put_json(signature, {"head": head.isoformat() if head else None})
+        return head
+
+    def fetch_ticks(
+        self, contract, start: datetime, end: datetime, what_to_show: str, pacer=None
+    ) -> TickBatch:
+        """按 IB 单次 1000 条的上限向后翻页拉取 [start, end) 的历史 tick。"""
+        self._ensure_connected()
+        start = start if start.tzinfo else start.replace(tzinfo=timezone.utc)
+        end = end if end.tzinfo else end.replace(tzinfo=timezone.utc)
+        pages = []
+        cursor = start
+        while cursor < end:
+            if pacer is not None:
+                pacer.wait()
+            ticks = self._ib.reqHistoricalTicks(  # type: ignore[attr-defined]
+                contract,
+                startDateTime=cursor,
+                endDateTime="",
+                numberOfTicks=1000,
+                whatToShow=what_to_show,
+                useRth=self.use_rth,
+                ignoreSize=False,
+            )
+            if not ticks:
+                break
+            pages.append(TickBatch.from_ticks(ticks, what_to_show))
+            # IB 会补齐最后一秒的全部 tick，下一页从下一秒开始即可不重不漏
+            cursor = ticks[-1].time.replace(microsecond=0) + timedelta(seconds=1)
+        return TickBatch.concat(what_to_show, pages).between(start, end)
+
+    def front_contract(self, symbol: str, config, as_of: Optional[datetime] = None):
         self._ensure_connected()
         IB, Future, Contract, util = self._load_ib()
+        return self._get_fut_contract_by_date(symbol, as_of or datetime.utcnow(), config, Contract)
+
+    def subscribe_realtime_bars(self, contract, on_bar: Callable[[object], None]):
+        """订阅 IB 5 秒实时K线，每根新 bar 回调 on_bar(RealTimeBar)。"""
+        self._ensure_connected()
+        bars = self._ib.reqRealTimeBars(  # type: ignore[attr-defined]
+            contract, 5, self.what_to_show, self.use_rth
+        )
+
+        def _on_update(bar_list, has_new_bar):
+            if has_new_bar and bar_list:
+                on_bar(bar_list[-1])
+
+        bars.updateEvent += _on_update
+        return bars
+
+    def cancel_realtime_bars(self, handle) -> None:
+        if self._ib is not None and self._ib.isConnected():
+            self._ib.cancelRealTimeBars(handle)
+
+    def is_connected(self) -> bool:
+        return self._ib is not None and self._ib.isConnected()
+
+    def wait(self, seconds: float) -> None:
+        """在 ib_async 事件循环中等待，期间处理订阅回调。"""
+        self._ib.sleep(seconds)  # type: ignore[attr-defined]
+
+    def list_fut_contracts(self, symbol: str, config=None) -> List[object]:
         symbol = symbol.upper()
+        exchange = config.contract_exchange.get(symbol, "")
+        currency = config.contract_currency.get(symbol, "")
+        signature = ("contracts", symbol, exchange, currency)
+        if self.offline:
+            cached = self.response_cache.get_json(signature) if self.response_cache is not None else None
+            if cached is None:
+                raise ResponseCacheMiss(f"响应缓存中没有该请求: {signature}")
+            return [CachedContract(**fields) for fields in cached]
+        self._ensure_connected()
+        IB, Future, Contract, util = self._load_ib()
         base = Contract()
         base.symbol = symbol
         base.secType = "FUT"
-        base.exchange = config.contract_exchange.get(symbol, "")
-        base.currency = config.contract_currency.get(symbol, "")
+        base.exchange = exchange
+        base.currency = currency
         base.includeExpired = True
         details = self._ib.reqContractDetails(base)  # type: ignore[attr-defined]
-        return [d.contract for d in details]
+        contracts = [d.contract for d in details]
+        # 合约列表会随新合约上市变化，联网时总是重新查询，缓存只供 replay 使用
+        if self.response_cache is not None:
+            self.response_cache.put_json(signature, [contract_fields(c) for c in contracts])
+        return contracts
 
     def close(self) -> None:
         if self._ib is not None:
             self._ib.disconnect()
             self._ib = None
+        if self.response_cache is not None:
+            self.response_cache.close()
+            self.response_cache = None
@@ -0,0 +1,426 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Dict, Optional, Sequence
+
+from .config import Config, default_config, merge_config
+from .contract_resolver import resolve_contract
+from .fetcher import (
+    _fetch_with_contract,
+    _record_failure,
+    _trim_to_window,
+    build_slice_requests,
+    interleave_requests,
+    resolve_time_range,
+)
+from .ib_client import IBAsyncClient
+from .metrics import retry_reason
+from .pacing import PacingLimiter
+from .report import FetchReport, JsonLinesReportSink, contract_label
+from .slicer import TimeSlice
+from .storage import ensure_db, insert_bars
+
+JOB_PENDING = "pending"
+JOB_LEASED = "leased"
+JOB_DONE = "done"
+JOB_NO_DATA = "no_data"
+JOB_FAILED = "failed"
+
+
+@dataclass
+class FetchJob:
+    id: int
+    symbol: str
+    bar: str
+    what_to_show: str
+    con_id: Optional[int]
+    start_utc: str
+    end_utc: str
+    attempts: int
+
+
+def create_job_table(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS fetch_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            symbol TEXT NOT NULL,
+            bar TEXT NOT NULL,
+            what_to_show TEXT NOT NULL,
+            con_id INTEGER,
+            start_utc TEXT NOT NULL,
+            end_utc TEXT NOT NULL,
+            state TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            lease_owner TEXT,
+            lease_until REAL,
+            next_eligible_at REAL NOT NULL,
+            rows INTEGER,
+            last_error TEXT,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            UNIQUE (symbol, bar, what_to_show, start_utc, end_utc)
+        )
+        """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_fetch_jobs_ready ON fetch_jobs (state, next_eligible_at)"
+    )
+
+
+def enqueue_fetch_jobs(
+    conn: sqlite3.Connection,
+    client,
+    symbols: Sequence[str],
+    bars: Sequence[str],
+    start: datetime,
+    end: datetime,
+    config: Config,
+    what_to_show: Optional[Sequence[str]] = None,
+    skip_stored: bool = False,
+) -> int:
+    """把 (合约, 周期, 分片) 展开为持久化任务；已存在的任务不会重复加入。"""
+    create_job_table(conn)
+    series = list(what_to_show or [config.what_to_show])
+    now = datetime.utcnow().isoformat()
+    added = 0
+    requests = []
+    for symbol in symbols:
+        requests.extend(
+            build_slice_requests(
+                client, conn, symbol, bars, start, end, config, series, skip_stored=skip_stored
+            )
+        )
+    # 按 id 顺序领取，入队时就按合约轮转排好
+    for request in interleave_requests(requests):
+        cursor = conn.execute(
+            """
+            INSERT OR IGNORE INTO fetch_jobs
+            (symbol, bar, what_to_show, con_id, start_utc, end_utc, state,
+             next_eligible_at, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, 0, ?, ?)
+            """,
+            (
+                request.symbol,
+                request.bar,
+                request.what_to_show,
+                getattr(request.contract, "conId", None),
+                request.time_slice.start.isoformat(),
+                request.time_slice.end.isoformat(),
+                JOB_PENDING,
+                now,
+                now,
+            ),
+        )
+        added += cursor.rowcount
+    conn.commit()
+    return added
+
+
+def claim_job(
+    conn: sqlite3.Connection, owner: str, lease_seconds: float, now: Optional[float] = None
+) -> Optional[FetchJob]:
+    """原子地领取一个到期任务；租约过期的任务（worker 崩溃）会被重新领取。"""
+    now = time.time() if now is None else now
+    row = conn.execute(
+        """
+        UPDATE fetch_jobs
+        SET state = ?, lease_owner = ?, lease_until = ?, attempts = attempts + 1, updated_at = ?
+        WHERE id = (
+            SELECT id FROM fetch_jobs
+            WHERE (state = ? AND next_eligible_at <= ?) OR (state = ? AND lease_until < ?)
+            ORDER BY next_eligible_at, id
+            LIMIT 1
+        )
+        RETURNING id, symbol, bar, what_to_show, con_id, start_utc, end_utc, attempts
+        """,
+        (
+            JOB_LEASED,
+            owner,
+            now + lease_seconds,
+            datetime.utcnow().isoformat(),
+            JOB_PENDING,
+            now,
+            JOB_LEASED,
+            now,
+        ),
+    ).fetchone()
+    conn.commit()
+    return FetchJob(*row) if row else None
+
+
+def renew_job_lease(conn: sqlite3.Connection, job: FetchJob, owner: str, lease_seconds: float) -> bool:
+    """把租约从现在起再延长 lease_seconds；任务已被别的 worker 接手时返回 False。"""
+    cursor = conn.execute(
+        "UPDATE fetch_jobs SET lease_until = ? WHERE id = ? AND state = ? AND lease_owner = ?",
+        (time.time() + lease_seconds, job.id, JOB_LEASED, owner),
+    )
+    conn.commit()
+    return cursor.rowcount == 1
+
+
+def finish_job(conn: sqlite3.Connection, job: FetchJob, state: str, rows: int = 0) -> None:
+    conn.execute(
+        """
+        UPDATE fetch_jobs
+        SET state = ?, rows = ?, lease_owner = NULL, lease_until = NULL, updated_at = ?
+        WHERE id = ?
+        """,
+        (state, rows, datetime.utcnow().isoformat(), job.id),
+    )
+    conn.commit()
+
+
+def fail_job(
+    conn: sqlite3.Connection, job: FetchJob, error: str, max_attempts: int, backoff_seconds: float
+) -> None:
+    """记录失败；未超过最大次数时按尝试次数退避后重新排队。"""
+    state = JOB_FAILED if job.attempts >= max_attempts else JOB_PENDING
+    conn.execute(
+        """
+        UPDATE fetch_jobs
+        SET state = ?, last_error = ?, lease_owner = NULL, lease_until = NULL,
+            next_eligible_at = ?, updated_at = ?
+        WHERE id = ?
+        """,
+        (
+            state,
+            error,
+            time.time() + backoff_seconds * job.attempts,
+            datetime.utcnow().isoformat(),
+            job.id,
+        ),
+    )
+    conn.commit()
+
+
+def job_counts(conn: sqlite3.Connection) -> Dict[str, int]:
+    create_job_table(conn)
+    return dict(conn.execute("SELECT state, COUNT(*) FROM fetch_jobs GROUP BY state").fetchall())
+
+
+def _next_pending_delay(conn: sqlite3.Connection) -> Optional[float]:
+    """距离最近一个退避中任务可领取还有多少秒；没有待处理任务时返回 None。"""
+    row = conn.execute(
+        "SELECT MIN(next_eligible_at) FROM fetch_jobs WHERE state = ?", (JOB_PENDING,)
+    ).fetchone()
+    if row is None or row[0] is None:
+        return None
+    return max(row[0] - time.time(), 0.0)
+
+
+def run_worker(
+    db_path: str,
+    client,
+    config: Config,
+    pacer: PacingLimiter,
+    report: FetchReport,
+    owner: Optional[str] = None,
+    lock: Optional[threading.Lock] = None,
+) -> None:
+    """循环领取并执行任务，直到没有可领取的任务。"""
+    owner = owner or f"{os.getpid()}-{threading.get_ident()}"
+    lock = lock or threading.Lock()
+    conn = ensure_db(db_path, busy_timeout=config.sqlite_busy_timeout, wal=config.sqlite_wal)
+    create_job_table(conn)
+    contracts: Dict[str, Dict[int, object]] = {}
+    try:
+        while True:
+            job = claim_job(conn, owner, config.job_lease_seconds)
+            if job is None:
+                delay = _next_pending_delay(conn)
+                if delay is None:
+                    break
+                time.sleep(delay)
+                continue
+            # 领到任务才占用限速额度；等待之后续租，排队时间不计入租约
+            pacer.wait(job.bar)
+            if not renew_job_lease(conn, job, owner, config.job_lease_seconds):
+                continue
+            series_cfg = merge_config(config, what_to_show=job.what_to_show)
+            time_slice = TimeSlice(
+                start=datetime.fromisoformat(job.start_utc), end=datetime.fromisoformat(job.end_utc)
+            )
+            contract = None
+            try:
+                contract = _job_contract(client, job, config, contracts)
+                rows = _fetch_with_contract(
+                    client, job.symbol, job.bar, time_slice.start, time_slice.end, series_cfg, contract
+                )
+            except Exception as exc:  # noqa: BLE001
+                with lock:
+                    _record_failure(
+                        conn,
+                        report,
+                        job.symbol,
+                        job.bar,
+                        job.what_to_show,
+                        time_slice,
+                        job.attempts,
+                        str(exc),
+                        False,
+                        contract=contract,
+                        retrying=job.attempts < config.retry_rounds,
+                    )
+                fail_job(
+                    conn,
+                    job,
+                    f"{retry_reason(exc)}: {exc}",
+                    config.retry_rounds,
+                    config.pacing_sleep_seconds,
+                )
+                continue
+            rows, _ = _trim_to_window(rows, time_slice)
+            if not rows:
+                with lock:
+                    _record_failure(
+                        conn,
+                        report,
+                        job.symbol,
+                        job.bar,
+                        job.what_to_show,
+                        time_slice,
+                        job.attempts,
+                        "no_data",
+                        True,
+                        contract=contract,
+                    )
+                finish_job(conn, job, JOB_NO_DATA)
+                continue
+            written = insert_bars(conn, job.symbol, job.bar, rows, what_to_show=job.what_to_show)
+            with lock:
+                report.record_slice(
+                    job.symbol,
+                    job.bar,
+                    job.what_to_show,
+                    contract_label(contract),
+                    job.start_utc,
+                    job.end_utc,
+                    written,
+                )
+            # 写入与任务完成在同一事务提交，崩溃后不会出现“已写库但仍待处理”
+            finish_job(conn, job, JOB_DONE, written)
+    finally:
+        conn.close()
+
+
+def _job_contract(client, job: FetchJob, config: Config, cache: Dict[str, Dict[int, object]]):
+    if job.con_id is None or not hasattr(client, "list_fut_contracts"):
+        return None
+    if job.symbol not in cache:
+        cache[job.symbol] = {
+            getattr(c, "conId", None): c for c in client.list_fut_contracts(job.symbol, config=config)
+        }
+    contract = cache[job.symbol].get(job.con_id)
+    if contract is None:
+        raise ValueError(f"未找到任务对应的合约: {job.symbol} conId={job.con_id}")
+    return contract
+
+
+def queue_fetch(
+    symbols: Sequence[str],
+    bars: Sequence[str],
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    lookback: Optional[str] = None,
+    config: Optional[Config] = None,
+    db_path: str = "data/ib_history.sqlite",
+    what_to_show: Optional[Sequence[str]] = None,
+    workers: int = 1,
+    client_factory: Optional[Callable[[int], object]] = None,
+    pacer: Optional[PacingLimiter] = None,
+    skip_stored: bool = False,
+    events_out: Optional[str] = None,
+) -> FetchReport:
+    """先把整个计划写入任务表，再由 worker 执行；中断后可用 run_jobs 继续。"""
+    cfg = merge_config(config or default_config())
+    start, end = resolve_time_range(start, end, lookback)
+    factory = client_factory or (lambda index: IBAsyncClient.from_config(cfg, resolve_contract))
+    client = factory(0)
+    conn = ensure_db(db_path)
+    try:
+        enqueue_fetch_jobs(
+            conn, client, symbols, bars, start, end, cfg, what_to_show, skip_stored=skip_stored
+        )
+    finally:
+        conn.close()
+        client.close()
+    report = run_jobs(
+        db_path,
+        cfg,
+        workers=workers,
+        client_factory=client_factory,
+        pacer=pacer,
+        events_out=events_out,
+    )
+    report.ranges = [{"start": start.isoformat(), "end": end.isoformat()}]
+    return report
+
+
+def run_jobs(
+    db_path: str,
+    config: Optional[Config] = None,
+    workers: int = 1,
+    client_factory: Optional[Callable[[int], object]] = None,
+    pacer: Optional[PacingLimiter] = None,
+    events_out: Optional[str] = None,
+) -> FetchReport:
+    """用 workers 个线程（各自独立的 IB 连接与数据库连接）处理任务队列。"""
+    cfg = merge_config(config or default_config())
+    owns_pacer = pacer is None
+    pacer = pacer or PacingLimiter.from_config(cfg)
+    report = FetchReport(
+        symbols=[],
+        bars=[],
+        ranges=[],
+        keep_records=events_out is None,
+        sink=JsonLinesReportSink(events_out) if events_out else None,
+    )
+    lock = threading.Lock()
+    factory = client_factory or (
+        lambda index: IBAsyncClient.from_config(
+            merge_config(cfg, ib_client_id=cfg.ib_client_id + index), resolve_contract
+        )
+    )
+
+    def _work(index: int) -> None:
+        client = factory(index)
+        try:
+            run_worker(db_path, client, cfg, pacer, report, lock=lock)
+        finally:
+            client.close()
+
+    def _thread_main(index: int) -> None:
+        # ib_async 的同步接口需要当前线程有事件循环
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        _work(index)
+
+    try:
+        if workers <= 1:
+            _work(0)
+        else:
+            threads = [
+                threading.Thread(target=_thread_main, args=(i,), daemon=True) for i in range(workers)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+    finally:
+        report.close()
+        if owns_pacer and hasattr(pacer, "close"):
+            pacer.close()
+    conn = ensure_db(db_path)
+    try:
+        rows = conn.execute("SELECT DISTINCT symbol, bar FROM fetch_jobs").fetchall()
+    finally:
+        conn.close()
+    report.symbols = sorted({symbol for symbol, _ in rows})
+    report.bars = sorted({bar for _, bar in rows})
+    return report
@@ -0,0 +1,238 @@
+from __future__ import annotations
+
+import json
+import os
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+from .profiling import phase_label, record_span
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, float("inf"))
+
+
+def retry_reason(exc: BaseException) -> str:
+    """把异常归类为便于统计的重试原因。"""
+    text = str(exc).lower()
+    if "pacing" in text:
+        return "pacing_violation"
+    if isinstance(exc, TimeoutError) or "timeout" in text or "timed out" in text:
+        return "timeout"
+    if "connect" in text:
+        return "connection"
+    return type(exc).__name__
+
+
+def attach_metrics(client, metrics: Optional["FetchMetrics"]) -> Optional["FetchMetrics"]:
+    """把 metrics 挂到客户端上（IBAsyncClient 借此记录 IB 等待与缓存命中），返回原来挂着的值。
+
+    客户端可能由调用方持有、跨多次拉取共用（会话、实时流守护进程），用完要用返回值恢复。
+    """
+    if not hasattr(client, "metrics"):
+        return None
+    previous = client.metrics
+    client.metrics = metrics
+    return previous
+
+
+class JsonLinesMetricsSink:
+    """每个请求追加一行 JSON，结束时追加汇总行，可边跑边 tail。"""
+
+    def __init__(self, path: str) -> None:
+        target = Path(path)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        self._fh = target.open("a", encoding="utf-8")
+
+    def on_request(self, metrics: "FetchMetrics", event: Dict) -> None:
+        self._fh.write(json.dumps(event, ensure_ascii=False) + "\n")
+        self._fh.flush()
+
+    def close(self, metrics: "FetchMetrics") -> None:
+        self._fh.write(json.dumps({"event": "summary", **metrics.summary()}, ensure_ascii=False) + "\n")
+        self._fh.close()
+
+
+class PrometheusTextfileSink:
+    """按间隔整体重写 node_exporter textfile 格式的指标文件。"""
+
+    def __init__(self, path: str, interval: float = 10.0) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.interval = interval
+        self._last_write = 0.0
+
+    def on_request(self, metrics: "FetchMetrics", event: Dict) -> None:
+        if time.monotonic() - self._last_write >= self.interval:
+            self._write(metrics)
+
+    def close(self, metrics: "FetchMetrics") -> None:
+        self._write(metrics)
+
+    def _write(self, metrics: "FetchMetrics") -> None:
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(metrics.to_prometheus(), encoding="utf-8")
+        os.replace(tmp, self.path)
+        self._last_write = time.monotonic()
+
+
+@dataclass
+class FetchMetrics:
+    """一次拉取的请求延迟分布、分阶段耗时、写入行数与重试原因。"""
+
+    sink: Optional[object] = None
+    requests: int = 0
+    rows: int = 0
+    overlap_rows: int = 0
+    rows_inserted: int = 0
+    rows_updated: int = 0
+    rows_unchanged: int = 0
+    cache_hits: int = 0
+    cache_misses: int = 0
+    no_data: int = 0
+    latency_sum: float = 0.0
+    latency_counts: List[int] = field(default_factory=lambda: [0] * len(LATENCY_BUCKETS))
+    phase_seconds: Dict[str, float] = field(default_factory=dict)
+    retries: Dict[str, int] = field(default_factory=dict)
+    _started: float = field(default_factory=time.monotonic)
+
+    def add_phase(self, name: str, seconds: float) -> None:
+        self.phase_seconds[name] = self.phase_seconds.get(name, 0.0) + seconds
+        record_span(name, seconds)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            with phase_label(name):
+                yield
+        finally:
+            self.add_phase(name, time.perf_counter() - started)
+
+    def observe_request(self, seconds: float, rows: int, outcome: str, **labels) -> None:
+        self.requests += 1
+        self.latency_sum += seconds
+        for idx, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.latency_counts[idx] += 1
+                break
+        if outcome == "no_data":
+            self.no_data += 1
+        if self.sink is not None:
+            event = {
+                "event": "request",
+                "ts": time.time(),
+                "outcome": outcome,
+                "latency": round(seconds, 6),
+                "rows": rows,
+                **labels,
+            }
+            self.sink.on_request(self, event)
+
+    def add_rows(self, rows: int) -> None:
+        self.rows += rows
+
+    def add_write(self, stats) -> None:
+        """累计 storage.WriteStats：rows 仍按收到的行数计，另外拆分实际改写的行数。"""
+        self.rows += stats.received
+        self.rows_inserted += stats.inserted
+        self.rows_updated += stats.updated
+        self.rows_unchanged += stats.unchanged
+
+    def add_overlap(self, rows: int) -> None:
+        """响应中落在请求窗口之外、写库前被裁掉的K线数。"""
+        self.overlap_rows += rows
+
+    def record_cache(self, hit: bool) -> None:
+        """IB 响应缓存的一次查询结果。"""
+        if hit:
+            self.cache_hits += 1
+        else:
+            self.cache_misses += 1
+
+    def record_retry(self, reason: str) -> None:
+        self.retries[reason] = self.retries.get(reason, 0) + 1
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self._started
+
+    def summary(self) -> Dict:
+        elapsed = self.elapsed()
+        cumulative = 0
+        histogram = {}
+        for bound, count in zip(LATENCY_BUCKETS, self.latency_counts):
+            cumulative += count
+            histogram["+Inf" if bound == float("inf") else str(bound)] = cumulative
+        return {
+            "elapsed_seconds": round(elapsed, 3),
+            "requests": self.requests,
+            "no_data": self.no_data,
+            "rows": self.rows,
+            "rows_per_second": round(self.rows / elapsed, 3) if elapsed > 0 else 0.0,
+            "overlap_rows": self.overlap_rows,
+            "writes": {
+                "inserted": self.rows_inserted,
+                "updated": self.rows_updated,
+                "unchanged": self.rows_unchanged,
+                # 实际改写行数 / 收到行数，重拉已入库数据时接近 0
+                "write_ratio": round((self.rows_inserted + self.rows_updated) / self.rows, 4)
+                if self.rows
+                else 0.0,
+            },
+            "response_cache": {"hits": self.cache_hits, "misses": self.cache_misses},
+            "latency_seconds": {
+                "sum": round(self.latency_sum, 6),
+                "mean": round(self.latency_sum / self.requests, 6) if self.requests else 0.0,
+                "buckets": histogram,
+            },
+            "phase_seconds": {k: round(v, 6) for k, v in sorted(self.phase_seconds.items())},
+            "retries": dict(sorted(self.retries.items())),
+        }
+
+    def to_prometheus(self) -> str:
+        lines = [
+            "# TYPE ib_history_fetch_requests_total counter",
+            f"ib_history_fetch_requests_total {self.requests}",
+            "# TYPE ib_history_fetch_rows_total counter",
+            f"ib_history_fetch_rows_total {self.rows}",
+            "# TYPE ib_history_fetch_written_rows_total counter",
+            f'ib_history_fetch_written_rows_total{{kind="inserted"}} {self.rows_inserted}',
+            f'ib_history_fetch_written_rows_total{{kind="updated"}} {self.rows_updated}',
+            f'ib_history_fetch_written_rows_total{{kind="unchanged"}} {self.rows_unchanged}',
+            "# TYPE ib_history_fetch_overlap_rows_total counter",
+            f"ib_history_fetch_overlap_rows_total {self.overlap_rows}",
+            "# TYPE ib_history_fetch_response_cache_total counter",
+            f'ib_history_fetch_response_cache_total{{result="hit"}} {self.cache_hits}',
+            f'ib_history_fetch_response_cache_total{{result="miss"}} {self.cache_misses}',
+            "# TYPE ib_history_fetch_request_seconds histogram",
+        ]
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.latency_counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f'ib_history_fetch_request_seconds_bucket{{le="{le}"}} {cumulative}')
+        lines.append(f"ib_history_fetch_request_seconds_sum {self.latency_sum}")
+        lines.append(f"ib_history_fetch_request_seconds_count {self.requests}")
+        lines.append("# TYPE ib_history_fetch_phase_seconds_total counter")
+        for name, seconds in sorted(self.phase_seconds.items()):
+            lines.append(f'ib_history_fetch_phase_seconds_total{{phase="{name}"}} {seconds}')
+        lines.append("# TYPE ib_history_fetch_retries_total counter")
+        for reason, count in sorted(self.retries.items()):
+            lines.append(f'ib_history_fetch_retries_total{{reason="{reason}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    def close(self) -> None:
+        if self.sink is not None:
+            self.sink.close(self)
+            self.sink = None
+
+
+def build_metrics(path: Optional[str] = None, fmt: str = "jsonl") -> FetchMetrics:
+    if path is None:
+        return FetchMetrics()
+    if fmt == "jsonl":
+        return FetchMetrics(sink=JsonLinesMetricsSink(path))
+    if fmt == "prom":
+        return FetchMetrics(sink=PrometheusTextfileSink(path))
+    raise ValueError(f"不支持的指标格式: {fmt}")
@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Optional
+
+from .bars import bar_seconds
+
+# IB 的「10 分钟 60 次」只约束 30 秒及以下的K线（以及 tick）请求
+WINDOW_MAX_BAR_SECONDS = 30
+
+
+def counts_toward_window(bar: Optional[str]) -> bool:
+    """该周期的请求是否计入滑动窗口上限；不知道周期（None）或 tick 时按计入处理。"""
+    if bar is None or not bar[-1:].isalpha() or not bar[:-1].isdigit():
+        return True
+    return bar_seconds(bar) <= WINDOW_MAX_BAR_SECONDS
+
+
+@dataclass
+class PacingLimiter:
+    """IB 历史数据限速：相邻请求最小间隔 + 滑动窗口内的请求上限（默认 10 分钟 60 次）。
+
+    窗口上限只对 30 秒及以下的K线请求生效（见 counts_toward_window），分钟及以上的K线只受最小间隔约束。
+    """
+
+    min_interval: float = 1.5
+    max_requests: int = 60
+    window_seconds: float = 600.0
+    clock: Callable[[], float] = time.monotonic
+    sleep: Callable[[float], None] = time.sleep
+    # 窗口内计入上限的请求时间
+    _history: Deque[float] = field(default_factory=deque)
+    _last: Optional[float] = None
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    @classmethod
+    def from_config(cls, config) -> "PacingLimiter":
+        """配置了 pacing_ledger_path 时返回跨进程共享的限速器。"""
+        if cls is PacingLimiter and config.pacing_ledger_path:
+            return SharedPacingLimiter(
+                min_interval=config.pacing_sleep_seconds,
+                max_requests=config.pacing_max_requests,
+                window_seconds=config.pacing_window_seconds,
+                ledger_path=config.pacing_ledger_path,
+                key=f"{config.ib_host}:{config.ib_port}",
+            )
+        return cls(
+            min_interval=config.pacing_sleep_seconds,
+            max_requests=config.pacing_max_requests,
+            window_seconds=config.pacing_window_seconds,
+        )
+
+    @classmethod
+    def unlimited(cls) -> "PacingLimiter":
+        """不限速，用于由其他地方（如会话守护进程）统一限速的场景。"""
+        return cls(min_interval=0.0, max_requests=10**9)
+
+    def delay(self, bar: Optional[str] = None) -> float:
+        """下一次 bar 周期的请求前还需等待的秒数。"""
+        now = self.clock()
+        while self._history and self._history[0] <= now - self.window_seconds:
+            self._history.popleft()
+        delay = 0.0
+        if self._last is not None:
+            delay = self._last + self.min_interval - now
+        if counts_toward_window(bar) and len(self._history) >= self.max_requests:
+            delay = max(delay, self._history[0] + self.window_seconds - now)
+        return max(delay, 0.0)
+
+    def wait(self, bar: Optional[str] = None) -> float:
+        """阻塞到允许发出下一次 bar 周期的请求，并登记本次请求；返回实际等待秒数。
+
+        多个线程共用同一个实例时，等待在锁内进行，保证整体不超限。
+        """
+        with self._lock:
+            delay = self.delay(bar)
+            if delay > 0:
+                self.sleep(delay)
+            self._last = self.clock()
+            if counts_toward_window(bar):
+                self._history.append(self._last)
+            return delay
+
+
+@dataclass
+class SharedPacingLimiter(PacingLimiter):
+    """把请求时间登记在 SQLite 账本里，连同一个 Gateway（key）的多个进程共同遵守限速。
+
+    账本用墙上时间；判断与登记在同一个 IMMEDIATE 事务里完成，等待时不持锁。
+    """
+
+    ledger_path: str = "data/pacing_ledger.sqlite"
+    key: str = ""
+    clock: Callable[[], float] = time.time
+    _conn: Optional[sqlite3.Connection] = field(default=None, repr=False)
+
+    def _ledger(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.ledger_path) or ".", exist_ok=True)
+            # 自动提交模式，事务边界由下面的 BEGIN IMMEDIATE / COMMIT 显式控制
+            conn = sqlite3.connect(
+                self.ledger_path, timeout=30.0, isolation_level=None, check_same_thread=False
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS pacing_ledger "
+                "(key TEXT NOT NULL, ts REAL NOT NULL, windowed INTEGER NOT NULL DEFAULT 1)"
+            )
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(pacing_ledger)")}
+            if "windowed" not in columns:
+                conn.execute("ALTER TABLE pacing_ledger ADD COLUMN windowed INTEGER NOT NULL DEFAULT 1")
+            conn.execute("CREATE INDEX IF NOT EXISTS pacing_ledger_key_ts ON pacing_ledger (key, ts)")
+            self._conn = conn
+        return self._conn
+
+    def wait(self, bar: Optional[str] = None) -> float:
+        windowed = counts_toward_window(bar)
+        waited = 0.0
+        with self._lock:
+            conn = self._ledger()
+            while True:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    now = self.clock()
+                    conn.execute(
+                        "DELETE FROM pacing_ledger WHERE key = ? AND ts <= ?",
+                        (self.key, now - self.window_seconds),
+                    )
+                    rows = conn.execute(
+                        "SELECT ts, windowed FROM pacing_ledger WHERE key = ? ORDER BY ts", (self.key,)
+                    ).fetchall()
+                    self._history = deque(ts for ts, counted in rows if counted)
+                    self._last = rows[-1][0] if rows else None
+                    delay = self.delay(bar)
+                    if delay <= 0:
+                        conn.execute(
+                            "INSERT INTO pacing_ledger (key, ts, windowed) VALUES (?, ?, ?)",
+                            (self.key, now, int(windowed)),
+                        )
+                    conn.execute("COMMIT")
+                except BaseException:
+                    conn.execute("ROLLBACK")
+                    raise
+                if delay <= 0:
+                    return waited
+                # 等待期间其他进程可能抢先登记，醒来后重新判断
+                self.sleep(delay)
+                waited += delay
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+import heapq
+import json
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+from .config import Config, default_config, merge_config
+from .contract_resolver import resolve_contract
+from .fetcher import SliceRequest, expand_slice_requests, interleave_requests, resolve_time_range
+from .ib_client import DataClient, IBAsyncClient
+from .pacing import PacingLimiter
+from .storage import ensure_db
+
+
+@dataclass
+class FetchPlan:
+    symbols: List[str]
+    bars: List[str]
+    what_to_show: List[str]
+    start: datetime
+    end: datetime
+    connections: int
+    requests: List[SliceRequest] = field(default_factory=list)
+    total_requests: int = 0
+    estimated_seconds: float = 0.0
+
+    @property
+    def skipped_requests(self) -> int:
+        return self.total_requests - len(self.requests)
+
+    def to_dict(self) -> Dict:
+        by_symbol: Dict[str, int] = {}
+        for request in self.requests:
+            by_symbol[request.symbol] = by_symbol.get(request.symbol, 0) + 1
+        return {
+            "symbols": self.symbols,
+            "bars": self.bars,
+            "what_to_show": self.what_to_show,
+            "range": {"start": self.start.isoformat(), "end": self.end.isoformat()},
+            "connections": self.connections,
+            "requests": len(self.requests),
+            "skipped_stored": self.skipped_requests,
+            "requests_by_symbol": by_symbol,
+            "estimated_seconds": round(self.estimated_seconds, 1),
+            "plan": [
+                {
+                    "symbol": r.symbol,
+                    "bar": r.bar,
+                    "what_to_show": r.what_to_show,
+                    "con_id": getattr(r.contract, "conId", None),
+                    "local_symbol": getattr(r.contract, "localSymbol", None),
+                    "start": r.time_slice.start.isoformat(),
+                    "end": r.time_slice.end.isoformat(),
+                }
+                for r in self.requests
+            ],
+        }
+
+    def write_json(self, path: str) -> None:
+        target = Path(path)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_text(json.dumps(self.to_dict(), indent=2, ensure_ascii=False))
+
+
+def estimate_seconds(
+    request_count: int,
+    config: Config,
+    connections: int = 1,
+    request_seconds: float = 1.0,
+    bars: Optional[Sequence[str]] = None,
+) -> float:
+    """在虚拟时钟上回放 PacingLimiter，估算 N 个请求在限速下的总耗时。
+
+    各连接共享同一个限速器；每个请求占用连接 request_seconds。bars 为各请求的周期，
+    决定是否计入窗口上限，缺省时全部计入。
+    """
+    if request_count <= 0:
+        return 0.0
+    now = [0.0]
+
+    def _sleep(seconds: float) -> None:
+        now[0] += seconds
+
+    pacer = PacingLimiter(
+        min_interval=config.pacing_sleep_seconds,
+        max_requests=config.pacing_max_requests,
+        window_seconds=config.pacing_window_seconds,
+        clock=lambda: now[0],
+        sleep=_sleep,
+    )
+    free_at = [0.0] * max(connections, 1)
+    finished = 0.0
+    for idx in range(request_count):
+        now[0] = max(now[0], heapq.heappop(free_at))
+        pacer.wait(bars[idx] if bars is not None else None)
+        done = now[0] + request_seconds
+        heapq.heappush(free_at, done)
+        finished = max(finished, done)
+    return finished
+
+
+def plan_fetch(
+    symbols: Sequence[str],
+    bars: Sequence[str],
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    lookback: Optional[str] = None,
+    config: Optional[Config] = None,
+    db_path: str = "data/ib_history.sqlite",
+    client: Optional[DataClient] = None,
+    what_to_show: Optional[Sequence[str]] = None,
+    connections: int = 1,
+    skip_stored: bool = True,
+    request_seconds: Optional[float] = None,
+) -> FetchPlan:
+    """展开合约区间 × 分片为请求计划，扣除已入库部分并估算限速下的耗时。"""
+    cfg = merge_config(config or default_config())
+    start, end = resolve_time_range(start, end, lookback)
+    series = list(what_to_show or [cfg.what_to_show])
+    owns_client = client is None
+    client = client or IBAsyncClient.from_config(cfg, resolve_contract)
+    conn = ensure_db(db_path)
+    try:
+        requests: List[SliceRequest] = []
+        total = 0
+        for symbol in symbols:
+            expanded, count = expand_slice_requests(
+                client, conn, symbol, bars, start, end, cfg, series, skip_stored=skip_stored
+            )
+            requests.extend(expanded)
+            total += count
+    finally:
+        conn.close()
+        if owns_client:
+            client.close()
+    ordered = interleave_requests(requests)
+    return FetchPlan(
+        symbols=list(symbols),
+        bars=list(bars),
+        what_to_show=series,
+        start=start,
+        end=end,
+        connections=connections,
+        requests=ordered,
+        total_requests=total,
+        estimated_seconds=estimate_seconds(
+            len(ordered),
+            cfg,
+            connections,
+            cfg.plan_request_seconds if request_seconds is None else request_seconds,
+            [r.bar for r in ordered],
+        ),
+    )
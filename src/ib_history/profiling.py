@@ -0,0 +1,195 @@
+from __future__ import annotations
+
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+# sample：后台线程定时抓取各线程调用栈（开销小，覆盖所有线程）；
+# cprofile：另外用 cProfile 精确统计主线程的函数调用次数与耗时
+MODES = ("sample", "cprofile")
+
+_ACTIVE: Optional["Profiler"] = None
+
+
+@contextmanager
+def phase_label(name: str) -> Iterator[None]:
+    """把当前线程这段时间内的采样归到阶段 name 下；未开启 profiling 时什么也不做。"""
+    profiler = _ACTIVE
+    if profiler is None:
+        yield
+        return
+    stack = profiler._labels.setdefault(threading.get_ident(), [])
+    stack.append(name)
+    try:
+        yield
+    finally:
+        stack.pop()
+
+
+def record_span(name: str, seconds: float) -> None:
+    profiler = _ACTIVE
+    if profiler is not None:
+        profiler.add_span(name, seconds)
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """计时并标记一个命名阶段，结果进入 profile 的阶段汇总。"""
+    started = time.perf_counter()
+    try:
+        with phase_label(name):
+            yield
+    finally:
+        record_span(name, time.perf_counter() - started)
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+
+
+@dataclass
+class Profiler:
+    """一次命令运行的 profile：调用栈采样（可选 cProfile）加命名阶段的墙钟耗时。
+
+    结束时写出 {prefix}.collapsed（折叠栈，可直接交给 flamegraph.pl / speedscope）、
+    {prefix}.phases.json（阶段汇总与最热函数），cprofile 模式另有 {prefix}.pstats。
+    采样栈以所在阶段 phase:<name> 为根，便于在火焰图里按阶段对比。
+    """
+
+    prefix: str
+    mode: str = "sample"
+    interval: float = 0.005
+    command: str = ""
+    stacks: Counter = field(default_factory=Counter)
+    spans: Dict[str, List[float]] = field(default_factory=dict)
+    samples: int = 0
+    wall_seconds: float = 0.0
+    _labels: Dict[int, List[str]] = field(default_factory=dict, repr=False)
+    _stop: threading.Event = field(default_factory=threading.Event, repr=False)
+    _thread: Optional[threading.Thread] = field(default=None, repr=False)
+    _cprofile: Optional[object] = field(default=None, repr=False)
+    _started: float = 0.0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def __post_init__(self) -> None:
+        if self.mode not in MODES:
+            raise ValueError(f"不支持的 profile 模式: {self.mode}")
+
+    def add_span(self, name: str, seconds: float) -> None:
+        with self._lock:
+            entry = self.spans.setdefault(name, [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+
+    def _sample_once(self) -> None:
+        me = threading.get_ident()
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            names = []
+            while frame is not None:
+                names.append(_frame_name(frame))
+                frame = frame.f_back
+            names.reverse()
+            labels = list(self._labels.get(ident, ()))
+            root = f"phase:{labels[-1]}" if labels else "phase:other"
+            self.stacks[";".join([root, *names])] += 1
+            self.samples += 1
+
+    def _run_sampler(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._sample_once()
+
+    def start(self) -> "Profiler":
+        global _ACTIVE
+        _ACTIVE = self
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run_sampler, name="ib-history-profiler", daemon=True)
+        self._thread.start()
+        if self.mode == "cprofile":
+            import cProfile
+
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        return self
+
+    def stop(self) -> None:
+        global _ACTIVE
+        if self._cprofile is not None:
+            self._cprofile.disable()
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.wall_seconds = time.perf_counter() - self._started
+        _ACTIVE = None
+
+    def summary(self) -> Dict:
+        wall = self.wall_seconds or 1e-9
+        leaf = Counter()
+        for stack, count in self.stacks.items():
+            leaf[stack.rsplit(";", 1)[-1]] += count
+        return {
+            "command": self.command,
+            "mode": self.mode,
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "wall_seconds": round(self.wall_seconds, 6),
+            "samples": self.samples,
+            "interval_seconds": self.interval,
+            "phases": {
+                name: {"count": count, "seconds": round(seconds, 6), "share": round(seconds / wall, 4)}
+                for name, (count, seconds) in sorted(self.spans.items(), key=lambda item: -item[1][1])
+            },
+            # 按采样落在函数自身（栈顶）的次数排序
+            "top_functions": [{"function": name, "samples": count} for name, count in leaf.most_common(20)],
+        }
+
+    def write(self) -> Dict[str, str]:
+        target = Path(self.prefix)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        paths = {
+            "collapsed": f"{self.prefix}.collapsed",
+            "phases": f"{self.prefix}.phases.json",
+        }
+        with open(paths["collapsed"], "w", encoding="utf-8") as handle:
+            for stack, count in sorted(self.stacks.items()):
+                handle.write(f"{stack} {count}\n")
+        Path(paths["phases"]).write_text(
+            json.dumps(self.summary(), indent=2, ensure_ascii=False), encoding="utf-8"
+        )
+        if self._cprofile is not None:
+            paths["pstats"] = f"{self.prefix}.pstats"
+            self._cprofile.dump_stats(paths["pstats"])
+        return paths
+
+
+def default_prefix(command: str, root: str = "reports/profile") -> str:
+    return str(Path(root) / f"{command}-{datetime.now().strftime('%Y%m%d-%H%M%S')}")
+
+
+@contextmanager
+def profile_run(mode: Optional[str], prefix: Optional[str], command: str) -> Iterator[Optional[Profiler]]:
+    """mode 为 None 时不做 profiling，直接执行。"""
+    if mode is None:
+        yield None
+        return
+    profiler = Profiler(prefix=prefix or default_prefix(command), mode=mode, command=command)
+    profiler.start()
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+        paths = profiler.write()
+        phases = ", ".join(
+            f"{name} {entry['seconds']:.2f}s" for name, entry in profiler.summary()["phases"].items()
+        )
+        print(f"[profile] 总耗时 {profiler.wall_seconds:.2f}s | 采样 {profiler.samples} | 阶段: {phases or '无'}")
+        print(f"[profile] 已写入: {', '.join(paths.values())}")
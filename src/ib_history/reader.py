@@ -0,0 +1,301 @@
+from __future__ import annotations
+
+import heapq
+import sqlite3
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .bars import BAR_DTYPE, BarBatch
+from .cold import read_block
+from .storage import BAR_COLUMNS, DEFAULT_WHAT_TO_SHOW, bars_table, cold_blocks
+
+
+def load_aligned_series(
+    conn: sqlite3.Connection,
+    symbol: str,
+    bar: str,
+    what_to_show: Sequence[str],
+    start_utc: Optional[str] = None,
+    end_utc: Optional[str] = None,
+) -> Dict[str, Dict[str, np.ndarray]]:
+    """读出多个 whatToShow 序列，按时间戳并集对齐，缺失值为 NaN；已归档的月份从冷存储块读出。
+
+    返回 {"ts": {"epoch": int64秒}, "TRADES": {"open": ..., ...}, "BID_ASK": {...}}。
+    """
+    series = []
+    for what in what_to_show:
+        parts = list(
+            read_column_chunks(conn, symbol, bar, what, BAR_COLUMNS, start_utc=start_utc, end_utc=end_utc)
+        )
+        if parts:
+            series.append((np.concatenate([ts for ts, _ in parts]), np.concatenate([m for _, m in parts])))
+        else:
+            series.append((np.empty(0, dtype=np.int64), np.empty((0, len(BAR_COLUMNS)))))
+    epoch = np.unique(np.concatenate([ts for ts, _ in series]))
+    result: Dict[str, Dict[str, np.ndarray]] = {"ts": {"epoch": epoch}}
+    for what, (ts, matrix) in zip(what_to_show, series):
+        aligned = np.full((len(epoch), len(BAR_COLUMNS)), np.nan)
+        aligned[np.searchsorted(epoch, ts)] = matrix
+        result[what] = {col: aligned[:, offset] for offset, col in enumerate(BAR_COLUMNS)}
+    return result
+
+
+def read_column_chunks(
+    conn: sqlite3.Connection,
+    symbol: str,
+    bar: str,
+    what_to_show: str = DEFAULT_WHAT_TO_SHOW,
+    columns: Sequence[str] = BAR_COLUMNS,
+    chunk_rows: int = 500_000,
+    start_utc: Optional[str] = None,
+    end_utc: Optional[str] = None,
+) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """按时间顺序分块读出 (epoch 秒, float64 矩阵)，columns 可以是 SQL 表达式。
+
+    内存只与 chunk_rows 有关；耗时主要在逐个构造 Python 对象，只取需要的列最划算。
+    NULL 读为 NaN。已归档到冷存储的月份透明地从压缩块读出（此时只支持原始列名），
+    同一时间戳热表优先。
+    """
+    table = bars_table(symbol, bar, what_to_show)
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+    ).fetchone()
+    blocks = cold_blocks(conn, table, start_utc, end_utc)
+    hot = _hot_column_chunks(conn, table, columns, chunk_rows, start_utc, end_utc) if exists else iter(())
+    if not blocks:
+        yield from hot
+        return
+    unknown = [col for col in columns if col not in BAR_COLUMNS]
+    if unknown:
+        raise ValueError(f"冷存储块只能读原始列，不支持: {unknown}")
+    lo = _text_epoch(start_utc) if start_utc is not None else None
+    hi = _text_epoch(end_utc) if end_utc is not None else None
+    buffer = _ChunkBuffer(hot)
+    for _, first_utc, last_utc, _, path in blocks:
+        yield from buffer.iter_before(_text_epoch(first_utc))
+        # 块所在区间内热表的K线（归档后补写的）优先于块内旧值
+        hot_ts, hot_matrix = buffer.take_before(_text_epoch(last_utc) + 1)
+        batch = read_block(path)
+        keep = np.ones(len(batch), dtype=bool)
+        if lo is not None:
+            keep &= batch.ts >= lo
+        if hi is not None:
+            keep &= batch.ts < hi
+        cold_matrix = np.empty((int(keep.sum()), len(columns)), dtype=np.float64)
+        for offset, col in enumerate(columns):
+            cold_matrix[:, offset] = batch.values[col][keep]
+        ts, matrix = batch.ts[keep], cold_matrix
+        if len(hot_ts):
+            ts = np.concatenate([ts, hot_ts])
+            matrix = np.concatenate([matrix, hot_matrix])
+            order = np.argsort(ts, kind="stable")
+            ts, matrix = ts[order], matrix[order]
+            last = np.r_[ts[1:] != ts[:-1], True]
+            ts, matrix = ts[last], matrix[last]
+        for begin in range(0, len(ts), chunk_rows):
+            yield ts[begin : begin + chunk_rows], matrix[begin : begin + chunk_rows]
+    yield from buffer.iter_before(None)
+
+
+def _text_epoch(text: str) -> int:
+    value = datetime.fromisoformat(text)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp())
+
+
+def _hot_column_chunks(
+    conn: sqlite3.Connection,
+    table: str,
+    columns: Sequence[str],
+    chunk_rows: int,
+    start_utc: Optional[str],
+    end_utc: Optional[str],
+) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    where, params = [], []
+    if start_utc is not None:
+        where.append("ts_utc >= ?")
+        params.append(start_utc)
+    if end_utc is not None:
+        where.append("ts_utc < ?")
+        params.append(end_utc)
+    selects = ["CAST(strftime('%s', ts_utc) AS INTEGER)", *columns]
+    cursor = conn.execute(
+        f"SELECT {', '.join(selects)} FROM {table}"
+        + (f" WHERE {' AND '.join(where)}" if where else "")
+        + " ORDER BY ts_utc",
+        params,
+    )
+    while True:
+        rows = cursor.fetchmany(chunk_rows)
+        if not rows:
+            break
+        matrix = np.array(rows, dtype=np.float64).reshape(len(rows), 1 + len(columns))
+        yield matrix[:, 0].astype(np.int64), matrix[:, 1:]
+
+
+def read_bar_chunks(
+    conn: sqlite3.Connection,
+    symbol: str,
+    bar: str,
+    what_to_show: str = DEFAULT_WHAT_TO_SHOW,
+    chunk_rows: int = 500_000,
+    start_utc: Optional[str] = None,
+    end_utc: Optional[str] = None,
+) -> Iterator[BarBatch]:
+    """按时间顺序分块读出整张K线表；NULL 价格为 NaN，NULL 成交量/笔数为 0。"""
+    for ts, matrix in read_column_chunks(
+        conn, symbol, bar, what_to_show, BAR_COLUMNS, chunk_rows, start_utc, end_utc
+    ):
+        values = np.empty(len(ts), dtype=BAR_DTYPE)
+        for offset, col in enumerate(BAR_COLUMNS):
+            column = matrix[:, offset]
+            if values.dtype[col].kind == "i":
+                column = np.nan_to_num(column)
+            values[col] = column
+        yield BarBatch(ts=ts, values=values)
+
+
+class BarEvent(NamedTuple):
+    """回测逐事件消费的一根K线；bar 为 BAR_DTYPE 记录，可按列名取值。"""
+
+    ts: int
+    symbol: str
+    bar: np.void
+
+
+def _symbol_events(
+    conn: sqlite3.Connection,
+    order: int,
+    symbol: str,
+    bar: str,
+    what_to_show: str,
+    chunk_rows: int,
+    start_utc: Optional[str],
+    end_utc: Optional[str],
+) -> Iterator[Tuple[int, int, str, np.void]]:
+    for batch in read_bar_chunks(conn, symbol, bar, what_to_show, chunk_rows, start_utc, end_utc):
+        for ts, record in zip(batch.ts.tolist(), batch.values):
+            yield ts, order, symbol, record
+
+
+def stream_bars(
+    conn: sqlite3.Connection,
+    symbols: Sequence[str],
+    bar: str,
+    what_to_show: str = DEFAULT_WHAT_TO_SHOW,
+    chunk_rows: int = 50_000,
+    start_utc: Optional[str] = None,
+    end_utc: Optional[str] = None,
+) -> Iterator[BarEvent]:
+    """多个品种的K线按时间归并成一条事件流。
+
+    每个品种一个分块游标，堆归并只在内存里保留各自当前块，内存与历史长度和品种数的乘积无关；
+    同一时刻按 symbols 顺序产出。
+    """
+    streams = [
+        _symbol_events(conn, order, symbol, bar, what_to_show, chunk_rows, start_utc, end_utc)
+        for order, symbol in enumerate(symbols)
+    ]
+    for ts, _, symbol, record in heapq.merge(*streams):
+        yield BarEvent(ts, symbol, record)
+
+
+@dataclass
+class AlignedBlock:
+    """一个时间窗内各品种按时间戳并集对齐的K线。
+
+    缺失位置价格为 NaN、成交量/笔数为 0，present 标记该品种在此时刻是否有K线。
+    """
+
+    start: int
+    ts: np.ndarray
+    bars: Dict[str, np.ndarray]
+    present: Dict[str, np.ndarray]
+
+
+class _ChunkBuffer:
+    """包住 (时间戳, 数据) 分块迭代器，按时间上限切出数据，跨块拼接。"""
+
+    def __init__(self, chunks: Iterator[Tuple[np.ndarray, np.ndarray]]) -> None:
+        self._chunks = chunks
+        self._ts = np.empty(0, dtype=np.int64)
+        self._data: Optional[np.ndarray] = None
+        self._pos = 0
+
+    def _fill(self) -> bool:
+        for ts, data in self._chunks:
+            if len(ts):
+                self._ts, self._data, self._pos = ts, data, 0
+                return True
+        return False
+
+    def peek(self) -> Optional[int]:
+        if self._pos >= len(self._ts) and not self._fill():
+            return None
+        return int(self._ts[self._pos])
+
+    def iter_before(self, limit: Optional[int]) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """逐段产出早于 limit 的数据（limit 为 None 时产出剩余全部），不整体拼接。"""
+        while self.peek() is not None:
+            cut = len(self._ts) if limit is None else int(np.searchsorted(self._ts, limit, side="left"))
+            if cut <= self._pos:
+                break
+            part = slice(self._pos, cut)
+            self._pos = cut
+            yield self._ts[part], self._data[part]
+            if cut < len(self._ts):
+                break
+
+    def take_before(self, limit: int) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        parts = list(self.iter_before(limit))
+        if not parts:
+            return np.empty(0, dtype=np.int64), None
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate([ts for ts, _ in parts]), np.concatenate([data for _, data in parts])
+
+
+def iter_aligned_blocks(
+    conn: sqlite3.Connection,
+    symbols: Sequence[str],
+    bar: str,
+    what_to_show: str = DEFAULT_WHAT_TO_SHOW,
+    window_seconds: int = 86400,
+    chunk_rows: int = 50_000,
+    start_utc: Optional[str] = None,
+    end_utc: Optional[str] = None,
+) -> Iterator[AlignedBlock]:
+    """按 UTC 对齐的时间窗逐块产出多品种对齐矩阵，没有任何K线的窗口跳过。"""
+    buffers = {
+        symbol: _ChunkBuffer(
+            (batch.ts, batch.values)
+            for batch in read_bar_chunks(conn, symbol, bar, what_to_show, chunk_rows, start_utc, end_utc)
+        )
+        for symbol in symbols
+    }
+    while True:
+        heads = [head for head in (buffer.peek() for buffer in buffers.values()) if head is not None]
+        if not heads:
+            return
+        start = min(heads) // window_seconds * window_seconds
+        parts = {symbol: buffer.take_before(start + window_seconds) for symbol, buffer in buffers.items()}
+        ts = np.unique(np.concatenate([part_ts for part_ts, _ in parts.values()]))
+        bars: Dict[str, np.ndarray] = {}
+        present: Dict[str, np.ndarray] = {}
+        for symbol, (part_ts, part_values) in parts.items():
+            values = np.zeros(len(ts), dtype=BAR_DTYPE)
+            for col in BAR_DTYPE.names:
+                if values.dtype[col].kind == "f":
+                    values[col] = np.nan
+            mask = np.zeros(len(ts), dtype=bool)
+            if len(part_ts):
+                idx = np.searchsorted(ts, part_ts)
+                values[idx] = part_values
+                mask[idx] = True
+            bars[symbol] = values
+            present[symbol] = mask
+        yield AlignedBlock(start=start, ts=ts, bars=bars, present=present)
@@ -0,0 +1,202 @@
+from __future__ import annotations
+
+import sqlite3
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .config import Config, default_config, merge_config
+from .contract_resolver import resolve_contract
+from .fetcher import _fetch_slice, build_slice_requests
+from .ib_client import DataClient, IBAsyncClient
+from .metrics import FetchMetrics, attach_metrics
+from .pacing import PacingLimiter
+from .report import FetchReport
+from .storage import (
+    compact_failures,
+    create_failure_table,
+    ensure_db,
+    resolve_failures,
+)
+
+
+@dataclass
+class FailureWindow:
+    """fetch_failures 中一段仍缺数据的区间，可能由多条失败记录合并而来。"""
+
+    symbol: str
+    bar: str
+    what_to_show: str
+    start: datetime
+    end: datetime
+    failure_ids: List[int] = field(default_factory=list)
+
+
+def pending_failure_windows(
+    conn: sqlite3.Connection, symbols: Optional[Sequence[str]] = None
+) -> Tuple[List[FailureWindow], List[int]]:
+    """读出未解决的失败记录，去重并合并相邻区间。
+
+    返回 (待重拉窗口, 已被其他拉取补齐的失败记录 id)。无数据记录不参与重拉。
+    """
+    # gaps 模块依赖本模块的窗口类型，这里延迟导入避免循环
+    from .gaps import find_gaps
+
+    create_failure_table(conn)
+    rows = conn.execute(
+        """
+        SELECT id, symbol, bar, what_to_show, start_utc, end_utc
+        FROM fetch_failures
+        WHERE resolved_at IS NULL AND is_no_data = 0
+        ORDER BY symbol, bar, what_to_show, start_utc, end_utc
+        """
+    ).fetchall()
+    wanted = {s.upper() for s in symbols} if symbols else None
+    distinct: Dict[Tuple[str, str, str, str, str], List[int]] = {}
+    for failure_id, symbol, bar, what, start_utc, end_utc in rows:
+        if wanted is not None and symbol.upper() not in wanted:
+            continue
+        distinct.setdefault((symbol, bar, what, start_utc, end_utc), []).append(failure_id)
+
+    covered: List[int] = []
+    windows: List[FailureWindow] = []
+    for (symbol, bar, what, start_utc, end_utc), ids in distinct.items():
+        start = datetime.fromisoformat(start_utc)
+        end = datetime.fromisoformat(end_utc)
+        # 交易时段内应有的K线都已入库（含冷存储）才算被后续拉取补齐，只补了一部分的仍要重拉
+        if not find_gaps(conn, symbol, bar, what, start, end):
+            covered.extend(ids)
+            continue
+        windows.append(FailureWindow(symbol, bar, what, start, end, list(ids)))
+    return merge_windows(windows), covered
+
+
+def merge_windows(windows: Sequence[FailureWindow]) -> List[FailureWindow]:
+    """合并同一序列上重叠或首尾相接的窗口。"""
+    merged: List[FailureWindow] = []
+    for window in sorted(windows, key=lambda w: (w.symbol, w.bar, w.what_to_show, w.start)):
+        last = merged[-1] if merged else None
+        if (
+            last is not None
+            and (last.symbol, last.bar, last.what_to_show)
+            == (window.symbol, window.bar, window.what_to_show)
+            and window.start <= last.end
+        ):
+            last.end = max(last.end, window.end)
+            last.failure_ids.extend(window.failure_ids)
+        else:
+            merged.append(
+                FailureWindow(
+                    window.symbol,
+                    window.bar,
+                    window.what_to_show,
+                    window.start,
+                    window.end,
+                    list(window.failure_ids),
+                )
+            )
+    return merged
+
+
+def refetch_window(client, conn, report, pacer, metrics, config: Config, window: FailureWindow) -> bool:
+    """按正常分片与限速重拉一个窗口，全部分片成功（或确认无数据）返回 True。"""
+    series_cfg = merge_config(config, what_to_show=window.what_to_show)
+    with metrics.phase("contract_resolution"):
+        requests = build_slice_requests(
+            client,
+            conn,
+            window.symbol,
+            [window.bar],
+            window.start,
+            window.end,
+            config,
+            [window.what_to_show],
+        )
+    ok = True
+    for request in requests:
+        ok &= _fetch_slice(
+            client,
+            conn,
+            report,
+            pacer,
+            metrics,
+            request.symbol,
+            request.bar,
+            request.contract,
+            request.time_slice,
+            series_cfg,
+        )
+    return ok
+
+
+def _failure_ids_within(conn: sqlite3.Connection, window: FailureWindow) -> List[int]:
+    rows = conn.execute(
+        """
+        SELECT id FROM fetch_failures
+        WHERE resolved_at IS NULL AND is_no_data = 0
+          AND symbol = ? AND bar = ? AND what_to_show = ? AND start_utc >= ? AND end_utc <= ?
+        """,
+        (
+            window.symbol,
+            window.bar,
+            window.what_to_show,
+            window.start.isoformat(),
+            window.end.isoformat(),
+        ),
+    ).fetchall()
+    return [row[0] for row in rows]
+
+
+def retry_failures(
+    config: Optional[Config] = None,
+    db_path: str = "data/ib_history.sqlite",
+    symbols: Optional[Sequence[str]] = None,
+    client: Optional[DataClient] = None,
+    pacer: Optional[PacingLimiter] = None,
+    metrics: Optional[FetchMetrics] = None,
+    compact: bool = True,
+) -> FetchReport:
+    """按 fetch_failures 重拉缺失区间，成功后标记失败记录已解决并压缩失败表。"""
+    cfg = merge_config(config or default_config())
+    pacer = pacer or PacingLimiter.from_config(cfg)
+    metrics = metrics or FetchMetrics()
+    conn = ensure_db(db_path)
+    owns_client = client is None
+    client = client or IBAsyncClient.from_config(cfg, resolve_contract)
+    previous_metrics = attach_metrics(client, metrics)
+
+    try:
+        windows, covered = pending_failure_windows(conn, symbols)
+        now = datetime.utcnow().isoformat()
+        resolve_failures(conn, covered, now)
+        report = FetchReport(
+            symbols=sorted({w.symbol for w in windows}),
+            bars=sorted({w.bar for w in windows}),
+            ranges=[
+                {
+                    "symbol": w.symbol,
+                    "bar": w.bar,
+                    "what_to_show": w.what_to_show,
+                    "start": w.start.isoformat(),
+                    "end": w.end.isoformat(),
+                }
+                for w in windows
+            ],
+        )
+        for window in windows:
+            if refetch_window(client, conn, report, pacer, metrics, cfg, window):
+                # 重拉过程中中途失败又成功的记录也一并标记
+                ids = window.failure_ids + _failure_ids_within(conn, window)
+                resolve_failures(conn, ids, datetime.utcnow().isoformat())
+            conn.commit()
+        if compact:
+            compact_failures(conn)
+        conn.commit()
+        report.metrics = metrics.summary()
+        return report
+    finally:
+        attach_metrics(client, previous_metrics)
+        metrics.close()
+        conn.close()
+        if owns_client:
+            client.close()
@@ -1,9 +1,12 @@
 from __future__ import annotations
 
 import json
+import time
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
+
+STAT_FIELDS = ("slices", "rows", "no_data", "retries", "failures")
 
 
 @dataclass
@@ -15,16 +18,132 @@ class FailureRecord:
     attempt: int
     reason: str
     is_no_data: bool
+    what_to_show: str = "TRADES"
+    contract: Optional[str] = None
+
+
+class JsonLinesReportSink:
+    """每个分片事件追加一行 JSON，可在拉取过程中 tail 进度。"""
+
+    def __init__(self, path: str) -> None:
+        target = Path(path)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        self._fh = target.open("a", encoding="utf-8")
+
+    def on_event(self, event: Dict) -> None:
+        self._fh.write(json.dumps(event, ensure_ascii=False) + "\n")
+        self._fh.flush()
+
+    def close(self) -> None:
+        self._fh.close()
+
+
+def contract_label(contract) -> Optional[str]:
+    if contract is None:
+        return None
+    return getattr(contract, "localSymbol", None) or str(getattr(contract, "conId", "")) or None
 
 
 @dataclass
 class FetchReport:
+    """拉取结果。
+
+    事件通过 sink 实时写出；keep_records=False 时不在内存里保留逐条失败记录，
+    只维护按 (symbol, bar, whatToShow, 合约) 聚合的计数，长时间回补内存不随失败数增长。
+    """
+
     symbols: List[str]
     bars: List[str]
     ranges: List[Dict[str, str]]
     success_count: int = 0
     failures: List[FailureRecord] = field(default_factory=list)
     no_data: List[FailureRecord] = field(default_factory=list)
+    metrics: Dict = field(default_factory=dict)
+    failure_count: int = 0
+    no_data_count: int = 0
+    keep_records: bool = True
+    sink: Optional[JsonLinesReportSink] = field(default=None, repr=False)
+    stats: Dict[Tuple[str, str, str, Optional[str]], Dict[str, int]] = field(default_factory=dict)
+    # 租约被其他拉取进程持有而跳过的序列
+    skipped: List[Dict[str, str]] = field(default_factory=list)
+
+    def _stats(self, symbol: str, bar: str, what: str, contract: Optional[str]) -> Dict[str, int]:
+        key = (symbol, bar, what, contract)
+        if key not in self.stats:
+            self.stats[key] = dict.fromkeys(STAT_FIELDS, 0)
+        return self.stats[key]
+
+    def _emit(self, event: str, **fields) -> None:
+        if self.sink is not None:
+            self.sink.on_event({"event": event, "ts": round(time.time(), 3), **fields})
+
+    def record_slice(
+        self,
+        symbol: str,
+        bar: str,
+        what: str,
+        contract: Optional[str],
+        start_utc: str,
+        end_utc: str,
+        rows: int,
+    ) -> None:
+        self.success_count += rows
+        stats = self._stats(symbol, bar, what, contract)
+        stats["slices"] += 1
+        stats["rows"] += rows
+        self._emit(
+            "slice_done",
+            symbol=symbol,
+            bar=bar,
+            what_to_show=what,
+            contract=contract,
+            start_utc=start_utc,
+            end_utc=end_utc,
+            rows=rows,
+        )
+
+    def record_no_data(self, record: FailureRecord) -> None:
+        self.no_data_count += 1
+        if self.keep_records:
+            self.no_data.append(record)
+        stats = self._stats(record.symbol, record.bar, record.what_to_show, record.contract)
+        stats["slices"] += 1
+        stats["no_data"] += 1
+        self._emit("no_data", **record.__dict__)
+
+    def record_failure(self, record: FailureRecord, retrying: bool = False) -> None:
+        """记录一次失败的尝试；retrying 表示之后还会重试。"""
+        self.failure_count += 1
+        if self.keep_records:
+            self.failures.append(record)
+        stats = self._stats(record.symbol, record.bar, record.what_to_show, record.contract)
+        stats["retries" if retrying else "failures"] += 1
+        self._emit("retry" if retrying else "failure", **record.__dict__)
+
+    def record_skipped(self, symbol: str, bar: str, what: str, owner: str = "") -> None:
+        entry = {"symbol": symbol, "bar": bar, "what_to_show": what, "owner": owner}
+        self.skipped.append(entry)
+        self._emit("skipped", **entry)
+
+    def summary(self) -> List[Dict]:
+        return [
+            {"symbol": symbol, "bar": bar, "what_to_show": what, "contract": contract, **counts}
+            for (symbol, bar, what, contract), counts in sorted(
+                self.stats.items(), key=lambda item: tuple(str(part) for part in item[0])
+            )
+        ]
+
+    def close(self) -> None:
+        if self.sink is not None:
+            self._emit(
+                "summary",
+                success_count=self.success_count,
+                failure_count=self.failure_count,
+                no_data_count=self.no_data_count,
+                by_series=self.summary(),
+            )
+            self.sink.close()
+            self.sink = None
 
     def to_dict(self) -> Dict:
         return {
@@ -32,8 +151,13 @@ class FetchReport:
             "bars": self.bars,
             "ranges": self.ranges,
             "success_count": self.success_count,
+            "failure_count": self.failure_count,
+            "no_data_count": self.no_data_count,
+            "summary": self.summary(),
             "failures": [record.__dict__ for record in self.failures],
             "no_data": [record.__dict__ for record in self.no_data],
+            "skipped": self.skipped,
+            "metrics": self.metrics,
         }
 
     def write_json(self, path: str) -> None:
@@ -0,0 +1,193 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+from .bars import BarBatch
+from .cold import decode_batch, encode_batch
+
+# off：不用缓存；readwrite：先查缓存，未命中再请求 IB 并写入；replay：只读缓存，不连接 IB
+MODES = ("off", "readwrite", "replay")
+
+CONTRACT_FIELDS = (
+    "conId",
+    "symbol",
+    "secType",
+    "lastTradeDateOrContractMonth",
+    "localSymbol",
+    "exchange",
+    "currency",
+    "multiplier",
+    "tradingClass",
+)
+
+
+class ResponseCacheMiss(LookupError):
+    """replay 模式下请求的响应不在缓存里。"""
+
+
+@dataclass(frozen=True)
+class CachedContract:
+    """从缓存还原的合约，只用于定位缓存条目和报告，不会发给 IB。"""
+
+    conId: int
+    symbol: str = ""
+    secType: str = "FUT"
+    lastTradeDateOrContractMonth: str = ""
+    localSymbol: str = ""
+    exchange: str = ""
+    currency: str = ""
+    multiplier: str = ""
+    tradingClass: str = ""
+
+
+def served_from_cache(client, contract, bar: str, start: datetime, end: datetime, config) -> bool:
+    """这次请求会直接由响应缓存回答（或 replay 模式根本不发请求），调用方据此跳过限速等待。"""
+    if getattr(client, "offline", False):
+        return True
+    check = getattr(client, "has_cached_bars", None)
+    return bool(check is not None and contract is not None and check(contract, bar, start, end, config))
+
+
+def contract_fields(contract) -> Dict[str, object]:
+    return {name: getattr(contract, name, "") for name in CONTRACT_FIELDS}
+
+
+class ResponseCache:
+    """按请求签名保存 IB 原始响应的磁盘缓存，总大小超过 max_bytes 时按最近使用时间淘汰。
+
+    K线响应存为压缩列块（与冷存储同一编码），合约列表等小响应存为 JSON；
+    索引放在 root/index.sqlite，多个进程可以共用同一目录。
+    """
+
+    def __init__(self, root: str, max_bytes: int) -> None:
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._conn = sqlite3.connect(str(self.root / "index.sqlite"), timeout=30.0)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                signature TEXT NOT NULL,
+                path TEXT NOT NULL,
+                bytes INTEGER NOT NULL,
+                created_at TEXT NOT NULL,
+                last_used REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self._conn.commit()
+
+    @staticmethod
+    def key(signature: Sequence) -> str:
+        return hashlib.sha1(json.dumps(list(signature), default=str).encode()).hexdigest()
+
+    def _existing_path(self, key: str) -> Optional[Path]:
+        row = self._conn.execute("SELECT path FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        path = self.root / row[0]
+        if not path.exists():
+            # 文件被外部删掉时索引行已失效，顺手清理
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._conn.commit()
+            return None
+        return path
+
+    def _lookup(self, signature: Sequence) -> Optional[Path]:
+        key = self.key(signature)
+        path = self._existing_path(key)
+        if path is None:
+            return None
+        self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+        self._conn.commit()
+        return path
+
+    def contains(self, signature: Sequence) -> bool:
+        """只有索引行和缓存文件都在时才算命中，调用方据此跳过 pacing 等待。"""
+        return self._existing_path(self.key(signature)) is not None
+
+    def get_bars(self, signature: Sequence) -> Optional[BarBatch]:
+        path = self._lookup(signature)
+        if path is None:
+            return None
+        with np.load(path) as archive:
+            return decode_batch(archive)
+
+    def put_bars(self, signature: Sequence, batch: BarBatch) -> None:
+        self._store(signature, ".npz", lambda handle: np.savez_compressed(handle, **encode_batch(batch)))
+
+    def get_json(self, signature: Sequence) -> Optional[object]:
+        path = self._lookup(signature)
+        if path is None:
+            return None
+        return json.loads(path.read_text(encoding="utf-8"))
+
+    def put_json(self, signature: Sequence, payload: object) -> None:
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self._store(signature, ".json", lambda handle: handle.write(data))
+
+    def _store(self, signature: Sequence, suffix: str, write) -> None:
+        key = self.key(signature)
+        relative = Path(key[:2]) / f"{key}{suffix}"
+        target = self.root / relative
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp = target.with_name(target.name + ".tmp")
+        with open(tmp, "wb") as handle:
+            write(handle)
+        os.replace(tmp, target)
+        self._conn.execute(
+            """
+            INSERT OR REPLACE INTO responses (key, signature, path, bytes, created_at, last_used)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (
+                key,
+                json.dumps(list(signature), default=str),
+                str(relative),
+                target.stat().st_size,
+                datetime.utcnow().isoformat(),
+                time.time(),
+            ),
+        )
+        self._evict()
+        self._conn.commit()
+
+    def _evict(self) -> None:
+        total = self._conn.execute("SELECT IFNULL(SUM(bytes), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        victims = []
+        for key, path, size in self._conn.execute(
+            "SELECT key, path, bytes FROM responses ORDER BY last_used, rowid"
+        ):
+            if total <= self.max_bytes:
+                break
+            victims.append((key, path))
+            total -= size
+        for key, path in victims:
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            try:
+                (self.root / path).unlink()
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> Dict[str, int]:
+        entries, size = self._conn.execute(
+            "SELECT COUNT(*), IFNULL(SUM(bytes), 0) FROM responses"
+        ).fetchone()
+        return {"entries": entries, "bytes": size}
+
+    def close(self) -> None:
+        self._conn.close()
@@ -0,0 +1,314 @@
+from __future__ import annotations
+
+import base64
+import json
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .bars import BAR_DTYPE, BarBatch
+from .config import Config, default_config, merge_config
+from .contract_resolver import resolve_contract
+from .ib_client import IBAsyncClient
+from .pacing import PacingLimiter
+from .response_cache import contract_fields, served_from_cache
+
+# 不经过 IB 的方法直接在连接线程应答，其余排队交给 serve 线程执行
+_INLINE_METHODS = ("ping", "shutdown")
+
+
+class SessionError(RuntimeError):
+    pass
+
+
+@dataclass(frozen=True)
+class SessionContract:
+    """守护进程返回的合约快照，字段与 ib_async Contract 同名。"""
+
+    conId: int
+    symbol: str = ""
+    secType: str = "FUT"
+    lastTradeDateOrContractMonth: str = ""
+    localSymbol: str = ""
+    exchange: str = ""
+    currency: str = ""
+    multiplier: str = ""
+    tradingClass: str = ""
+
+
+def _contract_to_dict(contract) -> Dict:
+    return contract_fields(contract)
+
+
+def _batch_to_dict(batch: BarBatch) -> Dict:
+    # 原始字节 + base64，比逐行 JSON 编码小且快
+    return {
+        "ts": base64.b64encode(np.ascontiguousarray(batch.ts, dtype=np.int64).tobytes()).decode(),
+        "values": base64.b64encode(np.ascontiguousarray(batch.values).tobytes()).decode(),
+    }
+
+
+def _batch_from_dict(data: Dict) -> BarBatch:
+    ts = np.frombuffer(base64.b64decode(data["ts"]), dtype=np.int64).copy()
+    values = np.frombuffer(base64.b64decode(data["values"]), dtype=BAR_DTYPE).copy()
+    return BarBatch(ts=ts, values=values)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                result = self.server.session.submit(request["method"], request.get("params", {}))
+                response = {"result": result}
+            except Exception as exc:  # noqa: BLE001
+                response = {"error": str(exc), "type": type(exc).__name__}
+            self.wfile.write((json.dumps(response, ensure_ascii=False) + "\n").encode("utf-8"))
+            self.wfile.flush()
+
+
+class _UnixServer(socketserver.ThreadingUnixStreamServer):
+    # 每个连接一个线程：一个客户端长时间占着连接时，其他客户端照样能连上
+    daemon_threads = True
+    block_on_close = False
+
+    def __init__(self, path: str, session: "SessionDaemon") -> None:
+        self.session = session
+        super().__init__(path, _Handler)
+
+
+class SessionDaemon:
+    """常驻进程：保持 IB 连接、合约缓存与限速器，通过 Unix socket 为 CLI 提供 RPC。
+
+    每个连接由独立线程收发，IB 调用排队后在 serve 线程里逐个执行（ib_async 不是线程安全的），
+    所有调用方共享同一个限速预算；ping / shutdown 不排队，IB 请求进行中也能立即应答。
+    """
+
+    def __init__(self, config: Config, socket_path: Optional[str] = None, client=None) -> None:
+        self.config = config
+        self.socket_path = socket_path or config.session_socket
+        self.client = client or IBAsyncClient.from_config(config, resolve_contract)
+        self.pacer = PacingLimiter.from_config(config)
+        self.started = time.time()
+        self.requests = 0
+        self._stop = False
+        self._lock = threading.Lock()
+        self._calls: "queue.Queue[Tuple[str, Dict, Future]]" = queue.Queue()
+        self._contracts: Dict[str, Tuple[float, List[object]]] = {}
+        self._by_con_id: Dict[int, object] = {}
+
+    def submit(self, method: str, params: Dict):
+        """连接线程调用：IB 相关方法排队等 serve 线程执行完再返回。"""
+        if method in _INLINE_METHODS:
+            return self.dispatch(method, params)
+        future: Future = Future()
+        self._calls.put((method, params, future))
+        return future.result()
+
+    def dispatch(self, method: str, params: Dict):
+        with self._lock:
+            self.requests += 1
+        if method == "ping":
+            return {
+                "uptime_seconds": round(time.time() - self.started, 1),
+                "requests": self.requests,
+                "connected": self._connected(),
+            }
+        if method == "shutdown":
+            self._stop = True
+            return True
+        if method == "list_fut_contracts":
+            return [_contract_to_dict(c) for c in self._list_contracts(params["symbol"])]
+        if method == "head_timestamp":
+            head = self.client.head_timestamp(
+                self._contract(params["contract"]), params.get("what_to_show")
+            )
+            return head.isoformat() if head is not None else None
+        if method == "fetch_bars_for_contract":
+            config = merge_config(self.config, what_to_show=params.get("what_to_show"))
+            contract = self._contract(params["contract"])
+            start = datetime.fromisoformat(params["start"])
+            end = datetime.fromisoformat(params["end"])
+            if not served_from_cache(self.client, contract, params["bar"], start, end, config):
+                self.pacer.wait(params["bar"])
+            batch = self.client.fetch_bars_for_contract(contract, params["bar"], start, end, config)
+            return _batch_to_dict(batch)
+        if method == "fetch_bars":
+            config = merge_config(self.config, what_to_show=params.get("what_to_show"))
+            self.pacer.wait(params["bar"])
+            batch = self.client.fetch_bars(
+                params["symbol"],
+                params["bar"],
+                datetime.fromisoformat(params["start"]),
+                datetime.fromisoformat(params["end"]),
+                config,
+            )
+            return _batch_to_dict(batch)
+        raise SessionError(f"未知方法: {method}")
+
+    def _connected(self) -> bool:
+        return bool(getattr(self.client, "is_connected", lambda: True)())
+
+    def _list_contracts(self, symbol: str) -> List[object]:
+        symbol = symbol.upper()
+        cached = self._contracts.get(symbol)
+        if cached is not None and time.time() - cached[0] < self.config.session_contract_ttl_seconds:
+            return cached[1]
+        contracts = self.client.list_fut_contracts(symbol, config=self.config)
+        self._contracts[symbol] = (time.time(), contracts)
+        for contract in contracts:
+            self._by_con_id[getattr(contract, "conId", 0)] = contract
+        return contracts
+
+    def _contract(self, data: Dict):
+        contract = self._by_con_id.get(data.get("conId"))
+        if contract is not None:
+            return contract
+        if isinstance(self.client, IBAsyncClient):
+            _, _, Contract, _ = self.client._load_ib()
+            return Contract(**{k: v for k, v in data.items() if v not in ("", None)})
+        return SessionContract(**data)
+
+    def serve(self) -> None:
+        if os.path.exists(self.socket_path):
+            if _alive(self.socket_path):
+                raise SessionError(f"会话守护进程已在运行: {self.socket_path}")
+            os.unlink(self.socket_path)
+        os.makedirs(os.path.dirname(self.socket_path) or ".", exist_ok=True)
+        server = _UnixServer(self.socket_path, self)
+        listener = threading.Thread(
+            target=server.serve_forever, kwargs={"poll_interval": 0.2}, name="ib-session-listener", daemon=True
+        )
+        listener.start()
+        try:
+            while not self._stop:
+                try:
+                    method, params, future = self._calls.get(timeout=0.2)
+                except queue.Empty:
+                    # 空闲时让 ib_async 处理心跳等事件
+                    if isinstance(self.client, IBAsyncClient) and self.client.is_connected():
+                        self.client.wait(0)
+                    continue
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    future.set_result(self.dispatch(method, params))
+                except Exception as exc:  # noqa: BLE001
+                    future.set_exception(exc)
+        finally:
+            server.shutdown()
+            server.server_close()
+            while not self._calls.empty():
+                self._calls.get_nowait()[2].set_exception(SessionError("会话守护进程已停止"))
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            self.client.close()
+
+
+class SessionClient:
+    """通过 Unix socket 调用会话守护进程，接口与 IBAsyncClient 的历史数据部分一致。"""
+
+    # 守护进程统一限速，调用方无需再本地等待
+    shared_pacing = True
+
+    def __init__(self, socket_path: str, timeout: Optional[float] = None) -> None:
+        self.socket_path = socket_path
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # 守护进程卡死时不无限阻塞；默认值覆盖一个完整的 pacing 窗口加 IB 请求超时
+        self._sock.settimeout(timeout if timeout is not None else default_config().session_client_timeout)
+        self._sock.connect(socket_path)
+        self._file = self._sock.makefile("rwb")
+
+    def call(self, method: str, **params):
+        payload = json.dumps({"method": method, "params": params}, ensure_ascii=False) + "\n"
+        self._file.write(payload.encode("utf-8"))
+        self._file.flush()
+        line = self._file.readline()
+        if not line:
+            raise SessionError("会话守护进程已断开")
+        response = json.loads(line)
+        if "error" in response:
+            raise SessionError(f"{response['type']}: {response['error']}")
+        return response["result"]
+
+    def ping(self) -> Dict:
+        return self.call("ping")
+
+    def list_fut_contracts(self, symbol: str, config=None) -> List[SessionContract]:
+        return [SessionContract(**data) for data in self.call("list_fut_contracts", symbol=symbol)]
+
+    def head_timestamp(self, contract, what_to_show: Optional[str] = None) -> Optional[datetime]:
+        head = self.call(
+            "head_timestamp", contract=_contract_to_dict(contract), what_to_show=what_to_show
+        )
+        return datetime.fromisoformat(head) if head else None
+
+    def fetch_bars_for_contract(self, contract, bar: str, start: datetime, end: datetime, config=None):
+        return _batch_from_dict(
+            self.call(
+                "fetch_bars_for_contract",
+                contract=_contract_to_dict(contract),
+                bar=bar,
+                start=start.isoformat(),
+                end=end.isoformat(),
+                what_to_show=getattr(config, "what_to_show", None),
+            )
+        )
+
+    def fetch_bars(self, symbol: str, bar: str, start: datetime, end: datetime, config=None):
+        return _batch_from_dict(
+            self.call(
+                "fetch_bars",
+                symbol=symbol,
+                bar=bar,
+                start=start.isoformat(),
+                end=end.isoformat(),
+                what_to_show=getattr(config, "what_to_show", None),
+            )
+        )
+
+    def shutdown(self) -> None:
+        self.call("shutdown")
+
+    def close(self) -> None:
+        self._file.close()
+        self._sock.close()
+
+
+def _alive(socket_path: str) -> bool:
+    try:
+        client = SessionClient(socket_path, timeout=2.0)
+    except OSError:
+        return False
+    try:
+        client.ping()
+        return True
+    except (OSError, SessionError):
+        return False
+    finally:
+        client.close()
+
+
+def connect_session(config: Config, socket_path: Optional[str] = None) -> Optional[SessionClient]:
+    """守护进程在运行时返回 SessionClient，否则返回 None 由调用方直连 IB。"""
+    path = socket_path or config.session_socket
+    if not os.path.exists(path):
+        return None
+    try:
+        return SessionClient(path, timeout=config.session_client_timeout)
+    except OSError:
+        return None
+
+
+def run_session(config: Optional[Config] = None, socket_path: Optional[str] = None) -> None:
+    cfg = merge_config(config or default_config())
+    SessionDaemon(cfg, socket_path).serve()
@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Tuple
+
+import numpy as np
+
+# CME Globex（股指、金属）：芝加哥时间周日 17:00 开盘至周五 16:00，每日 16:00-17:00 休市
+HALT_HOUR_CT = 16
+_HOUR = 3600
+_DAY = 86400
+_CST = -6 * _HOUR
+_CDT = -5 * _HOUR
+
+_dst_cache: Dict[int, Tuple[int, int]] = {}
+
+
+def _nth_sunday(year: int, month: int, n: int) -> datetime:
+    first = datetime(year, month, 1)
+    return first + timedelta(days=(6 - first.weekday()) % 7 + 7 * (n - 1))
+
+
+def _dst_bounds(year: int) -> Tuple[int, int]:
+    """美国夏令时起止的 UTC epoch 秒：3 月第二个周日 2:00 CST 至 11 月第一个周日 2:00 CDT。"""
+    if year not in _dst_cache:
+        start = _nth_sunday(year, 3, 2).replace(hour=2, tzinfo=timezone.utc) - timedelta(seconds=_CST)
+        end = _nth_sunday(year, 11, 1).replace(hour=2, tzinfo=timezone.utc) - timedelta(seconds=_CDT)
+        _dst_cache[year] = (int(start.timestamp()), int(end.timestamp()))
+    return _dst_cache[year]
+
+
+def chicago_offset(ts: np.ndarray) -> np.ndarray:
+    """每个 UTC epoch 秒对应的芝加哥时区偏移（秒）。"""
+    ts = np.asarray(ts, dtype=np.int64)
+    if not len(ts):
+        return np.empty(0, dtype=np.int64)
+    years = ts.astype("datetime64[s]").astype("datetime64[Y]").astype(np.int64) + 1970
+    first = int(years.min())
+    bounds = np.array([_dst_bounds(y) for y in range(first, int(years.max()) + 1)], dtype=np.int64)
+    idx = years - first
+    in_dst = (ts >= bounds[idx, 0]) & (ts < bounds[idx, 1])
+    return np.where(in_dst, _CDT, _CST)
+
+
+def to_local(ts: np.ndarray) -> np.ndarray:
+    """UTC epoch 秒换成芝加哥本地时间的 epoch 秒（按 UTC 解释即为本地钟面时间）。"""
+    ts = np.asarray(ts, dtype=np.int64)
+    return ts + chicago_offset(ts)
+
+
+def local_to_utc(local: np.ndarray) -> np.ndarray:
+    """to_local 的逆变换；夏令时切换的凌晨两点附近可能差一小时，交易时段边界不受影响。"""
+    local = np.asarray(local, dtype=np.int64)
+    return local - chicago_offset(local - _CST)
+
+
+def session_day(ts: np.ndarray) -> np.ndarray:
+    """每根K线所属交易日（epoch 天数）：芝加哥时间 17:00 开盘的时段归入次日。"""
+    shift = (24 - HALT_HOUR_CT - 1) * _HOUR
+    return (to_local(ts) + shift) // _DAY
+
+
+def session_bounds(days: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """交易日 days 的 Globex 时段 [前一日 17:00, 当日 16:00) 芝加哥时间，返回 UTC epoch 秒。"""
+    days = np.asarray(days, dtype=np.int64)
+    local_open = days * _DAY - (24 - HALT_HOUR_CT - 1) * _HOUR
+    local_close = days * _DAY + HALT_HOUR_CT * _HOUR
+    return local_to_utc(local_open), local_to_utc(local_close)
+
+
+def session_open_mask(ts: np.ndarray, step: int) -> np.ndarray:
+    """K线起点是否落在交易时段内（未计交易所节假日）。日线按工作日判断。"""
+    ts = np.asarray(ts, dtype=np.int64)
+    if step >= _DAY:
+        return ((ts // _DAY) + 3) % 7 < 5
+    local = ts + chicago_offset(ts)
+    weekday = ((local // _DAY) + 3) % 7  # 1970-01-01 是周四，周一为 0
+    hour = (local % _DAY) // _HOUR
+    mask = (hour != HALT_HOUR_CT) & (weekday != 5)
+    mask &= ~((weekday == 4) & (hour >= HALT_HOUR_CT))
+    mask &= ~((weekday == 6) & (hour < HALT_HOUR_CT + 1))
+    return mask
+
+
+def expected_bars(start: int, end: int, step: int) -> int:
+    """(start, end) 之间（不含两端）日历上应有的K线数量。"""
+    first = start + step
+    if first >= end:
+        return 0
+    return int(session_open_mask(np.arange(first, end, step, dtype=np.int64), step).sum())
@@ -4,6 +4,10 @@ from dataclasses import dataclass
 from datetime import datetime, timedelta
 from typing import Iterable, List, Tuple
 
+from .bars import bar_seconds
+
+_EPOCH = datetime(1970, 1, 1)
+
 
 @dataclass(frozen=True)
 class TimeSlice:
@@ -23,8 +27,25 @@ def slice_range(start: datetime, end: datetime, max_days: int) -> List[TimeSlice
     return slices
 
 
+def align_down(value: datetime, step_seconds: int) -> datetime:
+    """按 UTC 把时间向下对齐到K线起点。"""
+    epoch = int((value - _EPOCH).total_seconds())
+    return _EPOCH + timedelta(seconds=epoch - epoch % step_seconds)
+
+
 def slice_by_bar(start: datetime, end: datetime, bar: str, max_days_per_bar: dict) -> List[TimeSlice]:
+    """起点对齐到K线边界后切成首尾相接的分片，相邻分片不含同一根K线。"""
     max_days = max_days_per_bar.get(bar)
     if max_days is None:
         raise ValueError(f"未配置bar周期的最大分片天数: {bar}")
-    return slice_range(start, end, max_days=max_days)
+    step = bar_seconds(bar)
+    slices = slice_range(align_down(start, step), end, max_days=max_days)
+    # 超过一天的 durationStr 只能按整天取整：尾片的零头单独成一片（≤ 86400 S），
+    # 不让合约交接处或区间末尾的分片多拉将近一天的数据
+    if slices and step < 86400:
+        last = slices[-1]
+        whole_days = (last.end - last.start) // timedelta(days=1)
+        cut = last.start + timedelta(days=whole_days)
+        if whole_days and cut < last.end:
+            slices[-1:] = [TimeSlice(start=last.start, end=cut), TimeSlice(start=cut, end=last.end)]
+    return slices
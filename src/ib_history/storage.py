@@ -2,22 +2,90 @@ from __future__ import annotations
 
 import os
 import sqlite3
-from typing import Iterable, Mapping
+import time
+from dataclasses import dataclass
+from typing import Callable, Iterable, List, Mapping, Optional, Tuple, TypeVar, Union
 
+from .bars import BarBatch, ts_utc_text
 
-def ensure_db(db_path: str) -> sqlite3.Connection:
+T = TypeVar("T")
+
+
+def ensure_db(db_path: str, busy_timeout: float = 30.0, wal: bool = False) -> sqlite3.Connection:
+    """打开（必要时创建）数据库。
+
+    busy_timeout 内遇到其他进程持有写锁时等待而不是立刻报 locked；
+    wal 时切到 WAL 日志模式，读不阻塞写，多个拉取进程共用一个库时使用。
+    """
     os.makedirs(os.path.dirname(db_path), exist_ok=True)
-    return sqlite3.connect(db_path)
+    conn = sqlite3.connect(db_path, timeout=busy_timeout)
+    # WAL 是持久设置，只在库还不是 WAL 时切换；切换需要独占，遇到其他进程正在写就留给下次打开
+    if wal and conn.execute("PRAGMA journal_mode").fetchone()[0].lower() != "wal":
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+        except sqlite3.OperationalError as exc:
+            if not is_busy_error(exc):
+                raise
+    return conn
+
+
+def is_busy_error(exc: BaseException) -> bool:
+    text = str(exc).lower()
+    return isinstance(exc, sqlite3.OperationalError) and ("locked" in text or "busy" in text)
+
+
+def commit_with_retry(
+    conn: sqlite3.Connection,
+    write: Callable[[], T],
+    attempts: int = 5,
+    base_delay: float = 0.2,
+    sleep: Callable[[float], None] = time.sleep,
+) -> T:
+    """执行一段写入并立即提交，保持写事务短小；SQLITE_BUSY 时指数退避后重试。
 
+    失败的语句由 SQLite 自行撤销，事务里此前的写入保留，所以只重放 write 与提交；
+    write 需要可重复执行（如 upsert）。
+    """
+    for attempt in range(attempts):
+        try:
+            result = write()
+            conn.commit()
+            return result
+        except sqlite3.OperationalError as exc:
+            if not is_busy_error(exc) or attempt == attempts - 1:
+                raise
+            sleep(base_delay * 2**attempt)
+    raise AssertionError("unreachable")
 
-def bars_table(symbol: str, bar: str) -> str:
+
+DEFAULT_WHAT_TO_SHOW = "TRADES"
+BAR_COLUMNS = ("open", "high", "low", "close", "volume", "vwap", "trade_count")
+
+
+def bars_table(symbol: str, bar: str, what_to_show: str = DEFAULT_WHAT_TO_SHOW) -> str:
+    """TRADES 沿用 bars_{symbol}_{bar}，其他序列加后缀，如 bars_MNQ_1m_bid_ask。"""
     safe_symbol = symbol.upper()
     safe_bar = bar.replace("/", "_")
-    return f"bars_{safe_symbol}_{safe_bar}"
+    if what_to_show.upper() == DEFAULT_WHAT_TO_SHOW:
+        return f"bars_{safe_symbol}_{safe_bar}"
+    return f"bars_{safe_symbol}_{safe_bar}_{what_to_show.lower()}"
+
 
+def _ensure_column(conn: sqlite3.Connection, table: str, column: str, decl: str) -> None:
+    columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    if column not in columns:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
 
-def create_bars_table(conn: sqlite3.Connection, symbol: str, bar: str) -> None:
-    table = bars_table(symbol, bar)
+
+def create_bars_table(
+    conn: sqlite3.Connection, symbol: str, bar: str, what_to_show: str = DEFAULT_WHAT_TO_SHOW
+) -> None:
+    table = bars_table(symbol, bar, what_to_show)
+    create_bar_registry(conn)
+    # 每次写入前都会调用：已登记的表说明表和触发器都建好了，只读一下就返回，不开写事务
+    if conn.execute("SELECT 1 FROM bar_tables WHERE table_name = ?", (table,)).fetchone():
+        return
+    create_revisions_table(conn)
     conn.execute(
         f"""
         CREATE TABLE IF NOT EXISTS {table} (
@@ -33,6 +101,205 @@ def create_bars_table(conn: sqlite3.Connection, symbol: str, bar: str) -> None:
         """
     )
 
+    # IB 修订已写入的K线时留下变更记录，内容相同的重写不会触发
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {table}_revision AFTER UPDATE ON {table}
+        BEGIN
+            INSERT INTO bar_revisions (table_name, ts_utc, old_values, new_values, revised_at)
+            VALUES (
+                '{table}',
+                old.ts_utc,
+                json_array({", ".join(f"old.{col}" for col in BAR_COLUMNS)}),
+                json_array({", ".join(f"new.{col}" for col in BAR_COLUMNS)}),
+                strftime('%Y-%m-%dT%H:%M:%f', 'now')
+            );
+        END
+        """
+    )
+    if change_log_enabled(conn):
+        _create_change_triggers(conn, table)
+    # 最后登记：登记过即表示上面都已建好
+    conn.execute(
+        "INSERT OR IGNORE INTO bar_tables (table_name, symbol, bar, what_to_show) VALUES (?, ?, ?, ?)",
+        (table, symbol.upper(), bar, what_to_show.upper()),
+    )
+
+
+def create_bar_registry(conn: sqlite3.Connection) -> None:
+    """bar_tables 记录每个K线表名对应的序列。"""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS bar_tables (
+            table_name TEXT PRIMARY KEY,
+            symbol TEXT NOT NULL,
+            bar TEXT NOT NULL,
+            what_to_show TEXT NOT NULL
+        )
+        """
+    )
+
+
+def parse_bars_table(table: str) -> Optional[Tuple[str, str, str]]:
+    """bars_table 的逆运算：表名 -> (symbol, bar, what_to_show)，不是K线表时返回 None。"""
+    if not table.startswith("bars_"):
+        return None
+    parts = table[len("bars_") :].split("_", 2)
+    if len(parts) < 2:
+        return None
+    symbol, bar = parts[0], parts[1]
+    what_to_show = parts[2].upper() if len(parts) == 3 else DEFAULT_WHAT_TO_SHOW
+    if bars_table(symbol, bar, what_to_show) != table:
+        return None
+    return symbol, bar, what_to_show
+
+
+def register_bar_tables(conn: sqlite3.Connection) -> int:
+    """把库里已有、还没登记的K线表补进 bar_tables（登记表出现之前建的表，只有再写入时才会登记）。
+
+    返回新登记的表数。
+    """
+    create_bar_registry(conn)
+    rows = conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name GLOB 'bars_*' "
+        "AND name NOT IN (SELECT table_name FROM bar_tables)"
+    ).fetchall()
+    registered = 0
+    for (table,) in rows:
+        parsed = parse_bars_table(table)
+        if parsed is not None:
+            create_bars_table(conn, *parsed)
+            registered += 1
+    return registered
+
+
+def change_log_enabled(conn: sqlite3.Connection) -> bool:
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'bar_changes'").fetchone()
+    return row is not None
+
+
+def change_log_seq(conn: sqlite3.Connection) -> int:
+    """bar_changes 已分配到的最大序号（清理掉的记录也算）；未启用时为 0。"""
+    if not change_log_enabled(conn):
+        return 0
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'bar_changes'").fetchone()
+    return row[0] if row else 0
+
+
+def _create_change_triggers(conn: sqlite3.Connection, table: str) -> None:
+    # 同步用的变更序号：新增和实际改写的K线都记一条；删除（如归档到冷存储）不记，不会同步成删除
+    for event in ("INSERT", "UPDATE"):
+        conn.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_change_{event.lower()} AFTER {event} ON {table}
+            BEGIN
+                INSERT INTO bar_changes (table_name, ts_utc) VALUES ('{table}', new.ts_utc);
+            END
+            """
+        )
+
+
+def enable_change_log(conn: sqlite3.Connection) -> None:
+    """启用 bar_changes 变更日志：只有 sync 和交易日聚合需要，第一次用到时才建表并给已登记的K线表挂触发器。
+
+    seq 单调递增，从 1 起算：序号 0 表示日志启用之前，此前写入的K线不在日志里，
+    sync 从 0 导出时按 bar_tables 发全量，聚合第一次运行时整表重建；
+    所以每次都先把还没登记的旧K线表补登记上。
+    """
+    register_bar_tables(conn)
+    if change_log_enabled(conn):
+        return
+    conn.execute(
+        """
+        CREATE TABLE bar_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name TEXT NOT NULL,
+            ts_utc TEXT NOT NULL
+        )
+        """
+    )
+    conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('bar_changes', 1)")
+    for (table,) in conn.execute("SELECT table_name FROM bar_tables").fetchall():
+        _create_change_triggers(conn, table)
+
+
+# 读 bar_changes 的使用方：各自的表里有 last_seq 列记录已处理到的序号
+CHANGE_LOG_CONSUMERS = ("sync_peers", "aggregate_state")
+
+
+def prune_change_log(conn: sqlite3.Connection) -> int:
+    """删除所有使用方（sync 对端、交易日聚合）都已处理过的变更记录；还没有使用方时不删。"""
+    if not change_log_enabled(conn):
+        return 0
+    floors = []
+    for table in CHANGE_LOG_CONSUMERS:
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+        ).fetchone()
+        floor = conn.execute(f"SELECT MIN(last_seq) FROM {table}").fetchone()[0] if exists else None
+        if floor is not None:
+            floors.append(floor)
+    if not floors:
+        return 0
+    return conn.execute("DELETE FROM bar_changes WHERE seq <= ?", (min(floors),)).rowcount
+
+
+def create_revisions_table(conn: sqlite3.Connection) -> None:
+    """old_values / new_values 为按 BAR_COLUMNS 顺序的 JSON 数组。"""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS bar_revisions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name TEXT NOT NULL,
+            ts_utc TEXT NOT NULL,
+            old_values TEXT NOT NULL,
+            new_values TEXT NOT NULL,
+            revised_at TEXT NOT NULL
+        )
+        """
+    )
+
+
+def create_cold_manifest_table(conn: sqlite3.Connection) -> None:
+    """冷存储清单：每个 (表, 月份) 一个压缩块，first_utc / last_utc 为块内首末K线时间。"""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS cold_blocks (
+            table_name TEXT NOT NULL,
+            month TEXT NOT NULL,
+            first_utc TEXT NOT NULL,
+            last_utc TEXT NOT NULL,
+            rows INTEGER NOT NULL,
+            path TEXT NOT NULL,
+            bytes INTEGER NOT NULL,
+            created_at TEXT NOT NULL,
+            PRIMARY KEY (table_name, month)
+        )
+        """
+    )
+
+
+def cold_blocks(
+    conn: sqlite3.Connection,
+    table: str,
+    start_utc: Optional[str] = None,
+    end_utc: Optional[str] = None,
+) -> List[Tuple[str, str, str, int, str]]:
+    """与 [start_utc, end_utc) 有交集的冷存储块 (month, first_utc, last_utc, rows, path)，按月份排序。"""
+    create_cold_manifest_table(conn)
+    where, params = ["table_name = ?"], [table]
+    if start_utc is not None:
+        where.append("last_utc >= ?")
+        params.append(start_utc)
+    if end_utc is not None:
+        where.append("first_utc < ?")
+        params.append(end_utc)
+    return conn.execute(
+        f"SELECT month, first_utc, last_utc, rows, path FROM cold_blocks WHERE {' AND '.join(where)} "
+        "ORDER BY month",
+        params,
+    ).fetchall()
+
 
 def create_failure_table(conn: sqlite3.Connection) -> None:
     conn.execute(
@@ -46,39 +313,183 @@ def create_failure_table(conn: sqlite3.Connection) -> None:
             attempt INTEGER NOT NULL,
             reason TEXT,
             is_no_data INTEGER NOT NULL,
-            created_at TEXT NOT NULL
+            created_at TEXT NOT NULL,
+            what_to_show TEXT NOT NULL DEFAULT 'TRADES',
+            resolved_at TEXT
         )
         """
     )
+    _ensure_column(conn, "fetch_failures", "what_to_show", "TEXT NOT NULL DEFAULT 'TRADES'")
+    _ensure_column(conn, "fetch_failures", "resolved_at", "TEXT")
 
 
-def insert_bars(conn: sqlite3.Connection, symbol: str, bar: str, rows: Iterable[Mapping]) -> int:
-    create_bars_table(conn, symbol, bar)
-    payload = [
-        (
-            row["ts_utc"],
-            row.get("open"),
-            row.get("high"),
-            row.get("low"),
-            row.get("close"),
-            row.get("volume"),
-            row.get("vwap"),
-            row.get("trade_count"),
+def create_head_timestamp_table(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS head_timestamps (
+            con_id INTEGER NOT NULL,
+            what_to_show TEXT NOT NULL,
+            use_rth INTEGER NOT NULL,
+            head_utc TEXT NOT NULL,
+            fetched_at TEXT NOT NULL,
+            PRIMARY KEY (con_id, what_to_show, use_rth)
         )
-        for row in rows
-    ]
-    if not payload:
-        return 0
-    table = bars_table(symbol, bar)
-    conn.executemany(
+        """
+    )
+
+
+def load_head_timestamp(
+    conn: sqlite3.Connection, con_id: int, what_to_show: str, use_rth: bool
+) -> Optional[str]:
+    create_head_timestamp_table(conn)
+    row = conn.execute(
+        "SELECT head_utc FROM head_timestamps WHERE con_id = ? AND what_to_show = ? AND use_rth = ?",
+        (con_id, what_to_show, int(use_rth)),
+    ).fetchone()
+    return row[0] if row else None
+
+
+def save_head_timestamp(
+    conn: sqlite3.Connection,
+    con_id: int,
+    what_to_show: str,
+    use_rth: bool,
+    head_utc: str,
+    fetched_at: str,
+) -> None:
+    create_head_timestamp_table(conn)
+    conn.execute(
+        """
+        INSERT OR REPLACE INTO head_timestamps
+        (con_id, what_to_show, use_rth, head_utc, fetched_at)
+        VALUES (?, ?, ?, ?, ?)
+        """,
+        (con_id, what_to_show, int(use_rth), head_utc, fetched_at),
+    )
+
+
+@dataclass
+class WriteStats:
+    """一次写入的行数拆分：新增、内容变化而更新、与库内相同而跳过。"""
+
+    received: int = 0
+    inserted: int = 0
+    updated: int = 0
+
+    @property
+    def unchanged(self) -> int:
+        return self.received - self.inserted - self.updated
+
+    @property
+    def written(self) -> int:
+        return self.inserted + self.updated
+
+
+_CHANGED = " OR ".join(f"{col} IS NOT excluded.{col}" for col in BAR_COLUMNS)
+
+
+def insert_bars(
+    conn: sqlite3.Connection,
+    symbol: str,
+    bar: str,
+    rows: Union[Iterable[Mapping], BarBatch],
+    what_to_show: str = DEFAULT_WHAT_TO_SHOW,
+) -> int:
+    """写入K线，返回收到的行数；需要新增/更新/未变拆分时用 upsert_bars。"""
+    return upsert_bars(conn, symbol, bar, rows, what_to_show).received
+
+
+def upsert_bars(
+    conn: sqlite3.Connection,
+    symbol: str,
+    bar: str,
+    rows: Union[Iterable[Mapping], BarBatch],
+    what_to_show: str = DEFAULT_WHAT_TO_SHOW,
+) -> WriteStats:
+    """幂等写入：新时间戳插入，已有时间戳只在内容变化时更新。
+
+    重拉已入库的窗口不再改写页面；更新由触发器记入 bar_revisions。
+    """
+    create_bars_table(conn, symbol, bar, what_to_show)
+    if isinstance(rows, BarBatch):
+        # 列式批次直接按元组流式写入，不经过中间 dict
+        count = len(rows)
+        keys = ts_utc_text(rows.ts).tolist()
+        payload = rows.to_records()
+    else:
+        payload = [
+            (
+                row["ts_utc"],
+                row.get("open"),
+                row.get("high"),
+                row.get("low"),
+                row.get("close"),
+                row.get("volume"),
+                row.get("vwap"),
+                row.get("trade_count"),
+            )
+            for row in rows
+        ]
+        count = len(payload)
+        keys = [row[0] for row in payload]
+    if not count:
+        return WriteStats()
+    table = bars_table(symbol, bar, what_to_show)
+    # 写入前数出批次里已在库的时间戳，其余的必然是新插入
+    distinct = set(keys)
+    inserted = len(distinct) - _count_existing(conn, table, distinct)
+    cursor = conn.executemany(
         f"""
-        INSERT OR REPLACE INTO {table}
+        INSERT INTO {table}
         (ts_utc, open, high, low, close, volume, vwap, trade_count)
         VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(ts_utc) DO UPDATE SET
+        {", ".join(f"{col} = excluded.{col}" for col in BAR_COLUMNS)}
+        WHERE {_CHANGED}
         """,
         payload,
     )
-    return len(payload)
+    # rowcount 只计语句本身写入的行（不含触发器），内容未变的冲突行不计入
+    return WriteStats(received=count, inserted=inserted, updated=cursor.rowcount - inserted)
+
+
+def _count_existing(conn: sqlite3.Connection, table: str, keys: Iterable[str], chunk_size: int = 500) -> int:
+    keys = list(keys)
+    total = 0
+    for offset in range(0, len(keys), chunk_size):
+        part = keys[offset : offset + chunk_size]
+        placeholders = ", ".join("?" * len(part))
+        total += conn.execute(
+            f"SELECT COUNT(*) FROM {table} WHERE ts_utc IN ({placeholders})", part
+        ).fetchone()[0]
+    return total
+
+
+def latest_bar_ts(
+    conn: sqlite3.Connection, symbol: str, bar: str, what_to_show: str = DEFAULT_WHAT_TO_SHOW
+) -> Optional[str]:
+    create_bars_table(conn, symbol, bar, what_to_show)
+    table = bars_table(symbol, bar, what_to_show)
+    row = conn.execute(f"SELECT MAX(ts_utc) FROM {table}").fetchone()
+    blocks = cold_blocks(conn, table)
+    candidates = [v for v in (row[0] if row else None, blocks[-1][2] if blocks else None) if v]
+    return max(candidates) if candidates else None
+
+
+def stored_span(
+    conn: sqlite3.Connection, symbol: str, bar: str, what_to_show: str = DEFAULT_WHAT_TO_SHOW
+) -> Optional[Tuple[str, str]]:
+    create_bars_table(conn, symbol, bar, what_to_show)
+    table = bars_table(symbol, bar, what_to_show)
+    row = conn.execute(f"SELECT MIN(ts_utc), MAX(ts_utc) FROM {table}").fetchone()
+    firsts = [row[0]] if row and row[0] is not None else []
+    lasts = [row[1]] if row and row[1] is not None else []
+    # 已归档到冷存储的月份同样算作库内数据
+    blocks = cold_blocks(conn, table)
+    if blocks:
+        firsts.append(blocks[0][1])
+        lasts.append(max(block[2] for block in blocks))
+    return (min(firsts), max(lasts)) if firsts else None
 
 
 def log_failure(
@@ -91,13 +502,39 @@ def log_failure(
     reason: str,
     is_no_data: bool,
     created_at: str,
+    what_to_show: str = DEFAULT_WHAT_TO_SHOW,
 ) -> None:
     create_failure_table(conn)
     conn.execute(
         """
         INSERT INTO fetch_failures
-        (symbol, bar, start_utc, end_utc, attempt, reason, is_no_data, created_at)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        (symbol, bar, start_utc, end_utc, attempt, reason, is_no_data, created_at, what_to_show)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
         """,
-        (symbol, bar, start_utc, end_utc, attempt, reason, int(is_no_data), created_at),
+        (symbol, bar, start_utc, end_utc, attempt, reason, int(is_no_data), created_at, what_to_show),
     )
+
+
+def resolve_failures(conn: sqlite3.Connection, ids: Iterable[int], resolved_at: str) -> int:
+    create_failure_table(conn)
+    cursor = conn.executemany(
+        "UPDATE fetch_failures SET resolved_at = ? WHERE id = ? AND resolved_at IS NULL",
+        [(resolved_at, failure_id) for failure_id in ids],
+    )
+    return cursor.rowcount
+
+
+def compact_failures(conn: sqlite3.Connection) -> int:
+    """删除已解决的失败记录，同一窗口的多次失败只保留最新一条。"""
+    create_failure_table(conn)
+    deleted = conn.execute("DELETE FROM fetch_failures WHERE resolved_at IS NOT NULL").rowcount
+    deleted += conn.execute(
+        """
+        DELETE FROM fetch_failures
+        WHERE id NOT IN (
+            SELECT MAX(id) FROM fetch_failures
+            GROUP BY symbol, bar, what_to_show, start_utc, end_utc, is_no_data
+        )
+        """
+    ).rowcount
+    return deleted
@@ -0,0 +1,233 @@
+from __future__ import annotations
+
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .bars import bar_seconds
+from .config import Config, default_config, merge_config
+from .fetcher import fetch_history, parse_lookback
+from .ib_client import IBAsyncClient
+from .storage import ensure_db, insert_bars, latest_bar_ts
+
+REALTIME_BAR_SECONDS = 5
+
+
+@dataclass
+class BarAggregator:
+    """把 IB 5 秒实时K线聚合为指定周期的完整K线。
+
+    只输出收齐 seconds // 5 根 5 秒K线的周期；订阅中途开始的第一个周期、断流时缺了
+    中间或末尾几根的周期都直接丢弃，由缺口回补负责。
+    """
+
+    seconds: int
+    _bucket: Optional[int] = None
+    _parts: int = 0
+    _open: float = 0.0
+    _high: float = 0.0
+    _low: float = 0.0
+    _close: float = 0.0
+    _volume: int = 0
+    _notional: float = 0.0
+    _count: int = 0
+
+    def add(
+        self,
+        ts: int,
+        open_: float,
+        high: float,
+        low: float,
+        close: float,
+        volume: float,
+        wap: float,
+        count: int,
+    ) -> List[Dict]:
+        """加入一根 5 秒K线（ts 为其起始秒），返回因此完成的周期K线。"""
+        completed: List[Dict] = []
+        bucket = ts - ts % self.seconds
+        if self._bucket is not None and bucket != self._bucket:
+            # 上一周期没收到最后一根 5 秒K线（断流等），不完整，丢弃
+            self._bucket = None
+        if self._bucket is None:
+            self._bucket = bucket
+            self._open, self._high, self._low = open_, high, low
+            self._volume, self._notional, self._count, self._parts = 0, 0.0, 0, 0
+        else:
+            self._high = max(self._high, high)
+            self._low = min(self._low, low)
+        self._close = close
+        self._volume += int(volume)
+        self._notional += wap * volume
+        self._count += count
+        self._parts += 1
+        if ts + REALTIME_BAR_SECONDS >= bucket + self.seconds:
+            if self._parts == self.seconds // REALTIME_BAR_SECONDS:
+                completed.append(self._row())
+            self._bucket = None
+        return completed
+
+    def reset(self) -> None:
+        self._bucket = None
+
+    def _row(self) -> Dict:
+        return {
+            "ts_utc": datetime.fromtimestamp(self._bucket, tz=timezone.utc).isoformat(),
+            "open": self._open,
+            "high": self._high,
+            "low": self._low,
+            "close": self._close,
+            "volume": self._volume,
+            "vwap": self._notional / self._volume if self._volume else self._close,
+            "trade_count": self._count,
+        }
+
+
+@dataclass
+class _Subscription:
+    symbol: str
+    contract: object
+    aggregators: Dict[str, BarAggregator]
+    handle: object = None
+    # 每个周期本次连接内最近写入的完整K线起点；没有时首根完整K线要先回补与库内的缺口
+    last_bucket: Dict[str, datetime] = field(default_factory=dict)
+
+
+class StreamDaemon:
+    """订阅实时K线并持续写库，断线重连后只回补缺口。"""
+
+    def __init__(
+        self,
+        symbols: Sequence[str],
+        bars: Sequence[str],
+        config: Config,
+        db_path: str,
+        client: Optional[IBAsyncClient] = None,
+    ) -> None:
+        for bar in bars:
+            if bar_seconds(bar) >= 86400:
+                raise ValueError(f"实时聚合仅支持日内周期: {bar}")
+        self.symbols = [s.upper() for s in symbols]
+        self.bars = list(bars)
+        self.config = config
+        self.db_path = db_path
+        self.client = client or IBAsyncClient.from_config(config, None)
+        self.conn = ensure_db(db_path)
+        self._subs: List[_Subscription] = []
+        self._pending: List[Tuple[_Subscription, str, Dict]] = []
+
+    def run(self, duration: Optional[float] = None) -> None:
+        deadline = None if duration is None else time.monotonic() + duration
+        try:
+            while deadline is None or time.monotonic() < deadline:
+                if not self.client.is_connected():
+                    self._connect()
+                    continue
+                self.client.wait(1.0)
+                self._drain()
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        for sub in self._subs:
+            if sub.handle is not None:
+                self.client.cancel_realtime_bars(sub.handle)
+        self._subs = []
+        self.client.close()
+        self.conn.close()
+
+    def _connect(self) -> None:
+        self.client.close()
+        self._subs = []
+        try:
+            for symbol in self.symbols:
+                contract = self.client.front_contract(symbol, self.config)
+                sub = _Subscription(
+                    symbol=symbol,
+                    contract=contract,
+                    aggregators={bar: BarAggregator(bar_seconds(bar)) for bar in self.bars},
+                )
+                sub.handle = self.client.subscribe_realtime_bars(
+                    contract, lambda rt_bar, sub=sub: self._on_bar(sub, rt_bar)
+                )
+                self._subs.append(sub)
+        except Exception as exc:  # noqa: BLE001
+            print(f"[stream] 连接或订阅失败: {exc}，{self.config.stream_reconnect_seconds}s 后重试")
+            self.client.close()
+            time.sleep(self.config.stream_reconnect_seconds)
+
+    def _on_bar(self, sub: _Subscription, rt_bar) -> None:
+        ts = rt_bar.time
+        if ts.tzinfo is None:
+            ts = ts.replace(tzinfo=timezone.utc)
+        epoch = int(ts.timestamp())
+        for bar, aggregator in sub.aggregators.items():
+            for row in aggregator.add(
+                epoch,
+                rt_bar.open_,
+                rt_bar.high,
+                rt_bar.low,
+                rt_bar.close,
+                rt_bar.volume,
+                rt_bar.wap,
+                rt_bar.count,
+            ):
+                # 回调发生在 ib_async 事件处理中，写库和回补放到主循环里做
+                self._pending.append((sub, bar, row))
+
+    def _drain(self) -> None:
+        pending, self._pending = self._pending, []
+        for sub, bar, row in pending:
+            bucket = datetime.fromisoformat(row["ts_utc"])
+            last = sub.last_bucket.get(bar)
+            step = timedelta(seconds=bar_seconds(bar))
+            if last is None:
+                self._backfill_gap(sub.symbol, bar, bucket)
+            elif bucket > last + step:
+                # 中间丢弃了不完整的周期（或整段断流），从历史接口补齐
+                self._backfill_gap(sub.symbol, bar, bucket, start=last + step)
+            sub.last_bucket[bar] = bucket
+            insert_bars(self.conn, sub.symbol, bar, [row], what_to_show=self.config.what_to_show)
+        if pending:
+            self.conn.commit()
+
+    def _backfill_gap(
+        self, symbol: str, bar: str, first_live: datetime, start: Optional[datetime] = None
+    ) -> None:
+        """用历史接口回补 [start, first_live) 的缺口。
+
+        start 缺省为库内最新K线，最多回溯 stream_max_backfill。
+        """
+        if start is None:
+            floor = first_live - parse_lookback(self.config.stream_max_backfill)
+            last = latest_bar_ts(self.conn, symbol, bar, what_to_show=self.config.what_to_show)
+            start = max(datetime.fromisoformat(last), floor) if last else floor
+        if start >= first_live:
+            return
+        # fetch_history 用自己的连接写库：先提交本连接上已写入的实时K线（及建表），否则两边互等写锁
+        self.conn.commit()
+        report = fetch_history(
+            symbols=[symbol],
+            bars=[bar],
+            start=start.replace(tzinfo=None),
+            end=first_live.replace(tzinfo=None),
+            config=self.config,
+            db_path=self.db_path,
+            client=self.client,
+        )
+        print(
+            f"[stream] {symbol} {bar} 回补 {start.isoformat()} ~ {first_live.isoformat()}: "
+            f"{report.success_count} 条"
+        )
+
+
+def run_stream(
+    symbols: Sequence[str],
+    bars: Sequence[str],
+    config: Optional[Config] = None,
+    db_path: str = "data/ib_history.sqlite",
+    duration: Optional[float] = None,
+) -> None:
+    cfg = merge_config(config or default_config())
+    StreamDaemon(symbols, bars, cfg, db_path).run(duration=duration)
@@ -0,0 +1,249 @@
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional
+
+import numpy as np
+
+from .bars import BAR_DTYPE, BarBatch, ts_utc_text
+from .cold import decode_batch, encode_batch, merge_batches
+from .reader import read_bar_chunks
+from .storage import BAR_COLUMNS, change_log_seq, enable_change_log, prune_change_log, upsert_bars
+
+SYNC_FORMAT = 1
+
+
+@dataclass
+class SyncBatch:
+    """一个同步批次：源库 source_id 在 (from_seq, to_seq] 之间变更过的K线。"""
+
+    source_id: str
+    from_seq: int
+    to_seq: int
+    # 表名 -> 行数
+    tables: Dict[str, int] = field(default_factory=dict)
+    bytes: int = 0
+    inserted: int = 0
+    updated: int = 0
+
+    @property
+    def rows(self) -> int:
+        return sum(self.tables.values())
+
+
+def create_sync_tables(conn: sqlite3.Connection) -> None:
+    """sync_peers 记录导出方给每个对端发到的序号，sync_sources 记录接收方从每个源库应用到的序号。"""
+    enable_change_log(conn)
+    conn.execute("CREATE TABLE IF NOT EXISTS sync_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS sync_peers (
+            peer TEXT PRIMARY KEY,
+            last_seq INTEGER NOT NULL,
+            synced_at TEXT NOT NULL
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS sync_sources (
+            source_id TEXT PRIMARY KEY,
+            last_seq INTEGER NOT NULL,
+            applied_at TEXT NOT NULL
+        )
+        """
+    )
+
+
+def database_id(conn: sqlite3.Connection) -> str:
+    """库的唯一标识，第一次用到时生成；整库复制出来的副本要先 init_replica 换成新标识。"""
+    create_sync_tables(conn)
+    row = conn.execute("SELECT value FROM sync_meta WHERE key = 'database_id'").fetchone()
+    if row is not None:
+        return row[0]
+    value = uuid.uuid4().hex
+    conn.execute("INSERT INTO sync_meta (key, value) VALUES ('database_id', ?)", (value,))
+    return value
+
+
+def init_replica(conn: sqlite3.Connection) -> SyncBatch:
+    """把整库复制出来的文件初始化为副本：记下源库及其当前序号，自己换一个新标识。
+
+    返回的 to_seq 是源库导出下一批时应使用的 since。
+    """
+    create_sync_tables(conn)
+    source_id = database_id(conn)
+    last_seq = change_log_seq(conn)
+    conn.execute(
+        "INSERT OR REPLACE INTO sync_sources (source_id, last_seq, applied_at) VALUES (?, ?, ?)",
+        (source_id, last_seq, datetime.utcnow().isoformat()),
+    )
+    # 复制来的变更记录与对端进度属于源库
+    conn.execute("DELETE FROM bar_changes")
+    conn.execute("DELETE FROM sync_peers")
+    conn.execute("DELETE FROM sync_meta WHERE key = 'database_id'")
+    database_id(conn)
+    conn.commit()
+    return SyncBatch(source_id=source_id, from_seq=0, to_seq=last_seq)
+
+
+def _changed_batch(conn: sqlite3.Connection, table: str, since: int, until: int) -> BarBatch:
+    changed = "SELECT ts_utc FROM bar_changes WHERE table_name = ? AND seq > ? AND seq <= ?"
+    rows = conn.execute(
+        f"SELECT CAST(strftime('%s', ts_utc) AS INTEGER), {', '.join(BAR_COLUMNS)} FROM {table} "
+        f"WHERE ts_utc IN ({changed}) ORDER BY ts_utc",
+        (table, since, until),
+    ).fetchall()
+    hot = BarBatch.empty()
+    if rows:
+        matrix = np.array(rows, dtype=np.float64)
+        values = np.empty(len(rows), dtype=BAR_DTYPE)
+        for offset, name in enumerate(BAR_DTYPE.names):
+            column = matrix[:, offset + 1]
+            values[name] = np.nan_to_num(column) if values.dtype[name].kind == "i" else column
+        hot = BarBatch(ts=matrix[:, 0].astype(np.int64), values=values)
+    # 变更之后又被归档到冷存储的K线从块里取
+    archived = conn.execute(
+        f"SELECT DISTINCT CAST(strftime('%s', ts_utc) AS INTEGER) FROM ({changed}) "
+        f"WHERE ts_utc NOT IN (SELECT ts_utc FROM {table})",
+        (table, since, until),
+    ).fetchall()
+    if not archived:
+        return hot
+    wanted = np.array(sorted(row[0] for row in archived), dtype=np.int64)
+    meta = conn.execute(
+        "SELECT symbol, bar, what_to_show FROM bar_tables WHERE table_name = ?", (table,)
+    ).fetchone()
+    start, end = ts_utc_text(np.array([wanted[0], wanted[-1] + 1], dtype=np.int64)).tolist()
+    cold = BarBatch.empty()
+    for batch in read_bar_chunks(conn, meta[0], meta[1], meta[2], start_utc=start, end_utc=end):
+        keep = np.isin(batch.ts, wanted)
+        cold = merge_batches(cold, BarBatch(ts=batch.ts[keep], values=batch.values[keep]))
+    return merge_batches(cold, hot)
+
+
+def _full_batch(conn: sqlite3.Connection, symbol: str, bar: str, what_to_show: str) -> BarBatch:
+    chunks = list(read_bar_chunks(conn, symbol, bar, what_to_show))
+    if not chunks:
+        return BarBatch.empty()
+    return BarBatch(ts=np.concatenate([c.ts for c in chunks]), values=np.concatenate([c.values for c in chunks]))
+
+
+def export_changes(
+    conn: sqlite3.Connection,
+    out_path: str,
+    since: Optional[int] = None,
+    peer: Optional[str] = None,
+) -> SyncBatch:
+    """把序号 since 之后新增或改写过的K线写成一个压缩批次文件。
+
+    给出 peer 时 since 缺省取上次发给该对端的序号，导出后推进；同一K线多次改写只发最终值。
+    since 为 0 时导出全部K线（含冷存储）：变更日志启用之前写入的K线不在日志里。
+    """
+    create_sync_tables(conn)
+    if since is None:
+        row = None
+        if peer:
+            row = conn.execute("SELECT last_seq FROM sync_peers WHERE peer = ?", (peer,)).fetchone()
+        since = row[0] if row else 0
+    until = change_log_seq(conn)
+    result = SyncBatch(source_id=database_id(conn), from_seq=since, to_seq=max(until, since))
+    arrays: Dict[str, np.ndarray] = {}
+    series = []
+    if since == 0:
+        tables = conn.execute(
+            "SELECT table_name, symbol, bar, what_to_show FROM bar_tables ORDER BY table_name"
+        ).fetchall()
+    else:
+        tables = conn.execute(
+            "SELECT t.table_name, t.symbol, t.bar, t.what_to_show FROM bar_tables t WHERE t.table_name IN "
+            "(SELECT table_name FROM bar_changes WHERE seq > ? AND seq <= ?) ORDER BY t.table_name",
+            (since, until),
+        ).fetchall()
+    for idx, (table, symbol, bar, what) in enumerate(tables):
+        if since == 0:
+            batch = _full_batch(conn, symbol, bar, what)
+        else:
+            batch = _changed_batch(conn, table, since, until)
+        if not len(batch):
+            continue
+        arrays.update(encode_batch(batch, f"s{idx}_"))
+        series.append(
+            {"prefix": f"s{idx}_", "table": table, "symbol": symbol, "bar": bar, "what_to_show": what}
+        )
+        result.tables[table] = len(batch)
+    header = {
+        "format": SYNC_FORMAT,
+        "source_id": result.source_id,
+        "from_seq": result.from_seq,
+        "to_seq": result.to_seq,
+        "created_at": datetime.utcnow().isoformat(),
+        "series": series,
+    }
+    target = Path(out_path)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp = target.with_name(target.name + ".tmp")
+    with open(tmp, "wb") as handle:
+        payload = np.frombuffer(json.dumps(header).encode(), dtype=np.uint8)
+        np.savez_compressed(handle, header=payload, **arrays)
+    os.replace(tmp, target)
+    result.bytes = target.stat().st_size
+    if peer:
+        conn.execute(
+            "INSERT OR REPLACE INTO sync_peers (peer, last_seq, synced_at) VALUES (?, ?, ?)",
+            (peer, result.to_seq, datetime.utcnow().isoformat()),
+        )
+    conn.commit()
+    return result
+
+
+def apply_changes(conn: sqlite3.Connection, batch_path: str, force: bool = False) -> SyncBatch:
+    """把批次幂等地写入本库：重复应用同一批次不改变数据。
+
+    批次起点晚于本库已应用到的序号说明中间缺了批次，默认拒绝；force 时照样应用。
+    """
+    create_sync_tables(conn)
+    with np.load(batch_path) as archive:
+        header = json.loads(archive["header"].tobytes().decode())
+        if header.get("format") != SYNC_FORMAT:
+            raise ValueError(f"不支持的同步批次格式: {header.get('format')}")
+        result = SyncBatch(
+            source_id=header["source_id"], from_seq=header["from_seq"], to_seq=header["to_seq"]
+        )
+        if result.source_id == database_id(conn):
+            raise ValueError("批次来自本库，不能应用到自身")
+        row = conn.execute(
+            "SELECT last_seq FROM sync_sources WHERE source_id = ?", (result.source_id,)
+        ).fetchone()
+        applied = row[0] if row else 0
+        if result.from_seq > applied and not force:
+            raise ValueError(
+                f"批次从序号 {result.from_seq} 开始，本库只应用到 {applied}，缺少中间的批次"
+            )
+        for series in header["series"]:
+            batch = decode_batch(archive, series["prefix"])
+            stats = upsert_bars(conn, series["symbol"], series["bar"], batch, series["what_to_show"])
+            result.tables[series["table"]] = len(batch)
+            result.inserted += stats.inserted
+            result.updated += stats.updated
+    result.bytes = os.path.getsize(batch_path)
+    conn.execute(
+        "INSERT OR REPLACE INTO sync_sources (source_id, last_seq, applied_at) VALUES (?, ?, ?)",
+        (result.source_id, max(applied, result.to_seq), datetime.utcnow().isoformat()),
+    )
+    conn.commit()
+    return result
+
+
+def prune_changes(conn: sqlite3.Connection) -> int:
+    """删除所有已登记对端都已导出、交易日聚合也都已处理过的变更记录；都还没有时不删。"""
+    create_sync_tables(conn)
+    deleted = prune_change_log(conn)
+    conn.commit()
+    return deleted
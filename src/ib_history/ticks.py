@@ -0,0 +1,198 @@
+from __future__ import annotations
+
+import os
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+from .bars import BAR_DTYPE, BarBatch
+
+NS_PER_SECOND = 1_000_000_000
+
+TICK_DTYPES = {
+    "TRADES": np.dtype([("ts_ns", np.int64), ("price", np.float32), ("size", np.int32)]),
+    "BID_ASK": np.dtype(
+        [
+            ("ts_ns", np.int64),
+            ("bid", np.float32),
+            ("ask", np.float32),
+            ("bid_size", np.int32),
+            ("ask_size", np.int32),
+        ]
+    ),
+}
+
+
+def _tick_dtype(kind: str) -> np.dtype:
+    dtype = TICK_DTYPES.get(kind)
+    if dtype is None:
+        raise ValueError(f"不支持的tick类型: {kind}")
+    return dtype
+
+
+def _utc(value: datetime) -> datetime:
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def _to_ns(value: datetime) -> int:
+    value = _utc(value)
+    return int(value.timestamp()) * NS_PER_SECOND + value.microsecond * 1000
+
+
+@dataclass
+class TickBatch:
+    """一批 tick，按列存放（整型纳秒时间戳 + float32/int32 列）。"""
+
+    kind: str
+    data: np.ndarray
+
+    def __len__(self) -> int:
+        return int(self.data.shape[0])
+
+    @classmethod
+    def empty(cls, kind: str) -> "TickBatch":
+        return cls(kind=kind, data=np.empty(0, dtype=_tick_dtype(kind)))
+
+    @classmethod
+    def from_ticks(cls, ticks: Sequence, kind: str) -> "TickBatch":
+        """由 ib_async 的 HistoricalTickLast / HistoricalTickBidAsk 列表填充。"""
+        dtype = _tick_dtype(kind)
+        if kind == "TRADES":
+            rows = ((_to_ns(t.time), t.price, t.size) for t in ticks)
+        else:
+            rows = ((_to_ns(t.time), t.priceBid, t.priceAsk, t.sizeBid, t.sizeAsk) for t in ticks)
+        return cls(kind=kind, data=np.fromiter(rows, dtype=dtype, count=len(ticks)))
+
+    @classmethod
+    def concat(cls, kind: str, batches: Iterable["TickBatch"]) -> "TickBatch":
+        parts = [b.data for b in batches if len(b)]
+        if not parts:
+            return cls.empty(kind)
+        return cls(kind=kind, data=np.concatenate(parts))
+
+    def between(self, start: datetime, end: datetime) -> "TickBatch":
+        ts = self.data["ts_ns"]
+        mask = (ts >= _to_ns(start)) & (ts < _to_ns(end))
+        return TickBatch(kind=self.kind, data=self.data[mask])
+
+
+def _partition_path(root: str, symbol: str, kind: str, day) -> Path:
+    return Path(root) / symbol.upper() / kind / f"{day.year:04d}" / f"{day.isoformat()}.npz"
+
+
+def _read_partition(path: Path, kind: str) -> np.ndarray:
+    dtype = _tick_dtype(kind)
+    with np.load(path) as archive:
+        data = np.empty(len(archive["ts_ns"]), dtype=dtype)
+        for name in dtype.names:
+            data[name] = archive[name]
+    return data
+
+
+def _days(start: datetime, end: datetime) -> List:
+    start, end = _utc(start), _utc(end)
+    days = []
+    day = start.date()
+    while datetime.combine(day, datetime.min.time(), tzinfo=timezone.utc) < end:
+        days.append(day)
+        day += timedelta(days=1)
+    return days
+
+
+def write_ticks(
+    root: str, symbol: str, batch: TickBatch, start: datetime, end: datetime
+) -> int:
+    """把 [start, end) 内的 tick 写入按 UTC 日分区的压缩文件，覆盖该区间的旧数据。"""
+    start_ns, end_ns = _to_ns(start), _to_ns(end)
+    written = 0
+    for day in _days(start, end):
+        day_start = datetime.combine(day, datetime.min.time(), tzinfo=timezone.utc)
+        lo = max(start_ns, _to_ns(day_start))
+        hi = min(end_ns, _to_ns(day_start + timedelta(days=1)))
+        ts = batch.data["ts_ns"]
+        fresh = batch.data[(ts >= lo) & (ts < hi)]
+        path = _partition_path(root, symbol, batch.kind, day)
+        if path.exists():
+            old = _read_partition(path, batch.kind)
+            keep = old[(old["ts_ns"] < lo) | (old["ts_ns"] >= hi)]
+            merged = np.concatenate([keep, fresh])
+        else:
+            merged = fresh
+        if not len(merged):
+            continue
+        merged = merged[np.argsort(merged["ts_ns"], kind="stable")]
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.stem + ".tmp.npz")
+        np.savez_compressed(tmp, **{name: merged[name] for name in merged.dtype.names})
+        os.replace(tmp, path)
+        written += len(fresh)
+    return written
+
+
+def iter_ticks(
+    root: str, symbol: str, kind: str, start: datetime, end: datetime
+) -> Iterator[TickBatch]:
+    """逐个分区读取 [start, end) 内的 tick，内存占用不超过单日数据量。"""
+    start_ns, end_ns = _to_ns(start), _to_ns(end)
+    for day in _days(start, end):
+        path = _partition_path(root, symbol, kind, day)
+        if not path.exists():
+            continue
+        data = _read_partition(path, kind)
+        ts = data["ts_ns"]
+        data = data[(ts >= start_ns) & (ts < end_ns)]
+        if len(data):
+            yield TickBatch(kind=kind, data=data)
+
+
+def aggregate_ticks(chunks: Iterable[TickBatch], seconds: int) -> Iterator[BarBatch]:
+    """把按时间有序的 tick 流聚合为任意秒数周期的K线，跨分区的周期会被正确拼接。
+
+    TRADES 按成交价聚合；BID_ASK 按中间价聚合，volume 为 0，trade_count 为报价次数。
+    """
+    step = seconds * NS_PER_SECOND
+    carry: Optional[np.ndarray] = None
+    kind = "TRADES"
+    for chunk in chunks:
+        kind = chunk.kind
+        data = chunk.data if carry is None else np.concatenate([carry, chunk.data])
+        if not len(data):
+            continue
+        buckets = data["ts_ns"] // step
+        done = buckets < buckets[-1]
+        carry = data[~done]
+        if done.any():
+            yield _ticks_to_bars(data[done], buckets[done], seconds, kind)
+    if carry is not None and len(carry):
+        yield _ticks_to_bars(carry, carry["ts_ns"] // step, seconds, kind)
+
+
+def _ticks_to_bars(data: np.ndarray, buckets: np.ndarray, seconds: int, kind: str) -> BarBatch:
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(data)]
+    if kind == "TRADES":
+        price = data["price"].astype(np.float64)
+        size = data["size"].astype(np.int64)
+    else:
+        price = (data["bid"].astype(np.float64) + data["ask"].astype(np.float64)) / 2
+        size = np.zeros(len(data), dtype=np.int64)
+    values = np.empty(len(starts), dtype=BAR_DTYPE)
+    values["open"] = price[starts]
+    values["high"] = np.maximum.reduceat(price, starts)
+    values["low"] = np.minimum.reduceat(price, starts)
+    values["close"] = price[ends - 1]
+    volume = np.add.reduceat(size, starts)
+    values["volume"] = volume
+    values["trade_count"] = ends - starts
+    if kind == "TRADES":
+        notional = np.add.reduceat(price * size, starts)
+        values["vwap"] = np.where(volume > 0, notional / np.maximum(volume, 1), values["close"])
+    else:
+        values["vwap"] = np.add.reduceat(price, starts) / (ends - starts)
+    ts = buckets[starts] * seconds
+    return BarBatch(ts=ts.astype(np.int64), values=values)
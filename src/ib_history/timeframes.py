@@ -0,0 +1,266 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import sqlite3
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .bars import BarBatch, bar_seconds, ts_utc_text
+from .cold import read_block
+from .config import Config, default_config
+from .reader import read_bar_chunks, read_column_chunks
+from .storage import DEFAULT_WHAT_TO_SHOW, bars_table, cold_blocks
+
+# completed：映射到细周期K线收盘时已经走完的最后一根粗周期K线，回测无未来数据
+# containing：映射到包含该细周期K线的粗周期K线，其 OHLC 含未来信息，只适合打标签
+MODES = ("completed", "containing")
+
+
+@dataclass
+class MultiTimeframe:
+    """同一品种的多个周期，parents[bar][i] 是基准周期第 i 根对应的该周期K线下标，-1 表示没有。"""
+
+    symbol: str
+    base: str
+    mode: str
+    frames: Dict[str, BarBatch]
+    parents: Dict[str, np.ndarray]
+    # 本次加载时实际重新计算的映射行数，命中缓存为 0
+    index_rows_computed: Dict[str, int] = field(default_factory=dict)
+
+    def context(self, bar: str, column: str) -> np.ndarray:
+        """把粗周期某列按映射展开到基准周期长度，没有对应K线的位置为 NaN。"""
+        parent = self.parents[bar]
+        values = self.frames[bar].values[column].astype(np.float64)
+        out = np.full(len(parent), np.nan)
+        valid = parent >= 0
+        out[valid] = values[parent[valid]]
+        return out
+
+
+def parent_index(
+    fine_ts: np.ndarray, coarse_ts: np.ndarray, fine_step: int, coarse_step: int, mode: str = "completed"
+) -> np.ndarray:
+    """细周期每根K线对应的粗周期K线下标（两组时间戳均为K线起点且升序）。"""
+    if mode == "completed":
+        idx = np.searchsorted(coarse_ts + coarse_step, fine_ts + fine_step, side="right") - 1
+    elif mode == "containing":
+        idx = np.searchsorted(coarse_ts, fine_ts, side="right") - 1
+        inside = idx >= 0
+        inside[inside] = fine_ts[inside] < coarse_ts[idx[inside]] + coarse_step
+        idx[~inside] = -1
+    else:
+        raise ValueError(f"未知映射方式: {mode}")
+    return idx.astype(np.int64)
+
+
+def _read_ts(conn, symbol: str, bar: str, what_to_show: str, start_utc: Optional[str] = None) -> np.ndarray:
+    parts = [ts for ts, _ in read_column_chunks(conn, symbol, bar, what_to_show, (), start_utc=start_utc)]
+    return np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+
+
+def _count_rows(conn, table: str, op: str, ts_text: str) -> int:
+    count = conn.execute(f"SELECT COUNT(*) FROM {table} WHERE ts_utc {op} ?", (ts_text,)).fetchone()[0]
+    # 冷存储块整块落在范围内的直接用清单里的行数，只有跨界的块才解压
+    for _, first_utc, last_utc, rows, path in cold_blocks(conn, table):
+        if first_utc > ts_text or (op == "<" and first_utc == ts_text):
+            break
+        if last_utc < ts_text or (op == "<=" and last_utc == ts_text):
+            count += rows
+        else:
+            bound = int(np.datetime64(ts_text[:19], "s").astype(np.int64))
+            ts = read_block(path).ts
+            count += int(np.count_nonzero(ts <= bound if op == "<=" else ts < bound))
+    return count
+
+
+def _nearest_ts(conn, table: str, op: str, ts_text: str) -> Optional[str]:
+    """op 为 ">" 时取晚于 ts_text 的第一根，"<" 时取早于它的最后一根，热表与冷存储块一起看。"""
+    after = op == ">"
+    found = conn.execute(
+        f"SELECT {'MIN' if after else 'MAX'}(ts_utc) FROM {table} WHERE ts_utc {op} ?", (ts_text,)
+    ).fetchone()[0]
+    candidates = [found] if found is not None else []
+    if after:
+        blocks = cold_blocks(conn, table, start_utc=ts_text)
+    else:
+        blocks = cold_blocks(conn, table, end_utc=ts_text)[::-1]
+    bound = int(np.datetime64(ts_text[:19], "s").astype(np.int64))
+    for _, first_utc, last_utc, _, path in blocks:
+        edge = first_utc if after else last_utc
+        if (edge > ts_text) if after else (edge < ts_text):
+            candidates.append(edge)
+            break
+        # 块跨过 ts_text 时才解压
+        ts = read_block(path).ts
+        inside = ts[ts > bound] if after else ts[ts < bound]
+        if len(inside):
+            candidates.append(_text(int(inside[0] if after else inside[-1])))
+            break
+    if not candidates:
+        return None
+    return min(candidates) if after else max(candidates)
+
+
+def _text(epoch: int) -> str:
+    return str(ts_utc_text(np.array([epoch], dtype=np.int64))[0])
+
+
+class _IndexCache:
+    """整表范围的映射缓存：fine_ts 与 parent 对齐细周期全表，parent 为粗周期全表下标。
+
+    表尾追加数据时只补算受影响的尾部；中间插入或删除导致行数对不上时整体重建。
+    按数据库文件的绝对路径分目录，不同目录下同名的库互不干扰；内存库不落盘缓存。
+    """
+
+    def __init__(
+        self, cache_dir: str, db_file: str, symbol: str, what: str, fine: str, coarse: str, mode: str
+    ) -> None:
+        self.path: Optional[Path] = None
+        if db_file:
+            resolved = Path(db_file).resolve()
+            digest = hashlib.sha1(str(resolved).encode("utf-8")).hexdigest()[:16]
+            name = f"{symbol.upper()}_{what.lower()}_{fine}_{coarse}_{mode}.npz"
+            self.path = Path(cache_dir) / f"{resolved.stem}-{digest}" / name
+
+    def load(self) -> Optional[Dict[str, np.ndarray]]:
+        if self.path is None or not self.path.exists():
+            return None
+        with np.load(self.path) as data:
+            return {name: data[name] for name in data.files}
+
+    def save(self, fine_ts: np.ndarray, parent: np.ndarray, coarse_rows: int, coarse_last: int) -> None:
+        if self.path is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp.npz")
+        np.savez(
+            tmp,
+            fine_ts=fine_ts,
+            parent=parent,
+            coarse_rows=np.int64(coarse_rows),
+            coarse_last=np.int64(coarse_last),
+        )
+        os.replace(tmp, self.path)
+
+
+def _cached_parents(
+    conn: sqlite3.Connection,
+    symbol: str,
+    what_to_show: str,
+    fine: str,
+    coarse: str,
+    mode: str,
+    cache_dir: str,
+) -> Tuple[np.ndarray, np.ndarray, int]:
+    """返回 (细周期全表时间戳, 粗周期全表下标, 本次计算的行数)。"""
+    fine_step, coarse_step = bar_seconds(fine), bar_seconds(coarse)
+    fine_table = bars_table(symbol, fine, what_to_show)
+    coarse_table = bars_table(symbol, coarse, what_to_show)
+    db_file = conn.execute("PRAGMA database_list").fetchone()[2]
+    cache = _IndexCache(cache_dir, db_file, symbol, what_to_show, fine, coarse, mode)
+    cached = cache.load()
+
+    recompute_from: Optional[int] = None
+    kept_ts = np.empty(0, dtype=np.int64)
+    kept_parent = np.empty(0, dtype=np.int64)
+    if cached is not None and len(cached["fine_ts"]):
+        fine_last = int(cached["fine_ts"][-1])
+        coarse_last = int(cached["coarse_last"])
+        if (
+            _count_rows(conn, fine_table, "<=", _text(fine_last)) == len(cached["fine_ts"])
+            and _count_rows(conn, coarse_table, "<=", _text(coarse_last)) == int(cached["coarse_rows"])
+        ):
+            recompute_from = fine_last + 1
+            first_new = _nearest_ts(conn, coarse_table, ">", _text(coarse_last))
+            if first_new is not None:
+                # 新的粗周期K线可能改变已缓存尾部的映射
+                first_new_epoch = int(np.datetime64(first_new[:19], "s").astype(np.int64))
+                recompute_from = min(recompute_from, first_new_epoch - fine_step)
+            keep = cached["fine_ts"] < recompute_from
+            kept_ts, kept_parent = cached["fine_ts"][keep], cached["parent"][keep]
+
+    if recompute_from is None:
+        fine_tail = _read_ts(conn, symbol, fine, what_to_show)
+        offset, coarse_tail = 0, _read_ts(conn, symbol, coarse, what_to_show)
+    else:
+        fine_tail = _read_ts(conn, symbol, fine, what_to_show, _text(recompute_from))
+        # 从早于补算起点一个粗周期的最后一根开始取，保证候选K线都在尾部里
+        anchor = _nearest_ts(conn, coarse_table, "<", _text(recompute_from - coarse_step))
+        if anchor is None:
+            offset, coarse_tail = 0, _read_ts(conn, symbol, coarse, what_to_show)
+        else:
+            offset = _count_rows(conn, coarse_table, "<", anchor)
+            coarse_tail = _read_ts(conn, symbol, coarse, what_to_show, anchor)
+
+    tail_parent = parent_index(fine_tail, coarse_tail, fine_step, coarse_step, mode)
+    tail_parent[tail_parent >= 0] += offset
+    fine_ts = np.concatenate([kept_ts, fine_tail])
+    parent = np.concatenate([kept_parent, tail_parent])
+    if len(fine_tail) or cached is None:
+        coarse_rows = offset + len(coarse_tail)
+        coarse_last = int(coarse_tail[-1]) if len(coarse_tail) else -1
+        cache.save(fine_ts, parent, coarse_rows, coarse_last)
+    return fine_ts, parent, len(fine_tail)
+
+
+def _load_frame(conn, symbol, bar, what_to_show, start_utc, end_utc) -> BarBatch:
+    batches = list(read_bar_chunks(conn, symbol, bar, what_to_show, start_utc=start_utc, end_utc=end_utc))
+    if not batches:
+        return BarBatch.empty()
+    return BarBatch(
+        ts=np.concatenate([b.ts for b in batches]),
+        values=np.concatenate([b.values for b in batches]),
+    )
+
+
+def load_timeframes(
+    conn: sqlite3.Connection,
+    symbol: str,
+    bars: Sequence[str],
+    what_to_show: str = DEFAULT_WHAT_TO_SHOW,
+    start_utc: Optional[str] = None,
+    end_utc: Optional[str] = None,
+    mode: str = "completed",
+    cache_dir: Optional[str] = None,
+    config: Optional[Config] = None,
+) -> MultiTimeframe:
+    """一次读出同一品种的多个周期，最细的周期为基准，附带到各粗周期的下标映射。
+
+    映射按整表缓存在 cache_dir（缺省取配置 timeframe_cache_dir），表尾追加数据只补算尾部，
+    回测每次运行不再做时间对齐。
+    """
+    if cache_dir is None:
+        cache_dir = (config or default_config()).timeframe_cache_dir
+    if mode not in MODES:
+        raise ValueError(f"未知映射方式: {mode}")
+    ordered = sorted(dict.fromkeys(bars), key=bar_seconds)
+    base = ordered[0]
+    frames = {bar: _load_frame(conn, symbol, bar, what_to_show, start_utc, end_utc) for bar in ordered}
+    result = MultiTimeframe(symbol=symbol, base=base, mode=mode, frames=frames, parents={})
+    base_frame = frames[base]
+    for coarse in ordered[1:]:
+        if not len(base_frame) or not len(frames[coarse]):
+            result.parents[coarse] = np.full(len(base_frame), -1, dtype=np.int64)
+            result.index_rows_computed[coarse] = 0
+            continue
+        full_ts, full_parent, computed = _cached_parents(
+            conn, symbol, what_to_show, base, coarse, mode, cache_dir
+        )
+        result.index_rows_computed[coarse] = computed
+        first = int(np.searchsorted(full_ts, base_frame.ts[0]))
+        parent = full_parent[first : first + len(base_frame)].copy()
+        # 全表下标换算为本次加载窗口内的下标，窗口外的粗周期K线视为没有
+        coarse_offset = (
+            _count_rows(conn, bars_table(symbol, coarse, what_to_show), "<", start_utc)
+            if start_utc is not None
+            else 0
+        )
+        parent -= coarse_offset
+        parent[(parent < 0) | (parent >= len(frames[coarse]))] = -1
+        result.parents[coarse] = parent
+    return result
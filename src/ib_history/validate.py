@@ -0,0 +1,386 @@
+from __future__ import annotations
+
+import sqlite3
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .bars import bar_seconds, ts_utc_text
+from .config import Config, default_config, merge_config
+from .contract_resolver import resolve_contract
+from .gaps import known_spans, within_known
+from .ib_client import DataClient, IBAsyncClient
+from .metrics import FetchMetrics
+from .pacing import PacingLimiter
+from .reader import read_column_chunks
+from .recovery import FailureWindow, merge_windows, refetch_window
+from .report import FetchReport
+from .sessions import expected_bars, session_open_mask
+from .storage import DEFAULT_WHAT_TO_SHOW, bars_table, ensure_db
+
+CHECKS = (
+    "ohlc",
+    "zero_volume",
+    "outlier_return",
+    "gap",
+    "stale",
+    "off_session",
+    "misaligned",
+    "tz_duplicate",
+    "non_utc_ts",
+)
+# 重新请求有望修正的问题；时区重复、时段外K线需要人工处理
+REFETCH_CHECKS = ("ohlc", "zero_volume", "outlier_return", "gap", "stale")
+
+
+@dataclass
+class Finding:
+    check: str
+    start: int
+    end: int
+    value: float
+    detail: str = ""
+
+
+@dataclass
+class ValidationResult:
+    symbol: str
+    bar: str
+    what_to_show: str
+    rows: int = 0
+    counts: Dict[str, int] = field(default_factory=dict)
+    elapsed_seconds: float = 0.0
+
+
+def create_findings_table(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS bar_findings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            symbol TEXT NOT NULL,
+            bar TEXT NOT NULL,
+            what_to_show TEXT NOT NULL,
+            check_name TEXT NOT NULL,
+            start_utc TEXT NOT NULL,
+            end_utc TEXT NOT NULL,
+            value REAL,
+            detail TEXT,
+            created_at TEXT NOT NULL
+        )
+        """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_bar_findings_series "
+        "ON bar_findings (symbol, bar, what_to_show, check_name)"
+    )
+
+
+def _runs(mask: np.ndarray) -> List[Tuple[int, int]]:
+    """mask 中连续为 True 的下标区间 [i, j]。"""
+    if not mask.any():
+        return []
+    padded = np.concatenate(([False], mask, [False])).astype(np.int8)
+    edges = np.flatnonzero(np.diff(padded))
+    return [(int(a), int(b) - 1) for a, b in zip(edges[::2], edges[1::2])]
+
+
+_BAD_OHLC_SQL = """
+    open IS NULL OR high IS NULL OR low IS NULL OR close IS NULL
+    OR MIN(open, high, low, close) <= 0
+    OR high < MAX(open, close) OR low > MIN(open, close) OR high < low
+"""
+
+
+def _point_findings(
+    conn: sqlite3.Connection, table: str, step: int, check_volume: bool
+) -> List[Finding]:
+    """逐行即可判断的问题直接在 SQLite 里筛选，只把命中的行取回；只查热表，不解压冷存储块。"""
+    volume_sql = "IFNULL(volume, 0) <= 0" if check_volume else "0"
+    rows = conn.execute(
+        f"""
+        SELECT CAST(strftime('%s', ts_utc) AS INTEGER), ({_BAD_OHLC_SQL}), ({volume_sql})
+        FROM {table}
+        WHERE ({_BAD_OHLC_SQL}) OR ({volume_sql})
+        ORDER BY ts_utc
+        """
+    ).fetchall()
+    if not rows:
+        return []
+    matrix = np.array(rows, dtype=np.int64)
+    ts = matrix[:, 0]
+    findings: List[Finding] = []
+    for check, mask in (("ohlc", matrix[:, 1] == 1), ("zero_volume", matrix[:, 2] == 1)):
+        flagged = ts[mask]
+        if not len(flagged):
+            continue
+        # 相邻周期连续命中的合并为一条
+        breaks = np.flatnonzero(np.diff(flagged) != step) + 1
+        for part in np.split(flagged, breaks):
+            findings.append(Finding(check, int(part[0]), int(part[-1]) + step, float(len(part))))
+    return findings
+
+
+class _SeriesScanner:
+    """逐块扫描 (时间戳, 收盘价, 高低差)，块之间携带上一根K线与未结束的平线区间。"""
+
+    def __init__(self, bar: str, config: Config) -> None:
+        self.step = bar_seconds(bar)
+        self.intraday = self.step < 86400
+        self.sigma = config.validate_return_sigma
+        self.min_return = config.validate_min_return
+        self.stale_bars = config.validate_stale_bars
+        self.prev_ts: Optional[int] = None
+        self.prev_close = np.nan
+        self.stale_start: Optional[int] = None
+        self.stale_last: Optional[int] = None
+        self.stale_len = 0
+
+    def _flag_runs(self, findings: List[Finding], check: str, mask: np.ndarray, ts: np.ndarray) -> None:
+        for i, j in _runs(mask):
+            findings.append(Finding(check, int(ts[i]), int(ts[j]) + self.step, float(j - i + 1)))
+
+    def scan(self, ts: np.ndarray, close: np.ndarray, spread: np.ndarray) -> List[Finding]:
+        if len(ts) > 1 and (np.diff(ts) < 0).any():
+            # 非 +00:00 的时间文本会打乱文本排序，这里按实际时间重排
+            order = np.argsort(ts, kind="stable")
+            ts, close, spread = ts[order], close[order], spread[order]
+        findings: List[Finding] = []
+        if self.intraday:
+            self._flag_runs(findings, "misaligned", ts % self.step != 0, ts)
+            self._flag_runs(findings, "off_session", ~session_open_mask(ts, self.step), ts)
+        if self.prev_ts is not None:
+            # 排序错位到下一块的K线已由时区检查报告，这里不参与连续性检查
+            later = ts > self.prev_ts
+            if not later.all():
+                ts, close, spread = ts[later], close[later], spread[later]
+                if not len(ts):
+                    return findings
+
+        prev_ts = np.concatenate(([self.prev_ts if self.prev_ts is not None else ts[0]], ts[:-1]))
+        closes = np.concatenate(([self.prev_close], close))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            returns = np.log(closes[1:] / closes[:-1])
+        finite = np.isfinite(returns)
+        if finite.sum() > 10:
+            med = float(np.median(returns[finite]))
+            mad = float(np.median(np.abs(returns[finite] - med))) * 1.4826
+            spike = finite & (np.abs(returns) > self.min_return)
+            if mad > 0:
+                spike &= np.abs(returns - med) > self.sigma * mad
+            for idx in np.flatnonzero(spike):
+                findings.append(
+                    Finding(
+                        "outlier_return",
+                        int(prev_ts[idx]),
+                        int(ts[idx]) + self.step,
+                        float(returns[idx]),
+                        f"close {closes[idx]} -> {closes[idx + 1]}",
+                    )
+                )
+
+        for idx in np.flatnonzero(ts - prev_ts > self.step):
+            missing = expected_bars(int(prev_ts[idx]), int(ts[idx]), self.step)
+            if missing > 0:
+                findings.append(
+                    Finding("gap", int(prev_ts[idx]) + self.step, int(ts[idx]), float(missing))
+                )
+
+        # 平线：高低差为 0 且收盘价与上一根相同，连续出现视为报价停滞
+        flat = (spread == 0) & (closes[1:] == closes[:-1])
+        if flat[0] and self.stale_start is not None:
+            head = _runs(flat)[0][1] + 1
+            self.stale_len += head
+            self.stale_last = int(ts[head - 1])
+            if head < len(ts):
+                findings.extend(self._close_stale())
+            flat = flat.copy()
+            flat[:head] = False
+        else:
+            findings.extend(self._close_stale())
+        for i, j in _runs(flat):
+            # 平线区间从前一根K线算起
+            first = int(prev_ts[i])
+            length = j - i + 2
+            if j == len(ts) - 1:
+                # 最后一段可能延续到下一块，先不下结论
+                self.stale_start, self.stale_last, self.stale_len = first, int(ts[j]), length
+            elif length >= self.stale_bars:
+                findings.append(Finding("stale", first, int(ts[j]) + self.step, float(length)))
+
+        self.prev_ts = int(ts[-1])
+        self.prev_close = float(close[-1])
+        return findings
+
+    def _close_stale(self) -> List[Finding]:
+        findings = []
+        if self.stale_start is not None and self.stale_len >= self.stale_bars:
+            findings.append(
+                Finding("stale", self.stale_start, self.stale_last + self.step, float(self.stale_len))
+            )
+        self.stale_start, self.stale_last, self.stale_len = None, None, 0
+        return findings
+
+    def finish(self) -> List[Finding]:
+        return self._close_stale()
+
+
+def _timezone_findings(conn: sqlite3.Connection, table: str) -> List[Finding]:
+    """找出不是 +00:00 写法的时间文本；同一时刻已有 UTC 写法的判为时区重复。"""
+    rows = conn.execute(
+        f"SELECT ts_utc, CAST(strftime('%s', ts_utc) AS INTEGER) FROM {table} "
+        "WHERE ts_utc NOT LIKE '%+00:00'"
+    ).fetchall()
+    findings = []
+    for text, epoch in rows:
+        canonical = ts_utc_text(np.array([epoch], dtype=np.int64))[0]
+        duplicate = conn.execute(f"SELECT 1 FROM {table} WHERE ts_utc = ?", (canonical,)).fetchone()
+        findings.append(
+            Finding("tz_duplicate" if duplicate else "non_utc_ts", int(epoch), int(epoch) + 1, 1.0, text)
+        )
+    return findings
+
+
+def validate_series(
+    conn: sqlite3.Connection,
+    symbol: str,
+    bar: str,
+    what_to_show: str = DEFAULT_WHAT_TO_SHOW,
+    config: Optional[Config] = None,
+    chunk_rows: Optional[int] = None,
+) -> ValidationResult:
+    """扫描一张K线表并把结果写入 bar_findings（覆盖该序列上一次的结果）。"""
+    cfg = config or default_config()
+    started = time.perf_counter()
+    create_findings_table(conn)
+    result = ValidationResult(symbol=symbol, bar=bar, what_to_show=what_to_show)
+    scanner = _SeriesScanner(bar, cfg)
+    findings: List[Finding] = []
+    for ts, matrix in read_column_chunks(
+        conn,
+        symbol,
+        bar,
+        what_to_show,
+        ("close", "high", "low"),
+        chunk_rows=chunk_rows or cfg.validate_chunk_rows,
+    ):
+        result.rows += len(ts)
+        findings.extend(scanner.scan(ts, matrix[:, 0], matrix[:, 1] - matrix[:, 2]))
+    findings.extend(scanner.finish())
+    # 交易日历不含节假日：IB 已确认没有数据的缺口（节假日等）不再报告，也就不会被反复重拉
+    spans = known_spans(conn, symbol, bar, what_to_show)
+    findings = [
+        f for f in findings if f.check != "gap" or not within_known(f.start, f.end, scanner.step, spans)
+    ]
+    if result.rows:
+        table = bars_table(symbol, bar, what_to_show)
+        check_volume = what_to_show.upper() == DEFAULT_WHAT_TO_SHOW
+        findings.extend(_point_findings(conn, table, scanner.step, check_volume))
+        findings.extend(_timezone_findings(conn, table))
+
+    conn.execute(
+        "DELETE FROM bar_findings WHERE symbol = ? AND bar = ? AND what_to_show = ?",
+        (symbol, bar, what_to_show),
+    )
+    now = datetime.utcnow().isoformat()
+    starts = ts_utc_text(np.array([f.start for f in findings], dtype=np.int64))
+    ends = ts_utc_text(np.array([f.end for f in findings], dtype=np.int64))
+    conn.executemany(
+        """
+        INSERT INTO bar_findings
+        (symbol, bar, what_to_show, check_name, start_utc, end_utc, value, detail, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        [
+            (symbol, bar, what_to_show, f.check, start, end, f.value, f.detail, now)
+            for f, start, end in zip(findings, starts.tolist(), ends.tolist())
+        ],
+    )
+    conn.commit()
+    for finding in findings:
+        result.counts[finding.check] = result.counts.get(finding.check, 0) + 1
+    result.elapsed_seconds = time.perf_counter() - started
+    return result
+
+
+def validate_bars(
+    symbols: Sequence[str],
+    bars: Sequence[str],
+    what_to_show: Optional[Sequence[str]] = None,
+    config: Optional[Config] = None,
+    db_path: str = "data/ib_history.sqlite",
+    chunk_rows: Optional[int] = None,
+) -> List[ValidationResult]:
+    cfg = merge_config(config or default_config())
+    conn = ensure_db(db_path)
+    try:
+        return [
+            validate_series(conn, symbol, bar, what, cfg, chunk_rows)
+            for symbol in symbols
+            for bar in bars
+            for what in (what_to_show or [cfg.what_to_show])
+        ]
+    finally:
+        conn.close()
+
+
+def _naive(text: str) -> datetime:
+    return datetime.fromisoformat(text).astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def refetch_findings(
+    config: Optional[Config] = None,
+    db_path: str = "data/ib_history.sqlite",
+    symbols: Optional[Sequence[str]] = None,
+    checks: Sequence[str] = REFETCH_CHECKS,
+    client: Optional[DataClient] = None,
+    pacer: Optional[PacingLimiter] = None,
+    metrics: Optional[FetchMetrics] = None,
+) -> FetchReport:
+    """按 bar_findings 中的可疑区间重新请求并覆盖写入，成功的区间删除对应记录。"""
+    cfg = merge_config(config or default_config())
+    pacer = pacer or PacingLimiter.from_config(cfg)
+    metrics = metrics or FetchMetrics()
+    conn = ensure_db(db_path)
+    create_findings_table(conn)
+    owns_client = client is None
+    client = client or IBAsyncClient.from_config(cfg, resolve_contract)
+    try:
+        rows = conn.execute(
+            f"""
+            SELECT id, symbol, bar, what_to_show, start_utc, end_utc FROM bar_findings
+            WHERE check_name IN ({', '.join('?' for _ in checks)})
+            """,
+            list(checks),
+        ).fetchall()
+        wanted = {s.upper() for s in symbols} if symbols else None
+        windows = merge_windows(
+            [
+                FailureWindow(symbol, bar, what, _naive(start), _naive(end), [finding_id])
+                for finding_id, symbol, bar, what, start, end in rows
+                if wanted is None or symbol.upper() in wanted
+            ]
+        )
+        report = FetchReport(
+            symbols=sorted({w.symbol for w in windows}),
+            bars=sorted({w.bar for w in windows}),
+            ranges=[
+                {"symbol": w.symbol, "bar": w.bar, "start": w.start.isoformat(), "end": w.end.isoformat()}
+                for w in windows
+            ],
+        )
+        for window in windows:
+            if refetch_window(client, conn, report, pacer, metrics, cfg, window):
+                conn.executemany(
+                    "DELETE FROM bar_findings WHERE id = ?", [(i,) for i in window.failure_ids]
+                )
+            conn.commit()
+        report.metrics = metrics.summary()
+        return report
+    finally:
+        metrics.close()
+        conn.close()
+        if owns_client:
+            client.close()
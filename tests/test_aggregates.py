@@ -0,0 +1,139 @@
+from datetime import datetime
+
+import numpy as np
+
+from ib_history.aggregates import (
+    read_rth_bars,
+    read_session_bars,
+    read_session_stats,
+    read_volume_profile,
+    rth_bounds,
+    update_aggregates,
+)
+from ib_history.bars import ts_utc_text
+from ib_history.config import default_config
+from ib_history.fake_client import synthetic_bars
+from ib_history.reader import read_bar_chunks
+from ib_history.sessions import session_day
+from ib_history.storage import ensure_db, insert_bars, upsert_bars
+from ib_history.sync import export_changes, prune_changes
+
+
+def _minutes(conn, symbol):
+    batches = list(read_bar_chunks(conn, symbol, "1m"))
+    return np.concatenate([b.ts for b in batches]), np.concatenate([b.values for b in batches])
+
+
+def test_session_and_rth_views_from_full_session_minutes(tmp_path):
+    conn = ensure_db(str(tmp_path / "test.sqlite"))
+    # 跨 2024-03-10 夏令时切换
+    insert_bars(conn, "MNQ", "1m", synthetic_bars(1, "1m", datetime(2024, 3, 7), datetime(2024, 3, 13)))
+    conn.commit()
+    result = update_aggregates(conn, "MNQ")
+    assert result.rebuilt and result.sessions == 5
+
+    # RTH 1h K线从芝加哥时间 08:30 起算，夏令时前后对应不同的 UTC 时刻
+    hours = ts_utc_text(read_rth_bars(conn, "MNQ", "1h").ts).tolist()
+    assert hours[0] == "2024-03-07T14:30:00+00:00" and "2024-03-11T13:30:00+00:00" in hours
+    assert len(hours) == 4 * 7
+
+    ts, values = _minutes(conn, "MNQ")
+    day = int(np.datetime64("2024-03-11", "D").astype(np.int64))
+    start, end = rth_bounds("MNQ", day, default_config())
+    rth = (ts >= start) & (ts < end)
+    stats = {row["session_date"]: row for row in read_session_stats(conn, "MNQ", "rth")}["2024-03-11"]
+    assert stats["bars"] == stats["expected_bars"] == 390
+    assert stats["volume"] == values["volume"][rth].sum()
+    assert stats["open"] == values["open"][rth][0] and stats["close"] == values["close"][rth][-1]
+    opening = rth & (ts < start + 30 * 60)
+    assert (stats["or_high"], stats["or_low"]) == (values["high"][opening].max(), values["low"][opening].min())
+    assert read_rth_bars(conn, "MNQ", "5m").values["volume"].sum() == values["volume"][_rth_mask(ts)].sum()
+
+    prices, profile = read_volume_profile(conn, "MNQ", "2024-03-11", "rth")
+    assert np.isclose(profile.sum(), stats["volume"])
+    assert np.all(prices % 5.0 == 0) and prices[np.argmax(profile)] == stats["poc"]
+
+    full = read_session_bars(conn, "MNQ", "full")
+    assert ts_utc_text(full.ts).tolist()[-1] == "2024-03-13T00:00:00+00:00"
+    assert full.values["volume"].sum() == values["volume"].sum()
+
+
+def _rth_mask(ts):
+    cfg = default_config()
+    mask = np.zeros(len(ts), dtype=bool)
+    for day in np.unique(session_day(ts)):
+        start, end = rth_bounds("MNQ", int(day), cfg)
+        mask |= (ts >= start) & (ts < end)
+    return mask
+
+
+def test_incremental_update_matches_rebuild(tmp_path):
+    conn = ensure_db(str(tmp_path / "test.sqlite"))
+    insert_bars(conn, "MNQ", "1m", synthetic_bars(1, "1m", datetime(2024, 5, 6), datetime(2024, 5, 9)))
+    conn.commit()
+    update_aggregates(conn, "MNQ")
+
+    # 追加新的一天并修订旧交易日中的一根K线：只重算这两类交易日
+    insert_bars(conn, "MNQ", "1m", synthetic_bars(1, "1m", datetime(2024, 5, 9), datetime(2024, 5, 10)))
+    revised = {
+        "ts_utc": "2024-05-07T15:00:00+00:00",
+        "open": 1.0,
+        "high": 99999.0,
+        "low": 0.5,
+        "close": 1.5,
+        "volume": 10**6,
+        "vwap": 1.2,
+        "trade_count": 3,
+    }
+    upsert_bars(conn, "MNQ", "1m", [revised])
+    conn.commit()
+    result = update_aggregates(conn, "MNQ")
+    assert not result.rebuilt
+    assert result.sessions == 3  # 05-07 的修订，以及 05-09 / 05-10 两个交易日的新数据
+    incremental = {scope: read_session_stats(conn, "MNQ", scope) for scope in ("full", "rth")}
+    assert max(row["high"] for row in incremental["rth"]) == 99999.0
+    views = {bar: read_rth_bars(conn, "MNQ", bar) for bar in ("1m", "1h")}
+
+    rebuilt = update_aggregates(conn, "MNQ", rebuild=True)
+    assert rebuilt.rebuilt
+    for scope in ("full", "rth"):
+        assert read_session_stats(conn, "MNQ", scope) == incremental[scope]
+    for bar, batch in views.items():
+        again = read_rth_bars(conn, "MNQ", bar)
+        assert again.ts.tolist() == batch.ts.tolist() and again.values.tolist() == batch.values.tolist()
+
+
+def test_pruned_change_log_triggers_rebuild(tmp_path):
+    conn = ensure_db(str(tmp_path / "test.sqlite"))
+    insert_bars(conn, "MGC", "1m", synthetic_bars(2, "1m", datetime(2024, 5, 6), datetime(2024, 5, 8)))
+    conn.commit()
+    update_aggregates(conn, "MGC")
+    assert not update_aggregates(conn, "MGC").rebuilt
+
+    insert_bars(conn, "MGC", "1m", synthetic_bars(2, "1m", datetime(2024, 5, 8), datetime(2024, 5, 9)))
+    conn.execute("DELETE FROM bar_changes")
+    conn.commit()
+    result = update_aggregates(conn, "MGC")
+    assert result.rebuilt
+    assert [row["session_date"] for row in read_session_stats(conn, "MGC", "full")][-1] == "2024-05-09"
+
+
+def test_change_log_is_trimmed_to_slowest_consumer(tmp_path):
+    conn = ensure_db(str(tmp_path / "test.sqlite"))
+    insert_bars(conn, "MNQ", "1m", synthetic_bars(1, "1m", datetime(2024, 5, 6), datetime(2024, 5, 8)))
+    conn.commit()
+    update_aggregates(conn, "MNQ")
+    insert_bars(conn, "MNQ", "1m", synthetic_bars(1, "1m", datetime(2024, 5, 8), datetime(2024, 5, 9)))
+    conn.commit()
+    # 只做聚合、没有 sync 对端：处理完就清掉
+    assert not update_aggregates(conn, "MNQ").rebuilt
+    assert conn.execute("SELECT COUNT(*) FROM bar_changes").fetchone()[0] == 0
+
+    # 对端已导出的记录，聚合还没处理前 sync prune 不能删
+    insert_bars(conn, "MNQ", "1m", synthetic_bars(1, "1m", datetime(2024, 5, 9), datetime(2024, 5, 10)))
+    conn.commit()
+    export_changes(conn, str(tmp_path / "changes.npz"), peer="backtest")
+    assert prune_changes(conn) == 0
+    result = update_aggregates(conn, "MNQ")
+    assert not result.rebuilt and result.sessions == 2  # 05-09 与 05-10 两个交易日
+    assert conn.execute("SELECT COUNT(*) FROM bar_changes").fetchone()[0] == 0
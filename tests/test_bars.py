@@ -0,0 +1,34 @@
+from datetime import date, datetime, timezone
+from types import SimpleNamespace
+
+from ib_history.bars import BarBatch
+from ib_history.storage import ensure_db, insert_bars
+
+
+def _bar(ts, price):
+    return SimpleNamespace(
+        date=ts, open=price, high=price + 1, low=price - 1, close=price, volume=5.0, average=price, barCount=3
+    )
+
+
+def test_bar_batch_matches_isoformat(tmp_path):
+    stamps = [
+        datetime(2024, 1, 1, 9, 30, tzinfo=timezone.utc),
+        datetime(2024, 1, 1, 9, 31),
+        date(2024, 1, 2),
+    ]
+    expected = [
+        datetime(2024, 1, 1, 9, 30, tzinfo=timezone.utc).isoformat(),
+        datetime(2024, 1, 1, 9, 31, tzinfo=timezone.utc).isoformat(),
+        datetime(2024, 1, 2, tzinfo=timezone.utc).isoformat(),
+    ]
+    for stamp, text in zip(stamps, expected):
+        batch = BarBatch.from_bar_data([_bar(stamp, 10.0)])
+        assert batch.ts_utc().tolist() == [text]
+
+    batch = BarBatch.from_bar_data([_bar(stamps[0], 10.0), _bar(stamps[0].replace(minute=31), 11.0)])
+    conn = ensure_db(str(tmp_path / "test.sqlite"))
+    assert insert_bars(conn, "MNQ", "1m", batch) == 2
+    row = conn.execute("SELECT * FROM bars_MNQ_1m ORDER BY ts_utc DESC").fetchone()
+    assert row == ("2024-01-01T09:31:00+00:00", 11.0, 12.0, 10.0, 11.0, 5, 11.0, 3)
+    conn.close()
@@ -0,0 +1,25 @@
+from datetime import datetime
+
+import numpy as np
+
+from ib_history.chart_app import _load_bars
+from ib_history.cold import archive_series
+from ib_history.fake_client import synthetic_bars
+from ib_history.storage import ensure_db, insert_bars
+
+
+def test_load_bars_includes_archived_months(tmp_path):
+    db_path = str(tmp_path / "test.sqlite")
+    conn = ensure_db(db_path)
+    batch = synthetic_bars(1, "15m", datetime(2024, 1, 30), datetime(2024, 2, 2))
+    insert_bars(conn, "MNQ", "15m", batch)
+    conn.commit()
+    archive_series(conn, "MNQ", "15m", before=datetime(2024, 2, 5), root=str(tmp_path / "cold"))
+    conn.close()
+
+    frame = _load_bars(db_path, "MNQ", "15m", "")
+    assert len(frame) == len(batch)
+    expected = np.asarray(batch.ts, dtype="datetime64[s]").astype("datetime64[ns]")
+    assert (frame["time"].to_numpy() == expected).all()
+    np.testing.assert_array_equal(frame["close"].to_numpy(), batch.values["close"])
+    assert _load_bars(db_path, "MGC", "15m", "") is None
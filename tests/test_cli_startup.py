@@ -0,0 +1,39 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import ib_history
+
+HEAVY = ("numpy", "pandas", "ib_async", "lightweight_charts", "sqlite3", "ib_history.fetcher")
+
+
+def _run(code: str, *flags: str) -> subprocess.CompletedProcess:
+    env = dict(os.environ, PYTHONPATH=str(Path(ib_history.__file__).resolve().parents[1]))
+    return subprocess.run(
+        [sys.executable, *flags, "-c", code], env=env, capture_output=True, text=True, check=True
+    )
+
+
+def test_cli_import_skips_heavy_dependencies():
+    probe = "import json, sys, ib_history.cli; print(json.dumps(sorted(sys.modules)))"
+    loaded = set(json.loads(_run(probe).stdout))
+    assert not loaded & set(HEAVY)
+    assert {name for name in loaded if name.startswith("ib_history.")} == {"ib_history.cli", "ib_history.config"}
+
+
+def test_cli_import_time_budget():
+    # -X importtime 的累计耗时（微秒）：只含 argparse 与配置，远低于带 numpy 的 100ms 以上
+    result = _run("import ib_history.cli", "-X", "importtime")
+    line = next(row for row in result.stderr.splitlines() if row.rstrip().endswith("| ib_history.cli"))
+    cumulative_us = int(line.split("|")[1])
+    assert cumulative_us < 60_000
+
+
+def test_package_exports_fetch_history_lazily():
+    probe = (
+        "import sys, ib_history; before = 'ib_history.fetcher' in sys.modules; "
+        "ib_history.fetch_history; print(before, 'ib_history.fetcher' in sys.modules)"
+    )
+    assert _run(probe).stdout.split() == ["False", "True"]
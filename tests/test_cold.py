@@ -0,0 +1,118 @@
+import os
+from datetime import datetime
+
+import numpy as np
+
+from ib_history.cold import archive_history, archive_series, read_block
+from ib_history.config import default_config, merge_config
+from ib_history.fake_client import synthetic_bars
+from ib_history.gaps import find_gaps
+from ib_history.reader import read_bar_chunks, stream_bars
+from ib_history.storage import cold_blocks, ensure_db, insert_bars, stored_span, upsert_bars
+from ib_history.timeframes import load_timeframes
+
+START = datetime(2024, 1, 15)
+END = datetime(2024, 3, 12)
+
+
+def _db(path):
+    conn = ensure_db(path)
+    for bar in ("5m", "1h"):
+        insert_bars(conn, "MNQ", bar, synthetic_bars(1, bar, START, END))
+    # 人为制造两个缺口，其中一个落在将要归档的月份里
+    for start, end in (("2024-02-06T10:00:00", "2024-02-06T11:00:00"), ("2024-03-06T10:00:00", "2024-03-06T10:30:00")):
+        conn.execute(
+            "DELETE FROM bars_MNQ_5m WHERE ts_utc >= ? AND ts_utc < ?", (start + "+00:00", end + "+00:00")
+        )
+    conn.commit()
+    return conn
+
+
+def _read_all(conn, bar="5m", **kwargs):
+    batches = list(read_bar_chunks(conn, "MNQ", bar, chunk_rows=1000, **kwargs))
+    return np.concatenate([b.ts for b in batches]), np.concatenate([b.values for b in batches])
+
+
+def _snapshot(conn, cache_dir):
+    ts, values = _read_all(conn)
+    window = _read_all(conn, start_utc="2024-02-20T00:00:00+00:00", end_utc="2024-03-08T00:00:00+00:00")
+    events = [(e.ts, float(e.bar["close"])) for e in stream_bars(conn, ["MNQ"], "5m", chunk_rows=500)]
+    frames = load_timeframes(
+        conn, "MNQ", ["5m", "1h"], start_utc="2024-02-01T00:00:00+00:00", cache_dir=cache_dir
+    )
+    return {
+        "ts": ts.tolist(),
+        "close": values["close"].tolist(),
+        "volume": values["volume"].tolist(),
+        "window": window[0].tolist(),
+        "events": events,
+        "gaps": [(g.start, g.missing) for g in find_gaps(conn, "MNQ", "5m", chunk_rows=700)],
+        "span": stored_span(conn, "MNQ", "5m"),
+        "parents": frames.parents["1h"].tolist(),
+    }
+
+
+def test_archive_is_transparent_to_readers(tmp_path):
+    conn = _db(str(tmp_path / "test.sqlite"))
+    cache_dir = str(tmp_path / "index")
+    before = _snapshot(conn, cache_dir)
+
+    result = archive_series(conn, "MNQ", "5m", before=datetime(2024, 3, 5), root=str(tmp_path / "cold"))
+    archive_series(conn, "MNQ", "1h", before=datetime(2024, 3, 5), root=str(tmp_path / "cold"))
+    assert result.months == ["2024-01", "2024-02"]
+    hot_first = conn.execute("SELECT MIN(ts_utc) FROM bars_MNQ_5m").fetchone()[0]
+    assert hot_first.startswith("2024-03-")
+    blocks = cold_blocks(conn, "bars_MNQ_5m")
+    assert [b[0] for b in blocks] == ["2024-01", "2024-02"]
+    assert sum(b[3] for b in blocks) == result.rows
+    # 原始列 56 字节/行，SQLite 行存还要更多
+    assert result.bytes < result.rows * 16
+
+    # 映射缓存沿用归档前的结果，行数校验要把冷存储算进去
+    assert _snapshot(conn, cache_dir) == before
+    conn.close()
+
+
+def test_hot_rows_win_over_archived_block_and_get_merged(tmp_path):
+    conn = _db(str(tmp_path / "test.sqlite"))
+    root = str(tmp_path / "cold")
+    archive_series(conn, "MNQ", "5m", before=datetime(2024, 3, 1), root=root)
+
+    revised = {
+        "ts_utc": "2024-02-07T10:00:00+00:00",
+        "open": 1.0,
+        "high": 2.0,
+        "low": 0.5,
+        "close": 1.5,
+        "volume": 9,
+        "vwap": 1.2,
+        "trade_count": 3,
+    }
+    upsert_bars(conn, "MNQ", "5m", [revised])
+    conn.commit()
+    ts, values = _read_all(conn)
+    target = int(np.datetime64("2024-02-07T10:00:00", "s").astype(np.int64))
+    assert values["close"][ts == target].tolist() == [1.5]
+    assert len(np.unique(ts)) == len(ts)
+
+    again = archive_series(conn, "MNQ", "5m", before=datetime(2024, 3, 1), root=root)
+    assert again.months == ["2024-02"]
+    assert conn.execute(
+        "SELECT COUNT(*) FROM bars_MNQ_5m WHERE ts_utc < '2024-03-01T00:00:00+00:00'"
+    ).fetchone()[0] == 0
+    block = read_block(cold_blocks(conn, "bars_MNQ_5m")[-1][4])
+    assert block.values["volume"][block.ts == target].tolist() == [9]
+    assert len(_read_all(conn)[0]) == len(ts)
+    conn.close()
+
+
+def test_archive_history_vacuum_shrinks_database(tmp_path):
+    db_path = str(tmp_path / "test.sqlite")
+    _db(db_path).close()
+    size = os.path.getsize(db_path)
+    config = merge_config(default_config(), cold_root=str(tmp_path / "cold"))
+    results = archive_history(
+        ["MNQ"], ["5m", "1h"], before=datetime(2024, 3, 1), config=config, db_path=db_path, vacuum=True
+    )
+    assert [r.months for r in results] == [["2024-01", "2024-02"]] * 2
+    assert os.path.getsize(db_path) < size / 2
@@ -0,0 +1,153 @@
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+from ib_history.config import default_config
+from ib_history.coordination import SeriesLeases, series_lease_seconds
+from ib_history.fake_client import FakeIBClient
+from ib_history.fetcher import fetch_history
+from ib_history.pacing import PacingLimiter, SharedPacingLimiter
+from ib_history.storage import commit_with_retry, ensure_db, upsert_bars
+
+ROW = {
+    "ts_utc": "2024-05-06T15:00:00+00:00",
+    "open": 1.0,
+    "high": 1.0,
+    "low": 1.0,
+    "close": 1.0,
+    "volume": 1,
+    "vwap": 1.0,
+    "trade_count": 1,
+}
+
+
+def test_leases_partition_series_and_expire(tmp_path):
+    db_path = str(tmp_path / "test.sqlite")
+    now = [1000.0]
+    first = SeriesLeases(ensure_db(db_path, wal=True), 60, owner="a", clock=lambda: now[0])
+    second = SeriesLeases(ensure_db(db_path, wal=True), 60, owner="b", clock=lambda: now[0])
+    keys = [("MNQ", "1m", "TRADES"), ("MES", "1m", "TRADES")]
+    assert first.acquire(keys[:1]) == keys[:1]
+    assert second.acquire(keys) == keys[1:]
+    assert second.holder(keys[0]) == "a"
+
+    # 续约推迟过期时间；持有者停止续约后，租约过期即可被接管
+    now[0] += 40
+    first.renew_if_due()
+    now[0] += 40
+    assert second.acquire(keys[:1]) == []
+    now[0] += 61
+    assert second.acquire(keys[:1]) == keys[:1]
+    first.release()
+    assert second.holder(keys[0]) == "b"
+    second.release()
+    assert second.holder(keys[1]) is None
+
+
+def test_renewal_detects_lease_taken_over_after_expiry(tmp_path):
+    db_path = str(tmp_path / "test.sqlite")
+    now = [1000.0]
+    first = SeriesLeases(ensure_db(db_path), 60, owner="a", clock=lambda: now[0])
+    second = SeriesLeases(ensure_db(db_path), 60, owner="b", clock=lambda: now[0])
+    keys = [("MNQ", "1m", "TRADES"), ("MES", "1m", "TRADES")]
+    first.acquire(keys)
+    # a 停顿超过租期，b 接管了其中一个序列
+    now[0] += 61
+    assert second.acquire(keys[:1]) == keys[:1]
+    assert first.renew_if_due() == keys[:1]
+    assert (first.held, first.lost) == (keys[1:], keys[:1])
+    first.release()
+    assert second.holder(keys[0]) == "b"
+    # 租约至少覆盖一次完整的限速等待加 IB 请求的两倍
+    assert series_lease_seconds(default_config()) == 2 * (600.0 + 60.0)
+
+
+def test_wal_is_switched_once_and_tolerates_busy_database(tmp_path):
+    db_path = str(tmp_path / "test.sqlite")
+    holder = ensure_db(db_path)
+    holder.execute("CREATE TABLE t (x)")
+    holder.execute("BEGIN IMMEDIATE")
+    holder.execute("INSERT INTO t VALUES (1)")
+    # 其他连接正在写时切不了 WAL，不报错，保持原模式
+    busy = ensure_db(db_path, busy_timeout=0.05, wal=True)
+    assert busy.execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+    holder.commit()
+    assert ensure_db(db_path, wal=True).execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_commit_with_retry_waits_out_locked_database(tmp_path):
+    db_path = str(tmp_path / "test.sqlite")
+    writer = ensure_db(db_path, busy_timeout=0.01, wal=True)
+    upsert_bars(writer, "MNQ", "1m", [ROW])
+    writer.commit()
+    other = ensure_db(db_path, wal=True)
+    other.execute("BEGIN IMMEDIATE")
+    delays = []
+
+    def _sleep(delay):
+        delays.append(delay)
+        if len(delays) == 2:
+            other.commit()
+
+    stats = commit_with_retry(
+        writer, lambda: upsert_bars(writer, "MNQ", "1m", [{**ROW, "close": 2.0}]), sleep=_sleep
+    )
+    assert delays == [0.2, 0.4]
+    assert stats.updated == 1
+    assert other.execute("SELECT close FROM bars_MNQ_1m").fetchone() == (2.0,)
+
+    with pytest.raises(sqlite3.OperationalError):
+        commit_with_retry(writer, lambda: writer.execute("SELECT * FROM missing"), sleep=_sleep)
+
+
+def test_shared_pacing_ledger_spans_limiters(tmp_path):
+    now = [0.0]
+
+    def _limiter():
+        return SharedPacingLimiter(
+            min_interval=1.0,
+            max_requests=3,
+            window_seconds=10.0,
+            ledger_path=str(tmp_path / "pacing.sqlite"),
+            key="127.0.0.1:4002",
+            clock=lambda: now[0],
+            sleep=lambda s: now.__setitem__(0, now[0] + s),
+        )
+
+    first, second = _limiter(), _limiter()
+    waits = [limiter.wait() for limiter in (first, second, first, second)]
+    assert waits == [0.0, 1.0, 1.0, 8.0]
+    first.close()
+    second.close()
+
+
+def test_fetch_skips_series_leased_by_another_process(tmp_path):
+    db_path = str(tmp_path / "test.sqlite")
+    other = SeriesLeases(ensure_db(db_path), 300, owner="other-host-1")
+    other.acquire([("MNQ", "5m", "TRADES")])
+
+    def _fetch():
+        return fetch_history(
+            ["MNQ", "MES"],
+            ["5m"],
+            datetime(2024, 5, 6),
+            datetime(2024, 5, 7),
+            db_path=db_path,
+            client=FakeIBClient(),
+            pacer=PacingLimiter.unlimited(),
+        )
+
+    report = _fetch()
+    assert report.skipped == [
+        {"symbol": "MNQ", "bar": "5m", "what_to_show": "TRADES", "owner": "other-host-1"}
+    ]
+    assert report.success_count == 23 * 12 and report.failure_count == 0
+
+    # 对方释放后再跑一次，补上被跳过的序列；本进程的租约在结束时释放
+    other.release()
+    report = _fetch()
+    assert report.skipped == []
+    conn = ensure_db(db_path)
+    assert conn.execute("SELECT COUNT(*) FROM bars_MNQ_5m").fetchone()[0] == 23 * 12
+    assert conn.execute("SELECT COUNT(*) FROM series_leases").fetchone()[0] == 0
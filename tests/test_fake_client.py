@@ -0,0 +1,34 @@
+from datetime import datetime
+
+from ib_history.fake_client import FakeIBClient
+from ib_history.fetcher import fetch_history
+from ib_history.pacing import PacingLimiter
+
+
+def test_fetch_history_against_fake_gateway(tmp_path):
+    client = FakeIBClient(
+        pacing_violation_every=3,
+        empty_windows=[(datetime(2024, 5, 8), datetime(2024, 5, 9))],
+    )
+    report = fetch_history(
+        symbols=["MNQ"],
+        bars=["1m"],
+        start=datetime(2024, 5, 6),
+        end=datetime(2024, 5, 11),
+        db_path=str(tmp_path / "test.sqlite"),
+        client=client,
+        pacer=PacingLimiter(min_interval=0),
+    )
+    # 夏令时每日 21:00-22:00 UTC 休市，周五 21:00 收盘，5/8 整天无数据
+    assert report.success_count == 23 * 60 * 3 + 21 * 60
+    assert len(report.failures) == 2
+    assert report.metrics["retries"] == {"pacing_violation": 2}
+    assert [r.start_utc for r in report.no_data] == ["2024-05-08T00:00:00"]
+
+
+def test_synthetic_bars_are_deterministic():
+    client = FakeIBClient()
+    contract = client.list_fut_contracts("MNQ")[0]
+    a = client.fetch_bars_for_contract(contract, "1m", datetime(2018, 1, 2), datetime(2018, 1, 3))
+    b = client.fetch_bars_for_contract(contract, "1m", datetime(2018, 1, 2, 12), datetime(2018, 1, 3))
+    assert (a.values[-len(b):] == b.values).all()
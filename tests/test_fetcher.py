@@ -0,0 +1,201 @@
+import sqlite3
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from ib_history.fake_client import FakeIBClient
+from ib_history.fetcher import fetch_history
+from ib_history.ib_client import IBAsyncClient
+from ib_history.metrics import FetchMetrics
+from ib_history.pacing import PacingLimiter
+from ib_history.reader import load_aligned_series
+from ib_history.storage import ensure_db
+
+
+class ContractClient:
+    def __init__(self, head):
+        self.head = head
+        self.head_calls = 0
+        self.requests = []
+
+    def list_fut_contracts(self, symbol, config=None):
+        return [SimpleNamespace(conId=1, lastTradeDateOrContractMonth="20240315")]
+
+    def head_timestamp(self, contract, what_to_show=None):
+        self.head_calls += 1
+        return self.head
+
+    def fetch_bars_for_contract(self, contract, bar, start, end, config):
+        self.requests.append((start, end, config.what_to_show))
+        price = {"TRADES": 10, "BID_ASK": 9, "MIDPOINT": 9.5}[config.what_to_show]
+        return [
+            {
+                "ts_utc": start.isoformat(),
+                "open": price,
+                "high": price,
+                "low": price,
+                "close": price,
+                "volume": 1,
+                "vwap": price,
+                "trade_count": 1,
+            }
+        ]
+
+    def fetch_bars(self, symbol, bar, start, end, config=None):
+        raise AssertionError("should use fetch_bars_for_contract")
+
+    def close(self):
+        return None
+
+
+def test_ranges_clipped_to_cached_head_timestamp(tmp_path):
+    db = str(tmp_path / "test.sqlite")
+    client = ContractClient(head=datetime(2024, 3, 10, 12))
+    for _ in range(2):
+        fetch_history(
+            symbols=["MNQ"],
+            bars=["1h"],
+            start=datetime(2024, 1, 1),
+            end=datetime(2024, 3, 15),
+            db_path=db,
+            client=client,
+            pacer=PacingLimiter(min_interval=0),
+        )
+    assert client.head_calls == 1
+    assert client.requests
+    assert all(start >= datetime(2024, 3, 10, 12) for start, _, _ in client.requests)
+
+
+def test_multi_series_interleaved_and_aligned(tmp_path):
+    db = str(tmp_path / "test.sqlite")
+    client = ContractClient(head=None)
+    fetch_history(
+        symbols=["MNQ"],
+        bars=["1d"],
+        start=datetime(2023, 1, 1),
+        end=datetime(2024, 3, 15),
+        db_path=db,
+        client=client,
+        what_to_show=["TRADES", "BID_ASK"],
+        pacer=PacingLimiter(min_interval=0),
+    )
+    assert [what for _, _, what in client.requests] == ["TRADES", "BID_ASK"] * 2
+    conn = ensure_db(db)
+    aligned = load_aligned_series(conn, "MNQ", "1d", ["TRADES", "BID_ASK", "MIDPOINT"])
+    conn.close()
+    assert len(aligned["ts"]["epoch"]) == 2
+    assert (aligned["TRADES"]["close"] - aligned["BID_ASK"]["close"] == 1).all()
+    assert all(v != v for v in aligned["MIDPOINT"]["close"])
+
+
+class RoundingClient:
+    """模拟 IB 按整天回溯：每次都从窗口起点前一天开始返回。"""
+
+    def __init__(self):
+        self.fake = FakeIBClient()
+        self.windows = []
+
+    def list_fut_contracts(self, symbol, config=None):
+        return self.fake.list_fut_contracts(symbol, config)
+
+    def fetch_bars_for_contract(self, contract, bar, start, end, config):
+        self.windows.append((start, end))
+        return self.fake.fetch_bars_for_contract(contract, bar, start - timedelta(days=1), end, config)
+
+    def close(self):
+        return None
+
+
+def test_contract_ranges_tile_exactly_and_overlap_is_trimmed(tmp_path):
+    client = RoundingClient()
+    metrics = FetchMetrics()
+    report = fetch_history(
+        symbols=["MNQ"],
+        bars=["1h"],
+        start=datetime(2024, 6, 17),
+        end=datetime(2024, 6, 25),
+        db_path=str(tmp_path / "test.sqlite"),
+        client=client,
+        pacer=PacingLimiter(min_interval=0),
+        metrics=metrics,
+    )
+    # 6 月合约到期日 6/21 0 点为界，前后两个合约的请求首尾相接
+    assert all(a[1] == b[0] for a, b in zip(client.windows, client.windows[1:]))
+    assert datetime(2024, 6, 21) in [w[0] for w in client.windows]
+    # 每个分片多带出的前一天都在写库前裁掉
+    assert metrics.overlap_rows > 0
+    assert report.success_count == metrics.rows
+    conn = ensure_db(str(tmp_path / "test.sqlite"))
+    stored = conn.execute("SELECT COUNT(*) FROM bars_MNQ_1h").fetchone()[0]
+    assert stored == report.success_count
+    conn.close()
+
+
+def test_duration_covers_whole_window():
+    client = IBAsyncClient()
+    start = datetime(2024, 1, 1)
+    assert client._duration_str(start, start + timedelta(hours=1)) == "3600 S"
+    assert client._duration_str(start, start + timedelta(days=1)) == "86400 S"
+    assert client._duration_str(start, start + timedelta(days=1, hours=12)) == "2 D"
+    assert client._end_datetime(start).utcoffset() == timedelta(0)
+
+
+def test_refetching_stored_window_writes_nothing(tmp_path):
+    db = str(tmp_path / "test.sqlite")
+    summaries = []
+    for _ in range(2):
+        metrics = FetchMetrics()
+        fetch_history(
+            symbols=["MNQ"],
+            bars=["1h"],
+            start=datetime(2024, 5, 6),
+            end=datetime(2024, 5, 9),
+            db_path=db,
+            client=FakeIBClient(),
+            pacer=PacingLimiter(min_interval=0),
+            metrics=metrics,
+        )
+        summaries.append(metrics.summary())
+    assert summaries[0]["writes"]["write_ratio"] == 1.0
+    assert summaries[1]["writes"] == {
+        "inserted": 0,
+        "updated": 0,
+        "unchanged": summaries[0]["rows"],
+        "write_ratio": 0.0,
+    }
+
+
+class EmptyProbeClient(ContractClient):
+    """每次请求都返回空，并检查此时本进程是否还占着库的写锁。"""
+
+    def __init__(self, db_path):
+        super().__init__(datetime(2020, 1, 1))
+        self.db_path = db_path
+        self.locked = []
+
+    def fetch_bars_for_contract(self, contract, bar, start, end, config):
+        other = sqlite3.connect(self.db_path, timeout=0)
+        try:
+            other.execute("BEGIN IMMEDIATE")
+            other.rollback()
+            self.locked.append(False)
+        except sqlite3.OperationalError:
+            self.locked.append(True)
+        finally:
+            other.close()
+        return []
+
+
+def test_no_data_records_are_committed_before_next_request(tmp_path):
+    db = str(tmp_path / "test.sqlite")
+    client = EmptyProbeClient(db)
+    report = fetch_history(
+        symbols=["MNQ"],
+        bars=["1h"],
+        start=datetime(2024, 1, 1),
+        end=datetime(2024, 3, 1),
+        db_path=db,
+        client=client,
+        pacer=PacingLimiter(min_interval=0),
+    )
+    assert len(client.locked) > 1 and not any(client.locked)
+    assert len(report.no_data) == len(client.locked)
@@ -0,0 +1,110 @@
+from datetime import datetime
+
+from ib_history.fake_client import FakeIBClient
+from ib_history.fetcher import fetch_history
+from ib_history.gaps import fill_gaps, find_gaps, plan_gap_windows
+from ib_history.pacing import PacingLimiter
+from ib_history.storage import ensure_db
+
+# 模拟交易所节假日：IB 在这段时间确实没有数据
+HOLIDAY = [(datetime(2024, 5, 8, 12), datetime(2024, 5, 8, 13))]
+
+
+def _holey_db(db_path):
+    fetch_history(
+        ["MNQ"],
+        ["1m"],
+        start=datetime(2024, 5, 6),
+        end=datetime(2024, 5, 10),
+        db_path=db_path,
+        client=FakeIBClient(empty_windows=HOLIDAY),
+        pacer=PacingLimiter(min_interval=0),
+    )
+    conn = ensure_db(db_path)
+    for start, end in (
+        ("2024-05-07T10:00:00", "2024-05-07T10:30:00"),
+        ("2024-05-07T14:00:00", "2024-05-07T14:05:00"),
+        ("2024-05-09T03:00:00", "2024-05-09T05:00:00"),
+    ):
+        conn.execute(
+            "DELETE FROM bars_MNQ_1m WHERE ts_utc >= ? AND ts_utc < ?",
+            (start + "+00:00", end + "+00:00"),
+        )
+    conn.commit()
+    return conn
+
+
+def test_find_gaps_against_session_grid(tmp_path):
+    conn = _holey_db(str(tmp_path / "test.sqlite"))
+    gaps = find_gaps(conn, "MNQ", "1m", chunk_rows=1000)
+    assert [(g.start, g.missing) for g in gaps] == [
+        (datetime(2024, 5, 7, 10), 30),
+        (datetime(2024, 5, 7, 14), 5),
+        (datetime(2024, 5, 8, 12), 60),
+        (datetime(2024, 5, 9, 3), 120),
+    ]
+    # 给出范围时首尾也算：周一 00:00 之前是周日 22:00 开盘后的两小时
+    edges = find_gaps(conn, "MNQ", "1m", start=datetime(2024, 5, 5), end=datetime(2024, 5, 11))
+    assert edges[0].start == datetime(2024, 5, 5, 22) and edges[0].missing == 120
+    assert edges[-1].start == datetime(2024, 5, 10) and edges[-1].end == datetime(2024, 5, 10, 21)
+
+    # 1m 单次请求最多 1 天，四个缺口只需两次请求
+    windows = plan_gap_windows(gaps, {"1m": 1})
+    assert [(w.start, w.end) for w in windows] == [
+        (datetime(2024, 5, 7, 10), datetime(2024, 5, 7, 14, 5)),
+        (datetime(2024, 5, 8, 12), datetime(2024, 5, 9, 5)),
+    ]
+    conn.close()
+
+
+def test_fill_gaps_uses_few_requests_and_remembers_empty_windows(tmp_path):
+    db_path = str(tmp_path / "test.sqlite")
+    _holey_db(db_path).close()
+    client = FakeIBClient(empty_windows=HOLIDAY)
+
+    report = fill_gaps(["MNQ"], ["1m"], db_path=db_path, client=client, pacer=PacingLimiter(min_interval=0))
+    assert client.requests == 2
+    assert report.failure_count == 0
+
+    # 节假日所在窗口有其他K线返回，可能只是响应不完整：先不认定，下次再拉一次确认
+    conn = ensure_db(db_path)
+    assert [(g.start, g.end) for g in find_gaps(conn, "MNQ", "1m")] == HOLIDAY
+    conn.close()
+    fill_gaps(["MNQ"], ["1m"], db_path=db_path, client=client, pacer=PacingLimiter(min_interval=0))
+    assert client.requests == 3
+
+    conn = ensure_db(db_path)
+    assert find_gaps(conn, "MNQ", "1m") == []
+    known = find_gaps(conn, "MNQ", "1m", include_known=True)
+    assert [(g.start, g.end) for g in known] == HOLIDAY
+    conn.close()
+
+    fill_gaps(["MNQ"], ["1m"], db_path=db_path, client=client, pacer=PacingLimiter(min_interval=0))
+    assert client.requests == 3
+
+
+def test_fill_gaps_trusts_empty_responses_at_once(tmp_path):
+    db_path = str(tmp_path / "test.sqlite")
+    fetch_history(
+        ["MNQ"],
+        ["1m"],
+        start=datetime(2024, 5, 6),
+        end=datetime(2024, 5, 10),
+        db_path=db_path,
+        client=FakeIBClient(),
+        pacer=PacingLimiter(min_interval=0),
+    )
+    conn = ensure_db(db_path)
+    conn.execute(
+        "DELETE FROM bars_MNQ_1m WHERE ts_utc >= '2024-05-09T03:00:00+00:00' AND ts_utc < '2024-05-09T05:00:00+00:00'"
+    )
+    conn.commit()
+    conn.close()
+
+    # 整个请求窗口 IB 都返回无数据：一次就登记
+    client = FakeIBClient(empty_windows=[(datetime(2024, 5, 9, 3), datetime(2024, 5, 9, 5))])
+    fill_gaps(["MNQ"], ["1m"], db_path=db_path, client=client, pacer=PacingLimiter(min_interval=0))
+    assert client.requests == 1
+    conn = ensure_db(db_path)
+    assert find_gaps(conn, "MNQ", "1m") == []
+    conn.close()
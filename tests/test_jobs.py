@@ -0,0 +1,71 @@
+from datetime import datetime
+
+from ib_history.config import default_config
+from ib_history.fake_client import FakeIBClient
+from ib_history.jobs import (
+    JOB_DONE,
+    JOB_LEASED,
+    claim_job,
+    create_job_table,
+    enqueue_fetch_jobs,
+    job_counts,
+    queue_fetch,
+    renew_job_lease,
+    run_jobs,
+)
+from ib_history.pacing import PacingLimiter
+from ib_history.storage import ensure_db
+
+
+class _CountingPacer(PacingLimiter):
+    waits = 0
+
+    def wait(self, bar=None) -> float:
+        self.waits += 1
+        return super().wait(bar)
+
+
+def test_queue_fetch_runs_all_jobs_and_resume_is_noop(tmp_path):
+    db_path = str(tmp_path / "test.sqlite")
+    client = FakeIBClient()
+    report = queue_fetch(
+        symbols=["MNQ"],
+        bars=["1m"],
+        start=datetime(2024, 5, 6),
+        end=datetime(2024, 5, 8),
+        db_path=db_path,
+        workers=2,
+        client_factory=lambda index: client,
+        pacer=PacingLimiter(min_interval=0),
+    )
+    assert report.success_count == 23 * 60 * 2
+    conn = ensure_db(db_path)
+    counts = job_counts(conn)
+    conn.close()
+    assert set(counts) == {JOB_DONE}
+
+    served = client.rows_served
+    pacer = _CountingPacer(min_interval=0)
+    again = run_jobs(db_path, workers=1, client_factory=lambda index: client, pacer=pacer)
+    assert again.success_count == 0
+    # 队列已空：没有领到任务就不占用限速额度
+    assert pacer.waits == 0
+    assert client.rows_served == served
+
+
+def test_expired_lease_is_reclaimed(tmp_path):
+    conn = ensure_db(str(tmp_path / "test.sqlite"))
+    create_job_table(conn)
+    added = enqueue_fetch_jobs(
+        conn, FakeIBClient(), ["MNQ"], ["1h"], datetime(2024, 5, 6), datetime(2024, 5, 7), default_config()
+    )
+    assert added == 1
+    job = claim_job(conn, "crashed", lease_seconds=10, now=1000.0)
+    assert job is not None and job.attempts == 1
+    assert claim_job(conn, "other", lease_seconds=10, now=1005.0) is None
+    reclaimed = claim_job(conn, "other", lease_seconds=10, now=1011.0)
+    assert reclaimed.id == job.id and reclaimed.attempts == 2
+    assert not renew_job_lease(conn, job, "crashed", lease_seconds=10)
+    assert renew_job_lease(conn, reclaimed, "other", lease_seconds=10)
+    assert job_counts(conn) == {JOB_LEASED: 1}
+    conn.close()
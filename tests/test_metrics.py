@@ -0,0 +1,67 @@
+import json
+from datetime import datetime
+
+from ib_history.fetcher import fetch_history
+from ib_history.metrics import JsonLinesMetricsSink, FetchMetrics
+from ib_history.pacing import PacingLimiter
+
+
+class FlakyClient:
+    def __init__(self):
+        self.calls = 0
+
+    def fetch_bars(self, symbol, bar, start, end, config=None):
+        self.calls += 1
+        if self.calls == 1:
+            raise TimeoutError("request timed out")
+        return [{"ts_utc": start.isoformat(), "open": 1, "close": 1}]
+
+    def close(self):
+        return None
+
+
+def test_metrics_summary_and_jsonl_sink(tmp_path):
+    sink_path = tmp_path / "metrics.jsonl"
+    report = fetch_history(
+        symbols=["MNQ"],
+        bars=["1d"],
+        start=datetime(2024, 1, 1),
+        end=datetime(2024, 1, 5),
+        db_path=str(tmp_path / "test.sqlite"),
+        client=FlakyClient(),
+        pacer=PacingLimiter(min_interval=0),
+        metrics=FetchMetrics(sink=JsonLinesMetricsSink(str(sink_path))),
+    )
+    summary = report.to_dict()["metrics"]
+    assert summary["requests"] == 2
+    assert summary["rows"] == 1
+    assert summary["retries"] == {"timeout": 1}
+    assert summary["latency_seconds"]["buckets"]["+Inf"] == 2
+    assert "sqlite_write" in summary["phase_seconds"]
+    events = [json.loads(line) for line in sink_path.read_text().splitlines()]
+    assert [e["event"] for e in events] == ["request", "request", "summary"]
+    assert events[0]["outcome"] == "timeout"
+
+
+def test_prometheus_text():
+    metrics = FetchMetrics()
+    metrics.observe_request(0.3, 10, "ok")
+    metrics.add_phase("ib_wait", 0.25)
+    text = metrics.to_prometheus()
+    assert 'ib_history_fetch_request_seconds_bucket{le="0.5"} 1' in text
+    assert 'ib_history_fetch_phase_seconds_total{phase="ib_wait"} 0.25' in text
+
+
+def test_fetch_restores_caller_client_metrics(tmp_path):
+    client = FlakyClient()
+    client.metrics = owner = FetchMetrics()
+    fetch_history(
+        symbols=["MNQ"],
+        bars=["1d"],
+        start=datetime(2024, 1, 1),
+        end=datetime(2024, 1, 5),
+        db_path=str(tmp_path / "test.sqlite"),
+        client=client,
+        pacer=PacingLimiter(min_interval=0),
+    )
+    assert client.metrics is owner
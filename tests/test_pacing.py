@@ -0,0 +1,29 @@
+from ib_history.pacing import PacingLimiter
+
+
+def test_pacing_limiter_window():
+    now = [0.0]
+    limiter = PacingLimiter(
+        min_interval=1.0,
+        max_requests=3,
+        window_seconds=10.0,
+        clock=lambda: now[0],
+        sleep=lambda s: now.__setitem__(0, now[0] + s),
+    )
+    waits = [limiter.wait() for _ in range(4)]
+    assert waits == [0.0, 1.0, 1.0, 8.0]
+    assert now[0] == 10.0
+
+
+def test_window_cap_applies_only_to_small_bars():
+    now = [0.0]
+    limiter = PacingLimiter(
+        min_interval=1.0,
+        max_requests=2,
+        window_seconds=10.0,
+        clock=lambda: now[0],
+        sleep=lambda s: now.__setitem__(0, now[0] + s),
+    )
+    waits = [limiter.wait(bar) for bar in ("5s", "1m", "1h", "5s", "1m", "5s")]
+    # 1m / 1h 不占窗口额度；第三个 5s 请求要等第一个滑出窗口
+    assert waits == [0.0, 1.0, 1.0, 1.0, 1.0, 6.0]
@@ -0,0 +1,62 @@
+from datetime import datetime
+
+from ib_history.config import default_config, merge_config
+from ib_history.fake_client import FakeIBClient
+from ib_history.fetcher import fetch_history
+from ib_history.pacing import PacingLimiter
+from ib_history.planner import estimate_seconds, plan_fetch
+
+
+class _CountingClient(FakeIBClient):
+    lookups = 0
+
+    def list_fut_contracts(self, symbol, config=None):
+        self.lookups += 1
+        return super().list_fut_contracts(symbol, config)
+
+
+def test_estimate_follows_pacing_window():
+    cfg = merge_config(default_config(), pacing_sleep_seconds=1.0, pacing_max_requests=10, pacing_window_seconds=100.0)
+    assert estimate_seconds(10, cfg, request_seconds=0.5) == 9.5
+    # 第 11 个请求要等窗口内最早的请求滑出
+    assert estimate_seconds(11, cfg, request_seconds=0.5) == 100.5
+    # 请求本身比限速慢时，多连接可以并行
+    assert estimate_seconds(4, cfg, connections=1, request_seconds=4.0) == 16.0
+    assert estimate_seconds(4, cfg, connections=2, request_seconds=4.0) == 9.0
+    # 窗口上限只约束 30 秒及以下的K线，1m 只受最小间隔约束
+    assert estimate_seconds(11, cfg, request_seconds=0.5, bars=["1m"] * 11) == 10.5
+    assert estimate_seconds(11, cfg, request_seconds=0.5, bars=["30s"] * 11) == 100.5
+
+
+def test_plan_skips_stored_data_and_interleaves_symbols(tmp_path):
+    db_path = str(tmp_path / "test.sqlite")
+    client = _CountingClient()
+    fetch_history(
+        symbols=["MNQ"],
+        bars=["1h"],
+        start=datetime(2024, 5, 1),
+        end=datetime(2024, 5, 20),
+        db_path=db_path,
+        client=client,
+        pacer=PacingLimiter(min_interval=0),
+    )
+    client.lookups = 0
+    cfg = merge_config(default_config(), max_days_per_bar={"1h": 5})
+    plan = plan_fetch(
+        symbols=["MNQ", "MGC"],
+        bars=["1h"],
+        start=datetime(2024, 5, 1),
+        end=datetime(2024, 5, 31),
+        config=cfg,
+        db_path=db_path,
+        client=client,
+    )
+    # 库内最后一根是 5/19 周日 23:00 的K线，续拉从 5/20 00:00 开始
+    mnq = [r for r in plan.requests if r.symbol == "MNQ"]
+    assert mnq[0].time_slice.start == datetime(2024, 5, 20)
+    assert plan.total_requests == 12
+    # 每个品种只展开一次合约区间，总数与扣除后的请求同时得出
+    assert client.lookups == 2
+    assert plan.skipped_requests == 12 - len(plan.requests)
+    assert [r.symbol for r in plan.requests[:4]] == ["MNQ", "MGC", "MNQ", "MGC"]
+    assert plan.to_dict()["requests"] == len(plan.requests)
@@ -0,0 +1,51 @@
+import json
+import pstats
+import time
+from datetime import datetime
+
+from ib_history.fake_client import FakeIBClient
+from ib_history.fetcher import fetch_history
+from ib_history.pacing import PacingLimiter
+from ib_history.profiling import profile_run, span
+
+
+def test_profile_run_writes_collapsed_stacks_and_phase_summary(tmp_path):
+    prefix = str(tmp_path / "profile" / "fetch")
+    with profile_run("sample", prefix, "fetch") as profiler:
+        fetch_history(
+            ["MNQ"],
+            ["1m"],
+            datetime(2024, 5, 6),
+            datetime(2024, 5, 8),
+            db_path=str(tmp_path / "test.sqlite"),
+            client=FakeIBClient(),
+            pacer=PacingLimiter.unlimited(),
+        )
+        with span("chart_push"):
+            time.sleep(0.05)
+
+    summary = json.loads((tmp_path / "profile" / "fetch.phases.json").read_text(encoding="utf-8"))
+    assert summary["samples"] == profiler.samples > 0
+    assert {"contract_resolution", "sqlite_write", "pacing_sleep", "chart_push"} <= set(summary["phases"])
+    assert summary["phases"]["chart_push"]["count"] == 1
+    assert summary["phases"]["chart_push"]["seconds"] >= 0.05
+
+    lines = (tmp_path / "profile" / "fetch.collapsed").read_text(encoding="utf-8").splitlines()
+    assert lines and all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+    # 采样栈以所在阶段为根
+    assert any(line.startswith("phase:chart_push;") for line in lines)
+    assert not (tmp_path / "profile" / "fetch.pstats").exists()
+
+
+def test_cprofile_mode_adds_pstats(tmp_path):
+    prefix = str(tmp_path / "chart")
+    with profile_run("cprofile", prefix, "chart"):
+        sum(i * i for i in range(10000))
+    stats = pstats.Stats(f"{prefix}.pstats")
+    assert stats.total_calls > 0
+    assert json.loads(open(f"{prefix}.phases.json", encoding="utf-8").read())["mode"] == "cprofile"
+
+
+def test_spans_are_noops_without_profiler():
+    with span("chart_push"):
+        pass
@@ -0,0 +1,83 @@
+import calendar
+from datetime import datetime
+
+import numpy as np
+
+from ib_history.fake_client import synthetic_bars
+from ib_history.cold import archive_series
+from ib_history.reader import iter_aligned_blocks, load_aligned_series, stream_bars
+from ib_history.storage import ensure_db, insert_bars
+
+
+def _db(tmp_path):
+    conn = ensure_db(str(tmp_path / "test.sqlite"))
+    insert_bars(conn, "MNQ", "1h", synthetic_bars(1, "1h", datetime(2024, 5, 6), datetime(2024, 5, 9)))
+    mgc = synthetic_bars(2, "1h", datetime(2024, 5, 7), datetime(2024, 5, 10))
+    # MGC 每隔一根缺一根
+    keep = np.arange(len(mgc)) % 2 == 0
+    mgc.ts, mgc.values = mgc.ts[keep], mgc.values[keep]
+    insert_bars(conn, "MGC", "1h", mgc)
+    conn.commit()
+    return conn
+
+
+def test_stream_bars_merges_symbols_in_time_order(tmp_path):
+    conn = _db(tmp_path)
+    events = list(stream_bars(conn, ["MNQ", "MGC"], "1h", chunk_rows=7))
+    counts = {
+        symbol: conn.execute(f"SELECT COUNT(*) FROM bars_{symbol}_1h").fetchone()[0]
+        for symbol in ("MNQ", "MGC")
+    }
+    assert len(events) == sum(counts.values())
+    keys = [(e.ts, ["MNQ", "MGC"].index(e.symbol)) for e in events]
+    assert keys == sorted(keys)
+    first_mgc = next(e for e in events if e.symbol == "MGC")
+    assert first_mgc.ts == calendar.timegm((2024, 5, 7, 0, 0, 0))
+    assert first_mgc.bar["close"] > 0
+    conn.close()
+
+
+def test_iter_aligned_blocks_aligns_per_window(tmp_path):
+    conn = _db(tmp_path)
+    blocks = list(iter_aligned_blocks(conn, ["MNQ", "MGC"], "1h", window_seconds=86400, chunk_rows=5))
+    assert [np.datetime64(b.start, "s").astype(str) for b in blocks] == [
+        "2024-05-06T00:00:00",
+        "2024-05-07T00:00:00",
+        "2024-05-08T00:00:00",
+        "2024-05-09T00:00:00",
+    ]
+    day2 = blocks[1]
+    assert (day2.ts >= day2.start).all() and (day2.ts < day2.start + 86400).all()
+    assert day2.present["MNQ"].all()
+    assert day2.present["MGC"].sum() == (len(day2.ts) + 1) // 2
+    missing = ~day2.present["MGC"]
+    assert np.isnan(day2.bars["MGC"]["close"][missing]).all()
+    assert (day2.bars["MGC"]["volume"][missing] == 0).all()
+    assert not blocks[0].present["MGC"].any()
+    assert not blocks[3].present["MNQ"].any()
+    conn.close()
+
+
+def test_load_aligned_series_reads_archived_months(tmp_path):
+    conn = ensure_db(str(tmp_path / "test.sqlite"))
+    trades = synthetic_bars(1, "1h", datetime(2024, 1, 29), datetime(2024, 2, 3))
+    insert_bars(conn, "MNQ", "1h", trades)
+    insert_bars(conn, "MNQ", "1h", synthetic_bars(1, "1h", datetime(2024, 1, 30), datetime(2024, 2, 2)), "BID_ASK")
+    conn.commit()
+    before = load_aligned_series(conn, "MNQ", "1h", ["TRADES", "BID_ASK"])
+
+    for what in ("TRADES", "BID_ASK"):
+        archive_series(conn, "MNQ", "1h", what, before=datetime(2024, 2, 5), root=str(tmp_path / "cold"))
+    assert conn.execute("SELECT COUNT(*) FROM bars_MNQ_1h WHERE ts_utc < '2024-02-01'").fetchone()[0] == 0
+    after = load_aligned_series(conn, "MNQ", "1h", ["TRADES", "BID_ASK"])
+    assert after["ts"]["epoch"].tolist() == before["ts"]["epoch"].tolist() == trades.ts.tolist()
+    for what in ("TRADES", "BID_ASK"):
+        np.testing.assert_array_equal(after[what]["close"], before[what]["close"])
+    assert np.isnan(after["BID_ASK"]["close"][0]) and not np.isnan(after["BID_ASK"]["close"][24])
+
+    window = load_aligned_series(
+        conn, "MNQ", "1h", ["TRADES"], start_utc="2024-01-31T00:00:00+00:00", end_utc="2024-02-01T02:00:00+00:00"
+    )
+    lo, hi = calendar.timegm((2024, 1, 31, 0, 0, 0)), calendar.timegm((2024, 2, 1, 2, 0, 0))
+    assert window["ts"]["epoch"].tolist() == [ts for ts in trades.ts.tolist() if lo <= ts < hi]
+    conn.close()
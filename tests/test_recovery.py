@@ -0,0 +1,64 @@
+from datetime import datetime
+
+from ib_history.fake_client import FakeIBClient, synthetic_bars
+from ib_history.pacing import PacingLimiter
+from ib_history.recovery import pending_failure_windows, retry_failures
+from ib_history.storage import ensure_db, insert_bars, log_failure
+
+
+def _log(conn, start, end, attempt, is_no_data=False):
+    log_failure(conn, "MNQ", "1h", start, end, attempt, "timeout", is_no_data, "2024-06-01T00:00:00")
+
+
+def test_failure_windows_are_deduplicated_and_merged(tmp_path):
+    conn = ensure_db(str(tmp_path / "test.sqlite"))
+    for attempt in (1, 2, 3):
+        _log(conn, "2024-05-06T00:00:00", "2024-05-07T00:00:00", attempt)
+    _log(conn, "2024-05-07T00:00:00", "2024-05-08T00:00:00", 1)
+    _log(conn, "2024-05-09T00:00:00", "2024-05-10T00:00:00", 1)
+    _log(conn, "2024-05-12T00:00:00", "2024-05-13T00:00:00", 1, is_no_data=True)
+    # 这个窗口已被后来的拉取补齐
+    _log(conn, "2024-05-14T00:00:00", "2024-05-15T00:00:00", 1)
+    insert_bars(conn, "MNQ", "1h", synthetic_bars(1, "1h", datetime(2024, 5, 14), datetime(2024, 5, 15)))
+    # 只写入了一根K线的窗口仍缺数据
+    _log(conn, "2024-05-16T00:00:00", "2024-05-17T00:00:00", 1)
+    insert_bars(conn, "MNQ", "1h", [{"ts_utc": "2024-05-16T01:00:00+00:00", "close": 1.0}])
+
+    windows, covered = pending_failure_windows(conn)
+    assert [(w.start.day, w.end.day, len(w.failure_ids)) for w in windows] == [(6, 8, 4), (9, 10, 1), (16, 17, 1)]
+    assert len(covered) == 1
+    conn.close()
+
+
+def test_retry_failures_refetches_and_compacts(tmp_path):
+    db_path = str(tmp_path / "test.sqlite")
+    conn = ensure_db(db_path)
+    for attempt in (1, 2):
+        _log(conn, "2024-05-06T00:00:00", "2024-05-07T00:00:00", attempt)
+    _log(conn, "2024-05-12T00:00:00", "2024-05-13T00:00:00", 1, is_no_data=True)
+    conn.commit()
+    conn.close()
+
+    report = retry_failures(db_path=db_path, client=FakeIBClient(), pacer=PacingLimiter(min_interval=0))
+    assert report.success_count == 23
+    assert len(report.ranges) == 1
+
+    conn = ensure_db(db_path)
+    remaining = conn.execute("SELECT is_no_data FROM fetch_failures").fetchall()
+    conn.close()
+    assert remaining == [(1,)]
+
+
+def test_failure_window_over_known_holiday_is_covered(tmp_path):
+    conn = ensure_db(str(tmp_path / "test.sqlite"))
+    _log(conn, "2024-05-20T00:00:00", "2024-05-21T00:00:00", 1)
+    holiday = [(datetime(2024, 5, 20, 12), datetime(2024, 5, 20, 15))]
+    insert_bars(conn, "MNQ", "1h", synthetic_bars(1, "1h", datetime(2024, 5, 20), datetime(2024, 5, 21), holiday))
+    windows, covered = pending_failure_windows(conn)
+    assert len(windows) == 1 and covered == []
+
+    # IB 对节假日这段返回过无数据：其余K线都在，失败记录视为已补齐
+    _log(conn, "2024-05-20T12:00:00", "2024-05-20T15:00:00", 1, is_no_data=True)
+    windows, covered = pending_failure_windows(conn)
+    assert windows == [] and len(covered) == 1
+    conn.close()
@@ -1,3 +1,9 @@
+import json
+from datetime import datetime
+
+from ib_history.fake_client import FakeIBClient
+from ib_history.fetcher import fetch_history
+from ib_history.pacing import PacingLimiter
 from ib_history.report import FetchReport
 
 
@@ -6,3 +12,25 @@ def test_report_to_dict():
     data = report.to_dict()
     assert data["symbols"] == ["MNQ"]
     assert data["bars"] == ["1m"]
+
+
+def test_streaming_report_keeps_only_aggregates(tmp_path):
+    events_path = tmp_path / "events.jsonl"
+    report = fetch_history(
+        symbols=["MNQ"],
+        bars=["1m"],
+        start=datetime(2024, 5, 6),
+        end=datetime(2024, 5, 9),
+        db_path=str(tmp_path / "test.sqlite"),
+        client=FakeIBClient(pacing_violation_every=2, empty_windows=[(datetime(2024, 5, 7), datetime(2024, 5, 8))]),
+        pacer=PacingLimiter(min_interval=0),
+        events_out=str(events_path),
+    )
+    assert report.failures == [] and report.no_data == []
+    assert (report.failure_count, report.no_data_count) == (2, 1)
+    events = [json.loads(line) for line in events_path.read_text().splitlines()]
+    kinds = [event["event"] for event in events]
+    assert kinds.count("slice_done") == 2 and kinds.count("retry") == 2 and kinds[-1] == "summary"
+    (series,) = report.summary()
+    assert series["contract"] == "MNQ2406"
+    assert (series["slices"], series["rows"], series["retries"], series["no_data"]) == (3, 23 * 60 * 2, 2, 1)
@@ -0,0 +1,164 @@
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import numpy as np
+
+from ib_history.config import default_config, merge_config
+from ib_history.contract_resolver import resolve_contract
+from ib_history.fake_client import FakeIBClient, synthetic_bars
+from ib_history.fetcher import fetch_history
+from ib_history.ib_client import IBAsyncClient
+from ib_history.metrics import FetchMetrics
+from ib_history.reader import read_bar_chunks
+from ib_history.response_cache import ResponseCache
+from ib_history.storage import ensure_db
+
+START = datetime(2024, 5, 6)
+END = datetime(2024, 5, 9)
+
+
+class _StubIB:
+    """模拟 ib_async.IB 的三个请求接口，数据来自 FakeIBClient。"""
+
+    def __init__(self) -> None:
+        self.fake = FakeIBClient()
+        self.historical = 0
+        self.config = default_config()
+
+    def reqHistoricalData(self, contract, endDateTime, durationStr, barSizeSetting, **kwargs):
+        self.historical += 1
+        count, unit = durationStr.split()
+        span = timedelta(seconds=int(count)) if unit == "S" else timedelta(days=int(count))
+        end = endDateTime.astimezone(timezone.utc).replace(tzinfo=None)
+        bar = {v: k for k, v in self.config.bar_size_map.items()}[barSizeSetting]
+        batch = self.fake.fetch_bars_for_contract(contract, bar, end - span, end)
+        return [
+            SimpleNamespace(
+                date=datetime.fromtimestamp(int(ts), timezone.utc),
+                open=row["open"],
+                high=row["high"],
+                low=row["low"],
+                close=row["close"],
+                volume=row["volume"],
+                average=row["vwap"],
+                barCount=row["trade_count"],
+            )
+            for ts, row in zip(batch.ts, batch.values)
+        ]
+
+    def reqContractDetails(self, base):
+        return [SimpleNamespace(contract=c) for c in self.fake.list_fut_contracts(base.symbol)]
+
+    def reqHeadTimeStamp(self, contract, **kwargs):
+        return self.fake.head_timestamp(contract)
+
+    def isConnected(self):
+        return True
+
+    def disconnect(self):
+        return None
+
+
+class _CountingPacer:
+    def __init__(self) -> None:
+        self.waits = 0
+
+    def wait(self, bar=None) -> float:
+        self.waits += 1
+        return 0.0
+
+
+def _client(cfg, ib=None):
+    client = IBAsyncClient.from_config(cfg, resolve_contract)
+    client._ib = ib
+    # 测试环境没有 ib_async，合约查询只用到 Contract 的属性
+    client._load_ib = lambda: (None, None, SimpleNamespace, None)
+    return client
+
+
+def _fetch(cfg, db_path, client, pacer, start=START, end=END):
+    metrics = FetchMetrics()
+    report = fetch_history(
+        ["MNQ"], ["5m"], start, end, config=cfg, db_path=db_path, client=client, pacer=pacer, metrics=metrics
+    )
+    return report, metrics
+
+
+def _bars(db_path):
+    conn = ensure_db(db_path)
+    batches = list(read_bar_chunks(conn, "MNQ", "5m"))
+    conn.close()
+    ts = np.concatenate([b.ts for b in batches])
+    return ts.tolist(), np.concatenate([b.values for b in batches]).tolist()
+
+
+def test_readwrite_then_replay_offline(tmp_path):
+    cfg = merge_config(
+        default_config(), response_cache_mode="readwrite", response_cache_dir=str(tmp_path / "cache")
+    )
+    ib = _StubIB()
+    _fetch(cfg, str(tmp_path / "a.sqlite"), _client(cfg, ib), _CountingPacer())
+    requests = ib.historical
+    assert requests > 0
+
+    # 再次拉取（例如换表结构重建）：历史K线全部命中缓存，不占限速预算
+    ib = _StubIB()
+    pacer = _CountingPacer()
+    report, metrics = _fetch(cfg, str(tmp_path / "b.sqlite"), _client(cfg, ib), pacer)
+    assert ib.historical == 0 and pacer.waits == 0
+    assert metrics.summary()["response_cache"] == {"hits": requests, "misses": 0}
+    assert _bars(str(tmp_path / "b.sqlite")) == _bars(str(tmp_path / "a.sqlite"))
+
+    # replay：不连接 IB，合约列表与最早数据时间也从缓存还原
+    replay = merge_config(cfg, response_cache_mode="replay")
+    client = _client(replay)
+    report, _ = _fetch(replay, str(tmp_path / "c.sqlite"), client, _CountingPacer())
+    assert report.failure_count == 0
+    assert _bars(str(tmp_path / "c.sqlite")) == _bars(str(tmp_path / "a.sqlite"))
+
+    # 缓存里没有的窗口记为失败，不会去连 IB
+    missing = (END, END + timedelta(days=1))
+    report, _ = _fetch(replay, str(tmp_path / "d.sqlite"), client, _CountingPacer(), *missing)
+    assert report.failure_count > 0 and report.success_count == 0
+    client.close()
+
+
+def test_recent_windows_are_not_cached(tmp_path):
+    cfg = merge_config(
+        default_config(), response_cache_mode="readwrite", response_cache_dir=str(tmp_path / "cache")
+    )
+    client = _client(cfg, _StubIB())
+    end = datetime.utcnow().replace(second=0, microsecond=0)
+    contract = SimpleNamespace(conId=1)
+    client.fetch_bars_for_contract(contract, "5m", end - timedelta(hours=2), end, cfg)
+    assert not client.has_cached_bars(contract, "5m", end - timedelta(hours=2), end, cfg)
+    client.fetch_bars_for_contract(contract, "5m", START, END, cfg)
+    assert client.has_cached_bars(contract, "5m", START, END, cfg)
+
+
+def test_lru_eviction_keeps_recently_used(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache"), max_bytes=10**9)
+    batch = synthetic_bars(1, "1m", START, START + timedelta(hours=6))
+    for idx in range(3):
+        cache.put_bars(("bars", idx), batch)
+    size = cache.stats()["bytes"] // 3
+    cache.max_bytes = size * 3
+    assert cache.get_bars(("bars", 0)) is not None
+    cache.put_bars(("bars", 3), batch)
+    assert not cache.contains(("bars", 1))
+    assert all(cache.contains(("bars", idx)) for idx in (0, 2, 3))
+    restored = cache.get_bars(("bars", 3))
+    assert restored.ts.tolist() == batch.ts.tolist()
+    assert restored.values.tolist() == batch.values.tolist()
+    cache.close()
+
+
+def test_contains_drops_entries_whose_file_is_gone(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache"), max_bytes=10**9)
+    cache.put_bars(("bars", 0), synthetic_bars(1, "1m", START, START + timedelta(hours=1)))
+    assert cache.contains(("bars", 0))
+    for path in (tmp_path / "cache").rglob("*.npz"):
+        path.unlink()
+    assert not cache.contains(("bars", 0))
+    assert cache.stats()["entries"] == 0
+    cache.close()
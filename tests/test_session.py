@@ -0,0 +1,115 @@
+import threading
+import time
+from datetime import datetime
+
+from ib_history.config import default_config
+from ib_history.fake_client import FakeIBClient
+from ib_history.fetcher import fetch_history
+from ib_history.session import SessionClient, SessionDaemon, connect_session
+
+
+def _start_daemon(tmp_path, fake):
+    # AF_UNIX 路径有长度上限，放在 tmp_path 下的短文件名
+    path = str(tmp_path / "s.sock")
+    daemon = SessionDaemon(default_config(), path, client=fake)
+    thread = threading.Thread(target=daemon.serve, daemon=True)
+    thread.start()
+    for _ in range(100):
+        probe = connect_session(default_config(), path)
+        if probe is not None:
+            probe.close()
+            break
+        time.sleep(0.01)
+    return daemon, thread, path
+
+
+def test_fetch_through_session_daemon_reuses_contract_cache(tmp_path):
+    fake = FakeIBClient()
+    daemon, thread, path = _start_daemon(tmp_path, fake)
+    daemon.pacer.min_interval = 0
+    try:
+        for day in (6, 7):
+            client = SessionClient(path)
+            try:
+                report = fetch_history(
+                    symbols=["MNQ"],
+                    bars=["1m"],
+                    start=datetime(2024, 5, day),
+                    end=datetime(2024, 5, day + 1),
+                    db_path=str(tmp_path / "test.sqlite"),
+                    client=client,
+                )
+            finally:
+                client.close()
+            assert report.success_count == 23 * 60
+        assert fake.requests == 2
+        assert list(daemon._contracts) == ["MNQ"]
+    finally:
+        client = SessionClient(path)
+        client.shutdown()
+        client.close()
+        thread.join(timeout=5)
+    assert not thread.is_alive()
+
+
+def test_session_errors_are_raised_on_client(tmp_path):
+    daemon, thread, path = _start_daemon(tmp_path, FakeIBClient(pacing_violation_every=1))
+    daemon.pacer.min_interval = 0
+    client = SessionClient(path)
+    try:
+        contract = client.list_fut_contracts("MNQ")[0]
+        try:
+            client.fetch_bars_for_contract(contract, "1m", datetime(2018, 1, 2), datetime(2018, 1, 3))
+        except Exception as exc:  # noqa: BLE001
+            assert "pacing violation" in str(exc)
+        else:
+            raise AssertionError("expected pacing violation")
+        assert client.ping()["requests"] == 3
+    finally:
+        client.shutdown()
+        client.close()
+        thread.join(timeout=5)
+
+
+class _GatedClient(FakeIBClient):
+    """fetch 在 gate 打开前一直阻塞，模拟一个很慢的 IB 请求。"""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.entered = threading.Event()
+        self.gate = threading.Event()
+
+    def fetch_bars_for_contract(self, contract, bar, start, end, config=None):
+        self.entered.set()
+        self.gate.wait(5)
+        return super().fetch_bars_for_contract(contract, bar, start, end, config)
+
+
+def test_second_client_is_served_while_first_waits_on_ib(tmp_path):
+    fake = _GatedClient()
+    daemon, thread, path = _start_daemon(tmp_path, fake)
+    daemon.pacer.min_interval = 0
+    first = SessionClient(path)
+    contract = first.list_fut_contracts("MNQ")[0]
+    results = []
+    worker = threading.Thread(
+        target=lambda: results.append(
+            first.fetch_bars_for_contract(contract, "1m", datetime(2024, 5, 6), datetime(2024, 5, 7))
+        )
+    )
+    worker.start()
+    second = SessionClient(path, timeout=2.0)
+    try:
+        assert fake.entered.wait(5)
+        # 第一个连接仍在等 IB，第二个连接照样能连上并得到应答
+        assert second.ping()["connected"]
+        fake.gate.set()
+        worker.join(timeout=5)
+        assert len(results[0]) == 23 * 60
+    finally:
+        fake.gate.set()
+        second.shutdown()
+        second.close()
+        first.close()
+        thread.join(timeout=5)
+    assert not thread.is_alive()
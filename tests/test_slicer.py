@@ -1,6 +1,6 @@
 from datetime import datetime
 
-from ib_history.slicer import slice_range
+from ib_history.slicer import slice_by_bar, slice_range
 
 
 def test_slice_range_basic():
@@ -10,3 +10,18 @@ def test_slice_range_basic():
     assert len(slices) == 3
     assert slices[0].start == start
     assert slices[-1].end == end
+
+
+def test_slice_by_bar_aligns_start_and_tiles_without_overlap():
+    slices = slice_by_bar(datetime(2024, 1, 1, 9, 7, 41), datetime(2024, 1, 3, 12), "5m", {"5m": 1})
+    assert slices[0].start == datetime(2024, 1, 1, 9, 5)
+    assert all(a.end == b.start for a, b in zip(slices, slices[1:]))
+    assert slices[-1].end == datetime(2024, 1, 3, 12)
+
+
+def test_slice_by_bar_splits_fractional_tail_into_whole_days_and_seconds():
+    slices = slice_by_bar(datetime(2024, 1, 1), datetime(2024, 1, 8, 6), "1h", {"1h": 5})
+    spans = [(s.end - s.start).total_seconds() for s in slices]
+    assert spans == [5 * 86400, 2 * 86400, 6 * 3600]
+    # 日线不切零头
+    assert len(slice_by_bar(datetime(2024, 1, 1), datetime(2024, 1, 8, 6), "1d", {"1d": 365})) == 1
@@ -1,7 +1,18 @@
+import json
 import sqlite3
+from datetime import datetime
 from tempfile import NamedTemporaryFile
 
-from ib_history.storage import create_failure_table, insert_bars, ensure_db
+from ib_history.fake_client import synthetic_bars
+from ib_history.storage import (
+    change_log_enabled,
+    create_bars_table,
+    create_failure_table,
+    enable_change_log,
+    ensure_db,
+    insert_bars,
+    upsert_bars,
+)
 
 
 def test_insert_bars_and_failure_table():
@@ -23,3 +34,49 @@ def test_insert_bars_and_failure_table():
         assert inserted == 1
         create_failure_table(conn)
         conn.close()
+
+
+def test_upsert_bars_skips_unchanged_and_records_revisions(tmp_path):
+    conn = ensure_db(str(tmp_path / "test.sqlite"))
+    batch = synthetic_bars(1, "1h", datetime(2024, 5, 6), datetime(2024, 5, 7))
+    first = upsert_bars(conn, "MNQ", "1h", batch)
+    assert (first.inserted, first.updated, first.unchanged) == (len(batch), 0, 0)
+
+    before = conn.total_changes
+    again = upsert_bars(conn, "MNQ", "1h", batch)
+    assert (again.inserted, again.updated, again.unchanged) == (0, 0, len(batch))
+    assert conn.total_changes == before
+
+    # IB 修订了最近一根K线的成交量
+    batch.values["volume"][-1] += 5
+    revised = upsert_bars(conn, "MNQ", "1h", batch)
+    assert (revised.inserted, revised.updated, revised.written) == (0, 1, 1)
+    ts_utc, old, new = conn.execute("SELECT ts_utc, old_values, new_values FROM bar_revisions").fetchone()
+    assert ts_utc == batch.ts_utc()[-1]
+    assert json.loads(new)[4] == json.loads(old)[4] + 5
+
+    # 同一批里既有新K线又有修订：计数不依赖触发器写了多少行
+    mixed = synthetic_bars(1, "1h", datetime(2024, 5, 6, 22), datetime(2024, 5, 7, 2))
+    mixed.values["close"][0] += 1
+    mixed.values["volume"][1] = batch.values["volume"][-1]
+    stats = upsert_bars(conn, "MNQ", "1h", mixed)
+    assert (stats.inserted, stats.updated, stats.unchanged) == (2, 1, 1)
+    conn.close()
+
+
+def test_tables_register_once_and_change_log_is_opt_in(tmp_path):
+    conn = ensure_db(str(tmp_path / "test.sqlite"))
+    insert_bars(conn, "MNQ", "1h", synthetic_bars(1, "1h", datetime(2024, 5, 6), datetime(2024, 5, 7)))
+    conn.commit()
+    assert not change_log_enabled(conn)
+
+    # 已建好的表再次调用只读登记表，不开写事务，不挡住其他写入方
+    create_bars_table(conn, "MNQ", "1h")
+    assert not conn.in_transaction
+
+    enable_change_log(conn)
+    upsert_bars(conn, "MNQ", "1h", synthetic_bars(1, "1h", datetime(2024, 5, 7), datetime(2024, 5, 7, 3)))
+    insert_bars(conn, "MGC", "1h", synthetic_bars(2, "1h", datetime(2024, 5, 7), datetime(2024, 5, 7, 2)))
+    counts = dict(conn.execute("SELECT table_name, COUNT(*) FROM bar_changes GROUP BY table_name"))
+    assert counts == {"bars_MNQ_1h": 3, "bars_MGC_1h": 2}
+    conn.close()
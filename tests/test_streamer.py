@@ -0,0 +1,103 @@
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from ib_history.config import default_config, merge_config
+from ib_history.fake_client import FakeIBClient
+from ib_history.storage import ensure_db
+from ib_history.streamer import BarAggregator, StreamDaemon, _Subscription
+
+
+def test_aggregator_drops_partial_first_bucket():
+    agg = BarAggregator(seconds=60)
+    out = []
+    # 订阅从 00:00:30 开始，第一个 1m 周期不完整
+    for ts in range(30, 60, 5):
+        out += agg.add(ts, 1, 1, 1, 1, 1, 1, 1)
+    assert out == []
+    for i, ts in enumerate(range(60, 120, 5)):
+        out += agg.add(ts, 10 + i, 20 + i, 5, 11 + i, 2, 10, 1)
+    assert len(out) == 1
+    row = out[0]
+    assert row["ts_utc"] == "1970-01-01T00:01:00+00:00"
+    assert (row["open"], row["high"], row["low"], row["close"]) == (10, 31, 5, 22)
+    assert row["volume"] == 24
+    assert row["trade_count"] == 12
+
+
+def test_aggregator_drops_buckets_missing_sub_bars():
+    agg = BarAggregator(seconds=60)
+    out = []
+    # 第一个 1m 缺中间一根，第二个缺最后一根，第三个完整
+    for ts in range(0, 180, 5):
+        if ts in (30, 115):
+            continue
+        out += agg.add(ts, 1, 1, 1, 1, 1, 1, 1)
+    assert [row["ts_utc"] for row in out] == ["1970-01-01T00:02:00+00:00"]
+    assert out[0]["volume"] == 12
+
+
+class _RecordingDaemon(StreamDaemon):
+    def _backfill_gap(self, symbol, bar, first_live, start=None):
+        self.gaps.append((start, first_live))
+
+
+def test_drain_backfills_dropped_buckets(tmp_path):
+    db_path = str(tmp_path / "test.sqlite")
+    daemon = _RecordingDaemon(["MNQ"], ["1m"], default_config(), db_path, client=FakeIBClient())
+    daemon.gaps = []
+    sub = _Subscription(symbol="MNQ", contract=None, aggregators={"1m": BarAggregator(60)})
+    first_live = datetime(2024, 5, 7, 15, tzinfo=timezone.utc)
+    for offset in range(0, 240, 5):
+        if offset in (70, 125):  # 15:01 与 15:02 断流
+            continue
+        rt_bar = SimpleNamespace(
+            time=first_live + timedelta(seconds=offset),
+            open_=1.0,
+            high=2.0,
+            low=0.5,
+            close=1.5,
+            volume=10,
+            wap=1.2,
+            count=3,
+        )
+        daemon._on_bar(sub, rt_bar)
+    daemon._drain()
+    stored = [row[0] for row in daemon.conn.execute("SELECT ts_utc FROM bars_MNQ_1m ORDER BY ts_utc")]
+    daemon.close()
+    assert stored == [first_live.isoformat(), (first_live + timedelta(minutes=3)).isoformat()]
+    dropped = (first_live + timedelta(minutes=1), first_live + timedelta(minutes=3))
+    assert daemon.gaps == [(None, first_live), dropped]
+
+
+def test_drain_backfills_each_symbol_after_writing_another(tmp_path):
+    db_path = str(tmp_path / "test.sqlite")
+    cfg = merge_config(
+        default_config(), stream_max_backfill="1d", sqlite_busy_timeout=0.5, pacing_sleep_seconds=0
+    )
+    daemon = StreamDaemon(["MNQ", "MGC"], ["1m"], cfg, db_path, client=FakeIBClient())
+    first_live = datetime(2024, 5, 7, 15, tzinfo=timezone.utc)
+    # 同一次 drain 里两个品种各有一根完整的 1m：第二个品种回补时第一个品种的实时K线已写入
+    for symbol in ("MNQ", "MGC"):
+        sub = _Subscription(symbol=symbol, contract=None, aggregators={"1m": BarAggregator(60)})
+        for offset in range(0, 60, 5):
+            rt_bar = SimpleNamespace(
+                time=first_live + timedelta(seconds=offset),
+                open_=1.0,
+                high=2.0,
+                low=0.5,
+                close=1.5,
+                volume=10,
+                wap=1.2,
+                count=3,
+            )
+            daemon._on_bar(sub, rt_bar)
+    daemon._drain()
+    daemon.close()
+
+    conn = ensure_db(db_path)
+    for symbol in ("MNQ", "MGC"):
+        table = f"bars_{symbol}_1m"
+        assert conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] == 23 * 60 + 1
+        live = conn.execute(f"SELECT volume FROM {table} WHERE ts_utc = ?", (first_live.isoformat(),))
+        assert live.fetchone() == (120,)
+    conn.close()
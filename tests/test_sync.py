@@ -0,0 +1,139 @@
+import shutil
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from ib_history.cold import archive_series
+from ib_history.fake_client import synthetic_bars
+from ib_history.reader import read_bar_chunks
+from ib_history.storage import BAR_COLUMNS, ensure_db, insert_bars, upsert_bars
+from ib_history.sync import apply_changes, export_changes, init_replica, prune_changes
+
+REVISED = {
+    "ts_utc": "2024-01-09T15:00:00+00:00",
+    "open": 1.0,
+    "high": 2.0,
+    "low": 0.5,
+    "close": 1.5,
+    "volume": 9,
+    "vwap": 1.2,
+    "trade_count": 3,
+}
+
+
+def _bars(conn, bar="5m"):
+    batches = list(read_bar_chunks(conn, "MNQ", bar))
+    if not batches:
+        return [], []
+    ts = np.concatenate([b.ts for b in batches])
+    return ts.tolist(), np.concatenate([b.values for b in batches]).tolist()
+
+
+def test_export_apply_ships_only_new_and_changed_rows(tmp_path):
+    source = ensure_db(str(tmp_path / "source.sqlite"))
+    replica = ensure_db(str(tmp_path / "replica.sqlite"))
+    batch_path = str(tmp_path / "sync" / "changes.npz")
+    insert_bars(source, "MNQ", "5m", synthetic_bars(1, "5m", datetime(2024, 1, 8), datetime(2024, 1, 11)))
+    insert_bars(source, "MNQ", "1h", synthetic_bars(1, "1h", datetime(2024, 1, 8), datetime(2024, 1, 11)))
+    source.commit()
+
+    first = export_changes(source, batch_path, peer="backtest")
+    applied = apply_changes(replica, batch_path)
+    assert applied.inserted == first.rows == len(_bars(source)[0]) + len(_bars(source, "1h")[0])
+    assert _bars(replica) == _bars(source) and _bars(replica, "1h") == _bars(source, "1h")
+
+    # 一天新数据 + 一根修订：重拉已有区间的相同K线不产生变更
+    insert_bars(source, "MNQ", "5m", synthetic_bars(1, "5m", datetime(2024, 1, 9), datetime(2024, 1, 12)))
+    upsert_bars(source, "MNQ", "5m", [REVISED])
+    source.commit()
+    second = export_changes(source, batch_path, peer="backtest")
+    assert second.from_seq == first.to_seq
+    assert second.tables == {"bars_MNQ_5m": 276 + 1}
+    assert second.bytes < first.bytes
+    applied = apply_changes(replica, batch_path)
+    assert (applied.inserted, applied.updated) == (276, 1)
+    assert _bars(replica) == _bars(source)
+
+    again = apply_changes(replica, batch_path)
+    assert (again.inserted, again.updated) == (0, 0)
+
+    # 归档到冷存储是删除热表行，不同步成删除
+    archive_series(source, "MNQ", "5m", before=datetime(2024, 2, 1), root=str(tmp_path / "cold"))
+    third = export_changes(source, batch_path, peer="backtest")
+    assert third.rows == 0
+    apply_changes(replica, batch_path)
+    assert _bars(replica) == _bars(source)
+    assert prune_changes(source) > 0
+
+
+def test_apply_refuses_missing_batches_and_reads_archived_rows(tmp_path):
+    source = ensure_db(str(tmp_path / "source.sqlite"))
+    insert_bars(source, "MNQ", "5m", synthetic_bars(1, "5m", datetime(2024, 1, 8), datetime(2024, 1, 10)))
+    source.commit()
+    export_changes(source, str(tmp_path / "first.npz"), peer="backtest")
+    upsert_bars(source, "MNQ", "5m", [REVISED])
+    source.commit()
+    # 改写后被归档的K线从冷存储块里导出
+    archive_series(source, "MNQ", "5m", before=datetime(2024, 2, 1), root=str(tmp_path / "cold"))
+    batch = export_changes(source, str(tmp_path / "second.npz"), peer="backtest")
+    assert batch.rows == 1
+
+    replica = ensure_db(str(tmp_path / "replica.sqlite"))
+    with pytest.raises(ValueError):
+        apply_changes(replica, str(tmp_path / "second.npz"))
+    apply_changes(replica, str(tmp_path / "first.npz"))
+    apply_changes(replica, str(tmp_path / "second.npz"))
+    assert _bars(replica) == _bars(source)
+    with pytest.raises(ValueError):
+        apply_changes(source, str(tmp_path / "second.npz"))
+
+
+def test_copied_file_becomes_replica(tmp_path):
+    source_path, replica_path = str(tmp_path / "source.sqlite"), str(tmp_path / "replica.sqlite")
+    source = ensure_db(source_path)
+    insert_bars(source, "MNQ", "5m", synthetic_bars(1, "5m", datetime(2024, 1, 8), datetime(2024, 1, 10)))
+    source.commit()
+    export_changes(source, str(tmp_path / "unused.npz"))
+    shutil.copy(source_path, replica_path)
+
+    replica = ensure_db(replica_path)
+    baseline = init_replica(replica)
+    upsert_bars(source, "MNQ", "5m", [REVISED])
+    source.commit()
+    batch = export_changes(source, str(tmp_path / "changes.npz"), since=baseline.to_seq, peer="backtest")
+    assert batch.rows == 1
+    apply_changes(replica, str(tmp_path / "changes.npz"))
+    assert _bars(replica) == _bars(source)
+
+
+def test_first_export_includes_tables_created_before_registry(tmp_path):
+    source = ensure_db(str(tmp_path / "source.sqlite"))
+    replica = ensure_db(str(tmp_path / "replica.sqlite"))
+    # 早期版本建的表：没有触发器，也不在 bar_tables 里
+    source.execute(
+        "CREATE TABLE bars_MNQ_1m (ts_utc TEXT PRIMARY KEY, open REAL, high REAL, low REAL, close REAL, "
+        "volume INTEGER, vwap REAL, trade_count INTEGER)"
+    )
+    source.execute(
+        f"CREATE TABLE bars_MNQ_1m_bid_ask (ts_utc TEXT PRIMARY KEY, {', '.join(f'{c} REAL' for c in BAR_COLUMNS)})"
+    )
+    source.execute(
+        "INSERT INTO bars_MNQ_1m VALUES ('2024-01-08T15:00:00+00:00', 1.0, 2.0, 0.5, 1.5, 9, 1.2, 3)"
+    )
+    source.execute(
+        "INSERT INTO bars_MNQ_1m_bid_ask VALUES ('2024-01-08T15:00:00+00:00', 1.0, 2.0, 0.5, 1.5, 0, 0, 0)"
+    )
+    source.commit()
+
+    batch_path = str(tmp_path / "changes.npz")
+    first = export_changes(source, batch_path, peer="backtest")
+    assert first.tables == {"bars_MNQ_1m": 1, "bars_MNQ_1m_bid_ask": 1}
+    apply_changes(replica, batch_path)
+    assert _bars(replica, "1m") == _bars(source, "1m")
+
+    # 登记后旧表也挂上了变更触发器，之后的改写照常增量同步
+    upsert_bars(source, "MNQ", "1m", [dict(REVISED, ts_utc="2024-01-08T15:00:00+00:00", volume=19)])
+    source.commit()
+    second = export_changes(source, batch_path, peer="backtest")
+    assert second.tables == {"bars_MNQ_1m": 1}
@@ -0,0 +1,33 @@
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from ib_history.ticks import TickBatch, aggregate_ticks, iter_ticks, write_ticks
+
+
+def _trade(ts, price, size):
+    return SimpleNamespace(time=ts, price=price, size=size)
+
+
+def test_write_read_and_aggregate_across_partitions(tmp_path):
+    base = datetime(2024, 1, 1, 23, 59, 30, tzinfo=timezone.utc)
+    ticks = [_trade(base + timedelta(seconds=15 * i), 100.0 + i, 1 + i) for i in range(6)]
+    batch = TickBatch.from_ticks(ticks, "TRADES")
+    start, end = base, base + timedelta(minutes=2)
+    assert write_ticks(str(tmp_path), "MNQ", batch, start, end) == 6
+    assert len(list((tmp_path / "MNQ" / "TRADES").rglob("*.npz"))) == 2
+
+    chunks = list(iter_ticks(str(tmp_path), "MNQ", "TRADES", start, end))
+    assert [len(c) for c in chunks] == [2, 4]
+    bars = [b for b in aggregate_ticks(chunks, 60)]
+    ts = [int(t) for b in bars for t in b.ts]
+    minute = int(base.replace(second=0).timestamp())
+    assert ts == [minute, minute + 60]
+    second = bars[-1].values[-1]
+    assert second["open"] == 102.0 and second["close"] == 105.0
+    assert second["high"] == 105.0 and second["low"] == 102.0
+    assert second["volume"] == 3 + 4 + 5 + 6
+    assert second["trade_count"] == 4
+
+    # 重写同一区间会覆盖而不是追加
+    write_ticks(str(tmp_path), "MNQ", batch, start, end)
+    assert sum(len(c) for c in iter_ticks(str(tmp_path), "MNQ", "TRADES", start, end)) == 6
@@ -0,0 +1,97 @@
+from datetime import datetime
+
+import numpy as np
+
+from ib_history.config import default_config, merge_config
+from ib_history.fake_client import synthetic_bars
+from ib_history.storage import ensure_db, insert_bars
+from ib_history.timeframes import load_timeframes, parent_index
+
+
+def _insert(conn, bar, start, end):
+    insert_bars(conn, "MNQ", bar, synthetic_bars(1, bar, start, end))
+    conn.commit()
+
+
+def _brute_force(fine_ts, coarse_ts, fine_step, coarse_step):
+    out = []
+    for ts in fine_ts:
+        done = [j for j, c in enumerate(coarse_ts) if c + coarse_step <= ts + fine_step]
+        out.append(done[-1] if done else -1)
+    return out
+
+
+def test_parent_index_has_no_lookahead():
+    fine = np.arange(0, 3600, 180, dtype=np.int64)
+    coarse = np.array([0, 900, 1800, 2700], dtype=np.int64)
+    completed = parent_index(fine, coarse, 180, 900)
+    assert completed.tolist() == _brute_force(fine, coarse, 180, 900)
+    # 第 5 根 3m（12:00 收盘）时第一根 15m 才走完
+    assert completed[:6].tolist() == [-1, -1, -1, -1, 0, 0]
+    assert parent_index(fine, coarse, 180, 900, "containing")[:6].tolist() == [0, 0, 0, 0, 0, 1]
+
+
+def test_load_timeframes_caches_and_extends(tmp_path):
+    conn = ensure_db(str(tmp_path / "test.sqlite"))
+    cache_dir = str(tmp_path / "index")
+    for bar in ("3m", "15m", "1h"):
+        _insert(conn, bar, datetime(2024, 5, 6), datetime(2024, 5, 8))
+
+    first = load_timeframes(conn, "MNQ", ["1h", "3m", "15m"], cache_dir=cache_dir)
+    assert first.base == "3m"
+    assert first.index_rows_computed == {"15m": len(first.frames["3m"]), "1h": len(first.frames["3m"])}
+    again = load_timeframes(conn, "MNQ", ["3m", "15m", "1h"], cache_dir=cache_dir)
+    assert again.index_rows_computed == {"15m": 0, "1h": 0}
+
+    for bar in ("3m", "15m", "1h"):
+        _insert(conn, bar, datetime(2024, 5, 8), datetime(2024, 5, 9))
+    extended = load_timeframes(conn, "MNQ", ["3m", "15m", "1h"], cache_dir=cache_dir)
+    assert 0 < extended.index_rows_computed["1h"] < len(extended.frames["3m"]) // 2
+    rebuilt = load_timeframes(conn, "MNQ", ["3m", "15m", "1h"], cache_dir=str(tmp_path / "fresh"))
+    for bar in ("15m", "1h"):
+        assert np.array_equal(extended.parents[bar], rebuilt.parents[bar])
+        base, coarse = extended.frames["3m"].ts, extended.frames[bar].ts
+        step = 900 if bar == "15m" else 3600
+        assert extended.parents[bar].tolist() == _brute_force(base, coarse, 180, step)
+
+    # 加载子区间时下标换算到窗口内
+    window = load_timeframes(
+        conn,
+        "MNQ",
+        ["3m", "1h"],
+        start_utc="2024-05-07T12:00:00+00:00",
+        end_utc="2024-05-08T00:00:00+00:00",
+        cache_dir=cache_dir,
+    )
+    parent = window.parents["1h"]
+    assert parent[0] == -1 and parent[20] == 0
+    close = window.context("1h", "close")
+    assert close[20] == window.frames["1h"].values["close"][0]
+    assert np.isnan(close[0])
+    conn.close()
+
+
+def test_cache_is_keyed_by_database_path(tmp_path):
+    cache_dir = str(tmp_path / "index")
+    conns = [ensure_db(str(tmp_path / name / "ib_history.sqlite")) for name in ("a", "b")]
+    _insert(conns[0], "15m", datetime(2024, 5, 6), datetime(2024, 5, 8))
+    _insert(conns[0], "1h", datetime(2024, 5, 6), datetime(2024, 5, 8))
+    # 另一目录下的同名库数据不同，各自完整计算映射
+    _insert(conns[1], "15m", datetime(2024, 5, 7), datetime(2024, 5, 8))
+    _insert(conns[1], "1h", datetime(2024, 5, 7), datetime(2024, 5, 8))
+
+    loaded = [load_timeframes(conn, "MNQ", ["15m", "1h"], cache_dir=cache_dir) for conn in conns]
+    for conn, frames in zip(conns, loaded):
+        assert frames.index_rows_computed == {"1h": len(frames.frames["15m"])}
+        conn.close()
+    assert len(list((tmp_path / "index").iterdir())) == 2
+
+
+def test_cache_dir_defaults_to_config(tmp_path):
+    conn = ensure_db(str(tmp_path / "test.sqlite"))
+    for bar in ("15m", "1h"):
+        _insert(conn, bar, datetime(2024, 5, 6), datetime(2024, 5, 8))
+    cfg = merge_config(default_config(), timeframe_cache_dir=str(tmp_path / "configured"))
+    load_timeframes(conn, "MNQ", ["15m", "1h"], config=cfg)
+    assert len(list((tmp_path / "configured").iterdir())) == 1
+    conn.close()
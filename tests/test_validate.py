@@ -0,0 +1,110 @@
+import calendar
+from datetime import datetime
+
+import numpy as np
+
+from ib_history.bars import BarBatch
+from ib_history.fake_client import FakeIBClient, synthetic_bars
+from ib_history.pacing import PacingLimiter
+from ib_history.sessions import expected_bars
+from ib_history.storage import ensure_db, insert_bars, log_failure
+from ib_history.validate import refetch_findings, validate_series
+
+_COLUMNS = ("open", "high", "low", "close", "volume", "vwap", "trade_count")
+
+
+def _dirty_db(db_path):
+    batch = synthetic_bars(1, "1m", datetime(2024, 5, 6), datetime(2024, 5, 11))
+    values = batch.values.copy()
+    values["high"][100] = values["low"][100] - 1
+    values["volume"][200] = 0
+    values["close"][300] *= 1.1
+    values["high"][300] = values["close"][300]
+    price = values["close"][999]
+    for col in ("open", "high", "low", "close"):
+        values[col][1000:1040] = price
+    keep = np.ones(len(batch), dtype=bool)
+    keep[500:510] = False
+    clean = BarBatch(ts=batch.ts[keep], values=values[keep])
+    rows = list(clean.to_records())
+    duplicate = dict(zip(_COLUMNS, next(r for r in rows if r[0] == "2024-05-07T00:00:00+00:00")[1:]))
+    last = dict(zip(_COLUMNS, rows[-1][1:]))
+    conn = ensure_db(db_path)
+    insert_bars(conn, "MNQ", "1m", clean)
+    insert_bars(
+        conn,
+        "MNQ",
+        "1m",
+        [
+            # 同一时刻的 UTC+7 写法
+            {"ts_utc": "2024-05-07T07:00:00+07:00", **duplicate},
+            # 周六不在交易时段
+            {"ts_utc": "2024-05-11T12:00:00+00:00", **last},
+        ],
+    )
+    conn.commit()
+    return conn
+
+
+def test_expected_bars_skips_daily_halt_and_weekend():
+    # 周五 20:59 UTC 是夏令时收盘前最后一根，周日 22:00 UTC 重新开盘
+    last = calendar.timegm((2024, 5, 10, 20, 59, 0))
+    assert expected_bars(last, calendar.timegm((2024, 5, 12, 23, 0, 0)), 60) == 60
+    assert expected_bars(last, calendar.timegm((2024, 5, 13, 23, 0, 0)), 60) == 24 * 60
+
+
+def test_validate_series_finds_injected_problems(tmp_path):
+    conn = _dirty_db(str(tmp_path / "test.sqlite"))
+    result = validate_series(conn, "MNQ", "1m")
+    assert result.counts == {
+        "ohlc": 1,
+        "zero_volume": 1,
+        "outlier_return": 2,
+        "gap": 1,
+        "stale": 1,
+        "off_session": 1,
+        "tz_duplicate": 1,
+    }
+    gap = conn.execute(
+        "SELECT start_utc, value FROM bar_findings WHERE check_name = 'gap'"
+    ).fetchone()
+    assert gap[1] == 10.0
+    stale = conn.execute("SELECT value FROM bar_findings WHERE check_name = 'stale'").fetchone()
+    # 区间从收盘价开始不变的第 999 根算起
+    assert stale[0] == 41.0
+
+    # 小块读取时跨块的平线区间与前一根收盘价都要延续
+    chunked = validate_series(conn, "MNQ", "1m", chunk_rows=333)
+    assert chunked.counts == result.counts
+    assert conn.execute("SELECT COUNT(*) FROM bar_findings").fetchone()[0] == 8
+    conn.close()
+
+
+def test_refetch_findings_repairs_series(tmp_path):
+    db_path = str(tmp_path / "test.sqlite")
+    conn = _dirty_db(db_path)
+    validate_series(conn, "MNQ", "1m")
+    conn.close()
+
+    report = refetch_findings(db_path=db_path, client=FakeIBClient(), pacer=PacingLimiter(min_interval=0))
+    assert report.success_count > 0
+    conn = ensure_db(db_path)
+    remaining = {row[0] for row in conn.execute("SELECT check_name FROM bar_findings")}
+    assert remaining == {"off_session", "tz_duplicate"}
+    result = validate_series(conn, "MNQ", "1m")
+    assert set(result.counts) == {"off_session", "tz_duplicate"}
+    conn.close()
+
+
+def test_validate_skips_gaps_ib_confirmed_empty(tmp_path):
+    conn = ensure_db(str(tmp_path / "test.sqlite"))
+    holiday = [(datetime(2024, 5, 8, 12), datetime(2024, 5, 8, 15))]
+    insert_bars(conn, "MNQ", "1m", synthetic_bars(1, "1m", datetime(2024, 5, 6), datetime(2024, 5, 10), holiday))
+    conn.commit()
+    assert validate_series(conn, "MNQ", "1m").counts.get("gap") == 1
+
+    log_failure(
+        conn, "MNQ", "1m", "2024-05-08T12:00:00", "2024-05-08T15:00:00", 1, "no_data", True, "2024-06-01T00:00:00"
+    )
+    assert "gap" not in validate_series(conn, "MNQ", "1m").counts
+    conn.close()